@@ -0,0 +1,129 @@
+"""Minimal in-process stand-ins for the discord.py objects EventsCog touches."""
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from outbound import OutboundQueue
+
+_ids = itertools.count(1_000_000)
+
+
+def next_id() -> int:
+  return next(_ids)
+
+
+class FakeTyping:
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    return False
+
+
+class FakeHistory:
+  def __init__(self, messages, latency: float = 0.0):
+    self._messages = iter(messages)
+    self._latency = latency
+
+  def __aiter__(self):
+    return self
+
+  async def __anext__(self):
+    if self._latency:
+      # 最初の1ページ分の往復時間だけ待つ
+      await asyncio.sleep(self._latency)
+      self._latency = 0.0
+    try:
+      return next(self._messages)
+    except StopIteration:
+      raise StopAsyncIteration
+
+
+class FakeChannel:
+  def __init__(self, guild, name: str, bot_user, on_send=None, history_latency: float = 0.0):
+    self.id = next_id()
+    self.guild = guild
+    self.name = name
+    self.bot_user = bot_user
+    self.on_send = on_send
+    self.history_latency = history_latency
+    self.messages = []
+    self.last_message_id = None
+
+  def typing(self):
+    return FakeTyping()
+
+  def history(self, limit=100):
+    return FakeHistory(list(reversed(self.messages[-limit:])), self.history_latency)
+
+  def record(self, message):
+    self.messages.append(message)
+    self.last_message_id = message.id
+
+  async def send(self, content=None, reference=None, **kwargs):
+    message = FakeMessage(self, self.bot_user, content or "", reference=reference)
+    self.record(message)
+    if self.on_send is not None:
+      self.on_send(message)
+    return message
+
+
+class FakeMessage:
+  def __init__(self, channel, author, content: str, reference=None, mentions=None):
+    self.id = next_id()
+    self.channel = channel
+    self.guild = channel.guild
+    self.author = author
+    self.content = content
+    self.created_at = datetime.now(timezone.utc)
+    self.attachments = []
+    self.reference = reference
+    self.mentions = mentions or []
+
+  async def reply(self, content=None, **kwargs):
+    return await self.channel.send(content, reference=SimpleNamespace(message_id=self.id, resolved=self))
+
+
+class FakeBot:
+  def __init__(self):
+    self.user = SimpleNamespace(id=next_id(), name="meowgent", nick=None, bot=True)
+    self.guilds = []
+    self.meowgent = None
+    self.outbound = OutboundQueue()
+
+  def get_channel(self, channel_id):
+    for guild in self.guilds:
+      for channel in guild.text_channels:
+        if channel.id == channel_id:
+          return channel
+    return None
+
+  async def wait_for(self, event, timeout=None, check=None):
+    # ベンチマークではリプライ待ちをせずにすぐタイムアウトさせる
+    raise asyncio.TimeoutError()
+
+
+def build_fake_gateway(
+  guild_count: int,
+  channels_per_guild: int,
+  users_per_guild: int,
+  on_send=None,
+  history_latency: float = 0.0,
+):
+  bot = FakeBot()
+  for guild_index in range(guild_count):
+    guild = SimpleNamespace(id=next_id(), name=f"guild-{guild_index}", text_channels=[], members=[])
+    guild.channels = guild.text_channels
+    for channel_index in range(channels_per_guild):
+      guild.text_channels.append(FakeChannel(
+        guild,
+        f"channel-{channel_index}",
+        bot.user,
+        on_send=on_send,
+        history_latency=history_latency,
+      ))
+    for user_index in range(users_per_guild):
+      guild.members.append(SimpleNamespace(id=next_id(), name=f"user-{guild_index}-{user_index}", nick=None, bot=False))
+    bot.guilds.append(guild)
+  return bot
@@ -0,0 +1,112 @@
+"""Memory benchmark for the stored conversation history.
+
+  uv run python benchmarks/memory_benchmark.py --channels 1000 --messages-per-channel 10
+
+Fills ShortTermMemory and the legacy per-channel history with synthetic
+messages and reports the bytes per stored message measured with tracemalloc,
+for the current ConversationMessage and for the previous layout (a plain
+dataclass that builds a new LLM dict for every call).
+"""
+import argparse
+import json
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from cogs.events_cog import ConversationMessage, EventsCog, ShortTermMemory
+
+
+@dataclass
+class LegacyConversationMessage:
+  message_id: int
+  channel_id: int
+  author_id: int
+  author_name: str
+  role: str
+  content: Any
+  created_at: Any
+
+  def to_llm_message(self) -> dict[str, Any]:
+    return {
+      "role": self.role,
+      "content": self.content,
+    }
+
+
+def build_cog() -> EventsCog:
+  cog = EventsCog.__new__(EventsCog)
+  cog.bot = SimpleNamespace(user=SimpleNamespace(id=0))
+  cog.short_term_memory = ShortTermMemory(EventsCog.MAX_HISTORY_LENGTH)
+  cog.channel_message_history = {}
+  return cog
+
+
+def fill(cog: EventsCog, message_type, args) -> int:
+  started = datetime(2026, 6, 5, tzinfo=timezone.utc)
+  message_id = 0
+  for channel_id in range(args.channels):
+    for index in range(args.messages_per_channel):
+      message_id += 1
+      author_id = (channel_id + index) % args.users
+      # Discordのペイロードから作られる名前やロールは、メッセージごとに別の文字列になる
+      name = f"user{author_id}".encode().decode()
+      role = ("user" if index % 3 else "assistant").encode().decode()
+      cog.short_term_memory.add(message_type(
+        message_id=message_id,
+        channel_id=channel_id,
+        author_id=author_id,
+        author_name=name,
+        role=role,
+        content=f"{name}:{author_id} " + "にゃ" * (index % 20 + 5),
+        created_at=started + timedelta(seconds=message_id),
+      ))
+      cog.sync_legacy_history(channel_id)
+  return sum(len(messages) for messages in cog.short_term_memory._messages_by_channel.values())
+
+
+def measure(message_type, args) -> dict[str, float]:
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  cog = build_cog()
+  stored = fill(cog, message_type, args)
+  used = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+  del cog
+  return {
+    "stored_messages": stored,
+    "bytes_per_message": round(used / max(1, stored), 1),
+  }
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--channels", type=int, default=1000)
+  parser.add_argument("--messages-per-channel", type=int, default=EventsCog.MAX_HISTORY_LENGTH)
+  parser.add_argument("--users", type=int, default=50)
+  parser.add_argument("--json", action="store_true", help="Print the result as JSON.")
+  args = parser.parse_args(argv)
+
+  before = measure(LegacyConversationMessage, args)
+  after = measure(ConversationMessage, args)
+  result = {
+    "before": before,
+    "after": after,
+    "saved_ratio": round(1 - after["bytes_per_message"] / max(1.0, before["bytes_per_message"]), 3),
+  }
+  if args.json:
+    print(json.dumps(result, indent=2))
+    return
+  print(f"stored messages:   {after['stored_messages']}")
+  print(f"before (bytes/msg): {before['bytes_per_message']}")
+  print(f"after  (bytes/msg): {after['bytes_per_message']}")
+  print(f"saved:             {result['saved_ratio']:.1%}")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,130 @@
+"""Local OpenAI-compatible chat completions server for offline benchmarks."""
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from aiohttp import web
+
+
+@dataclass
+class MockServerConfig:
+  latency_ms: float = 200.0
+  tokens_per_second: float = 50.0
+  completion_tokens: int = 40
+  tool_call_rate: float = 0.0
+  tool_name: str = "get_current_time"
+  tool_arguments: str = '{"timezone_name": "Asia/Tokyo"}'
+  seed: int = 0
+
+
+class MockOpenAIServer:
+  def __init__(self, config: MockServerConfig, host: str = "127.0.0.1", port: int = 0):
+    self.config = config
+    self.host = host
+    self.port = port
+    self.requests = 0
+    self.tool_calls = 0
+    self._random = random.Random(config.seed)
+    self._runner = None
+
+  @property
+  def base_url(self) -> str:
+    return f"http://{self.host}:{self.port}/v1"
+
+  async def start(self):
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", self.handle_chat_completions)
+    self._runner = web.AppRunner(app, access_log=None)
+    await self._runner.setup()
+    site = web.TCPSite(self._runner, self.host, self.port)
+    await site.start()
+    self.port = site._server.sockets[0].getsockname()[1]
+
+  async def stop(self):
+    if self._runner is not None:
+      await self._runner.cleanup()
+      self._runner = None
+
+  async def handle_chat_completions(self, request: web.Request) -> web.Response:
+    body = await request.json()
+    self.requests += 1
+    messages = body.get("messages", [])
+    prompt_tokens = sum(len(json.dumps(message, ensure_ascii=False)) for message in messages) // 4
+
+    wants_tool = (
+      body.get("tools")
+      and body.get("tool_choice") != "none"
+      and messages
+      and messages[-1].get("role") != "tool"
+      and self._random.random() < self.config.tool_call_rate
+    )
+    completion_tokens = 10 if wants_tool else self.config.completion_tokens
+    delay = self.config.latency_ms / 1000
+    if self.config.tokens_per_second > 0:
+      delay += completion_tokens / self.config.tokens_per_second
+    await asyncio.sleep(delay)
+
+    if wants_tool:
+      self.tool_calls += 1
+      message = {
+        "role": "assistant",
+        "content": None,
+        "tool_calls": [{
+          "id": f"call_{uuid.uuid4().hex[:12]}",
+          "type": "function",
+          "function": {"name": self.config.tool_name, "arguments": self.config.tool_arguments},
+        }],
+      }
+      finish_reason = "tool_calls"
+    else:
+      message = {"role": "assistant", "content": "にゃ " * completion_tokens}
+      finish_reason = "stop"
+
+    return web.json_response({
+      "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+      "object": "chat.completion",
+      "created": int(time.time()),
+      "model": body.get("model") or "mock",
+      "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+      "usage": {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+      },
+    })
+
+
+async def serve_forever(config: MockServerConfig, host: str, port: int):
+  server = MockOpenAIServer(config, host=host, port=port)
+  await server.start()
+  print(f"Mock OpenAI server listening on {server.base_url}")
+  try:
+    await asyncio.Event().wait()
+  finally:
+    await server.stop()
+
+
+if __name__ == "__main__":
+  import argparse
+
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--host", default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8808)
+  parser.add_argument("--latency-ms", type=float, default=200.0)
+  parser.add_argument("--tokens-per-second", type=float, default=50.0)
+  parser.add_argument("--completion-tokens", type=int, default=40)
+  parser.add_argument("--tool-call-rate", type=float, default=0.0)
+  args = parser.parse_args()
+  asyncio.run(serve_forever(
+    MockServerConfig(
+      latency_ms=args.latency_ms,
+      tokens_per_second=args.tokens_per_second,
+      completion_tokens=args.completion_tokens,
+      tool_call_rate=args.tool_call_rate,
+    ),
+    args.host,
+    args.port,
+  ))
@@ -0,0 +1,307 @@
+"""End-to-end offline benchmark for EventsCog + Meowgent + OpenAICompatibleChatProvider.
+
+Replays synthetic multi-guild traffic through EventsCog.on_message against a
+local mock chat completions server, then reports throughput, reply latency
+percentiles, event loop lag and memory per channel.
+
+  uv run python benchmarks/run_benchmark.py --guilds 4 --messages 500
+
+With --processes N the guilds are split into N shard groups that run in
+separate processes (each with its own mock server), like src/launcher.py
+does in production, and the results are merged.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from multiprocessing import get_context
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_discord import FakeMessage, build_fake_gateway
+from mock_openai_server import MockOpenAIServer, MockServerConfig
+
+
+@dataclass
+class BenchmarkResult:
+  processes: int = 1
+  messages: int = 0
+  replies: int = 0
+  provider_requests: int = 0
+  tool_calls: int = 0
+  elapsed_seconds: float = 0.0
+  throughput_messages_per_second: float = 0.0
+  throughput_replies_per_second: float = 0.0
+  reply_latency_ms: dict[str, float] = field(default_factory=dict)
+  event_loop_lag_ms: dict[str, float] = field(default_factory=dict)
+  channels: int = 0
+  stored_messages: int = 0
+  memory_bytes_per_channel: float = 0.0
+  memory_bytes_per_message: float = 0.0
+
+
+def percentile(values: list[float], ratio: float) -> float:
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  index = min(len(ordered) - 1, max(0, round(ratio * (len(ordered) - 1))))
+  return ordered[index]
+
+
+def summarize(values: list[float]) -> dict[str, float]:
+  return {
+    "p50": round(percentile(values, 0.50) * 1000, 2),
+    "p95": round(percentile(values, 0.95) * 1000, 2),
+    "p99": round(percentile(values, 0.99) * 1000, 2),
+    "max": round(max(values, default=0.0) * 1000, 2),
+  }
+
+
+def deep_sizeof(obj, seen=None) -> int:
+  seen = set() if seen is None else seen
+  if id(obj) in seen:
+    return 0
+  seen.add(id(obj))
+  size = sys.getsizeof(obj)
+  if isinstance(obj, dict):
+    size += sum(deep_sizeof(key, seen) + deep_sizeof(value, seen) for key, value in obj.items())
+  elif isinstance(obj, (list, tuple, set, frozenset)):
+    size += sum(deep_sizeof(item, seen) for item in obj)
+  elif hasattr(obj, "__dict__"):
+    size += deep_sizeof(vars(obj), seen)
+  elif hasattr(obj, "__slots__"):
+    size += sum(
+      deep_sizeof(getattr(obj, slot), seen)
+      for cls in type(obj).__mro__
+      for slot in getattr(cls, "__slots__", ())
+      if hasattr(obj, slot)
+    )
+  return size
+
+
+async def sample_loop_lag(samples: list[float], stop: asyncio.Event, interval: float = 0.01):
+  loop = asyncio.get_running_loop()
+  while not stop.is_set():
+    started = loop.time()
+    await asyncio.sleep(interval)
+    samples.append(max(0.0, loop.time() - started - interval))
+
+
+def build_runtime(bot, base_url: str, max_tokens: int, cassette_mode=None, cassette_path=None, replay_speed=None):
+  from cassette import wrap_provider
+  from llm import OpenAICompatibleChatProvider
+  from meowgent import Meowgent
+  from tools.get_current_time import GET_CURRENT_TIME_TOOL
+
+  provider = OpenAICompatibleChatProvider(
+    model="mock",
+    api_key="benchmark",
+    base_url=base_url,
+    max_tokens=max_tokens,
+  )
+  tools = [GET_CURRENT_TIME_TOOL]
+  bot.meowgent = Meowgent(
+    provider=wrap_provider(provider, cassette_mode, cassette_path, speed=replay_speed),
+    tools=tools,
+    system_prompt="benchmark",
+  )
+  return provider
+
+
+async def run_benchmark(args, samples: dict[str, list[float]] | None = None) -> BenchmarkResult:
+  from cogs.events_cog import EventsCog
+
+  if args.trace:
+    from tracing import configure_tracing
+    configure_tracing(args.trace, args.trace_sample_rate)
+
+  rng = random.Random(args.seed)
+  random.seed(args.seed)
+
+  server = MockOpenAIServer(MockServerConfig(
+    latency_ms=args.latency_ms,
+    tokens_per_second=args.tokens_per_second,
+    completion_tokens=args.completion_tokens,
+    tool_call_rate=args.tool_call_rate,
+    seed=args.seed,
+  ))
+  await server.start()
+
+  result = BenchmarkResult()
+  sends = []
+  bot = build_fake_gateway(
+    args.guilds,
+    args.channels_per_guild,
+    args.users_per_guild,
+    on_send=sends.append,
+    history_latency=args.history_latency_ms / 1000,
+  )
+  cassette_mode = "record" if args.record else "replay" if args.replay else None
+  provider = build_runtime(
+    bot,
+    server.base_url,
+    args.completion_tokens,
+    cassette_mode=cassette_mode,
+    cassette_path=args.record or args.replay,
+    replay_speed=args.replay_speed,
+  )
+  cog = EventsCog(bot)
+
+  latencies: list[float] = []
+  lag_samples: list[float] = []
+  stop = asyncio.Event()
+  lag_task = asyncio.create_task(sample_loop_lag(lag_samples, stop))
+
+  channels = [channel for guild in bot.guilds for channel in guild.text_channels]
+  bot_mention = f"<@{bot.user.id}>"
+
+  async def dispatch(message):
+    sends_before = len(sends)
+    started = time.perf_counter()
+    await cog.on_message(message)
+    if len(sends) > sends_before:
+      latencies.append(time.perf_counter() - started)
+
+  tasks = []
+  started = time.perf_counter()
+  for index in range(args.messages):
+    channel = rng.choice(channels)
+    author = rng.choice(channel.guild.members)
+    mentioned = rng.random() < args.mention_ratio
+    content = f"{bot_mention} message {index}" if mentioned else f"message {index}"
+    message = FakeMessage(channel, author, content, mentions=[bot.user] if mentioned else [])
+    channel.record(message)
+    tasks.append(asyncio.create_task(dispatch(message)))
+    if args.rate > 0:
+      await asyncio.sleep(rng.expovariate(args.rate))
+  await asyncio.gather(*tasks)
+  result.elapsed_seconds = time.perf_counter() - started
+
+  stop.set()
+  await lag_task
+  await provider.client.close()
+  await server.stop()
+  if args.trace:
+    from tracing import TRACER
+    TRACER.exporter.close()
+
+  stored = cog.short_term_memory._messages_by_channel
+  result.messages = args.messages
+  result.replies = len(latencies)
+  if args.replay:
+    result.provider_requests = bot.meowgent.provider.stats.calls
+  else:
+    result.provider_requests = server.requests
+    result.tool_calls = server.tool_calls
+  result.throughput_messages_per_second = round(result.messages / result.elapsed_seconds, 2)
+  result.throughput_replies_per_second = round(result.replies / result.elapsed_seconds, 2)
+  result.reply_latency_ms = summarize(latencies)
+  result.event_loop_lag_ms = summarize(lag_samples)
+  result.channels = len(stored)
+  result.stored_messages = sum(len(messages) for messages in stored.values())
+  # 旧形式の履歴 (channel_message_history) も含めて数える。共有している辞書は1回だけ数えられる
+  memory_bytes = deep_sizeof((stored, cog.channel_message_history))
+  result.memory_bytes_per_channel = round(memory_bytes / max(1, result.channels), 1)
+  result.memory_bytes_per_message = round(memory_bytes / max(1, result.stored_messages), 1)
+  result.elapsed_seconds = round(result.elapsed_seconds, 3)
+  if samples is not None:
+    samples["latencies"] = latencies
+    samples["lag"] = lag_samples
+  return result
+
+
+def run_partition(args, index: int) -> tuple[dict, dict[str, list[float]]]:
+  """1プロセス分 (シャードグループ1つ分) のギルドとメッセージを処理する"""
+  partition = argparse.Namespace(**vars(args))
+  partition.guilds = max(1, args.guilds // args.processes)
+  partition.messages = args.messages // args.processes + (1 if index < args.messages % args.processes else 0)
+  partition.rate = args.rate / args.processes
+  partition.seed = args.seed + index
+  partition.trace = f"{args.trace}.{index}" if args.trace else None
+  samples: dict[str, list[float]] = {}
+  from loop_monitor import install_event_loop
+  install_event_loop(args.event_loop)
+  result = asyncio.run(run_benchmark(partition, samples))
+  return asdict(result), samples
+
+
+def run_processes(args) -> BenchmarkResult:
+  with ProcessPoolExecutor(args.processes, mp_context=get_context("spawn")) as pool:
+    outputs = list(pool.map(run_partition, [args] * args.processes, range(args.processes)))
+
+  result = BenchmarkResult(processes=args.processes)
+  latencies: list[float] = []
+  lag_samples: list[float] = []
+  memory_bytes = 0.0
+  for partition, samples in outputs:
+    result.messages += partition["messages"]
+    result.replies += partition["replies"]
+    result.provider_requests += partition["provider_requests"]
+    result.tool_calls += partition["tool_calls"]
+    result.channels += partition["channels"]
+    result.stored_messages += partition["stored_messages"]
+    result.elapsed_seconds = max(result.elapsed_seconds, partition["elapsed_seconds"])
+    memory_bytes += partition["memory_bytes_per_channel"] * partition["channels"]
+    latencies.extend(samples["latencies"])
+    lag_samples.extend(samples["lag"])
+
+  result.throughput_messages_per_second = round(result.messages / result.elapsed_seconds, 2)
+  result.throughput_replies_per_second = round(result.replies / result.elapsed_seconds, 2)
+  result.reply_latency_ms = summarize(latencies)
+  result.event_loop_lag_ms = summarize(lag_samples)
+  result.memory_bytes_per_channel = round(memory_bytes / max(1, result.channels), 1)
+  result.memory_bytes_per_message = round(memory_bytes / max(1, result.stored_messages), 1)
+  return result
+
+
+def build_parser() -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--guilds", type=int, default=4)
+  parser.add_argument("--channels-per-guild", type=int, default=5)
+  parser.add_argument("--users-per-guild", type=int, default=20)
+  parser.add_argument("--messages", type=int, default=500)
+  parser.add_argument("--rate", type=float, default=100.0, help="Incoming messages per second (0 = all at once).")
+  parser.add_argument("--mention-ratio", type=float, default=0.3)
+  parser.add_argument("--latency-ms", type=float, default=200.0, help="Mock provider base latency.")
+  parser.add_argument("--tokens-per-second", type=float, default=200.0)
+  parser.add_argument("--completion-tokens", type=int, default=40)
+  parser.add_argument("--tool-call-rate", type=float, default=0.1)
+  parser.add_argument("--history-latency-ms", type=float, default=50.0, help="Simulated channel.history round trip.")
+  parser.add_argument("--seed", type=int, default=1)
+  parser.add_argument("--record", metavar="PATH", help="Record provider traffic to a cassette file.")
+  parser.add_argument("--replay", metavar="PATH", help="Replay provider traffic from a cassette file instead of the mock server.")
+  parser.add_argument("--replay-speed", type=float, default=None, help="1.0 = recorded latency, 0 = no delay.")
+  parser.add_argument("--trace", metavar="PATH", help="Write sampled reply spans as a Chrome trace file.")
+  parser.add_argument("--trace-sample-rate", type=float, default=1.0)
+  parser.add_argument("--event-loop", choices=("asyncio", "uvloop"), default="asyncio", help="uvloop falls back to asyncio when not installed.")
+  parser.add_argument("--processes", type=int, default=1, help="Split guilds into N shard groups, one process each.")
+  parser.add_argument("--json", action="store_true", help="Print the result as JSON.")
+  return parser
+
+
+def main(argv=None):
+  parser = build_parser()
+  args = parser.parse_args(argv)
+  from loop_monitor import install_event_loop
+  install_event_loop(args.event_loop)
+  if args.processes > 1:
+    if args.record or args.replay:
+      parser.error("--record/--replay can only be used with a single process")
+    result = run_processes(args)
+  else:
+    result = asyncio.run(run_benchmark(args))
+  if args.json:
+    print(json.dumps(asdict(result), ensure_ascii=False, indent=2))
+    return
+  for key, value in asdict(result).items():
+    print(f"{key:32} {value}")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,151 +1,168 @@
+import time
+
+STARTED_AT = time.monotonic()  # 起動から最初の返信までの時間を測るため、なるべく早く記録する
+
+import asyncio
+import hashlib
+import importlib
+import json
+import signal
 from datetime import datetime, timedelta
-from logging import basicConfig, getLogger, INFO
+from logging import getLogger
+from pathlib import Path
 
 import discord
 from discord.ext import commands
 
-from config import load_config
-from llm import OpenAICompatibleChatProvider, ToolDefinition
-from tools.get_current_time import get_current_time
+from cassette import wrap_provider
+from config import add_reload_listener, get_config, install_reload_triggers
+from llm import OpenAICompatibleChatProvider
+from logging_setup import setup_logging
+from loop_monitor import LoopMonitor, install_event_loop
+from metrics import (
+  STAMINA,
+  mark_startup_phase,
+  sample_event_loop_lag,
+  set_startup_origin,
+  start_metrics_server,
+)
+from outbound import OutboundQueue, PRIORITY_NOTIFICATION
+from state_snapshot import load_snapshot, save_snapshot
+from tools.registry import ToolRegistry
 from tools.task_manager import TaskManager
-from tools.web_search import web_search
+from tracing import TRACER, configure_tracing
 
-basicConfig(level=INFO)
+set_startup_origin(STARTED_AT)
+config = get_config()
+setup_logging(config.logging.level, config.logging.format, config.logging.max_length)
 logger = getLogger(__name__)
-
-config = load_config()
+configure_tracing(config.sharding.partition_path(config.tracing.path), config.tracing.sample_rate)
 
 intents = discord.Intents.default()
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='!?!!?', intents=intents)
+# シャードごとにゲートウェイ接続を分ける。launcher.py から複数プロセスで起動するとシャードグループごとに別プロセスになる
+BotBase = commands.AutoShardedBot if config.sharding.enabled else commands.Bot
+
+
+class MeowgentBot(BotBase):
+  async def close(self):
+    # 切断する前に生成中の返信を待ち、記憶などを保存する
+    if not getattr(self, "shutting_down", False):
+      self.shutting_down = True
+      try:
+        await shutdown()
+      except Exception:
+        logger.exception("Graceful shutdown failed")
+    await super().close()
+
+
+if config.sharding.enabled:
+  bot = MeowgentBot(
+    command_prefix='!?!!?',
+    intents=intents,
+    shard_count=config.sharding.shard_count,
+    shard_ids=config.sharding.shard_ids,
+  )
+else:
+  bot = MeowgentBot(command_prefix='!?!!?', intents=intents)
 bot.meowgent = None
+bot.task_manager = None
+bot.restored_state = None
+bot.close_task = None
+bot.outbound = OutboundQueue()
 
 appId = None
 
+# ゲートウェイ接続中に別スレッドで読み込んでおく重いモジュール
+WARM_IMPORTS = ("openai", "apscheduler.schedulers.asyncio", "meowgent")
+
+
+def warm_imports():
+  for module_name in WARM_IMPORTS:
+    try:
+      importlib.import_module(module_name)
+    except ImportError:
+      logger.warning("Failed to preload %s", module_name)
+
+
 @bot.event
 async def on_ready():
-  logger.info(f"Bot is ready. Logged in as {bot.user}")
+  logger.info(f"Bot is ready. Logged in as {bot.user} (shards: {bot.shard_ids or 'all'})")
+  mark_startup_phase("ready")
+
+  # on_readyは再接続のたびに呼ばれるので、ランタイムの組み立ては初回だけ
+  if bot.meowgent is not None:
+    logger.info("Reconnected. Reusing the existing Meowgent runtime.")
+    return
 
   from meowgent import Meowgent
 
   # load llm
-  provider = OpenAICompatibleChatProvider(
-    model=config.openai.model,
-    api_key=config.openai.api_key,
-    base_url=config.openai.api_url,
-    max_tokens=config.openai.max_tokens,
-    temperature=config.openai.temperature
+  provider = OpenAICompatibleChatProvider(**config.openai.provider_settings())
+  provider = wrap_provider(
+    provider,
+    config.llm_cassette.mode,
+    config.sharding.partition_path(config.llm_cassette.path),
+    speed=config.llm_cassette.speed,
   )
 
   # Task Manager
+  # 予約はメモリ上のジョブストアに持ち、終了時のスナップショット (プロセスごとに別ファイル) で引き継ぐ
   task_manager = TaskManager()
-  async def task(channel_id: int, prompt: str):
-    try:
+  async def run_scheduled_prompts(channel_id: int, prompts: list[str]):
+    """同じチャンネルに同時に届いた予約プロンプトを1回のエージェント実行で処理する"""
+    if len(prompts) == 1:
+      content = prompts[0]
+    else:
+      numbered_prompts = "\n".join(f"{index}. {prompt}" for index, prompt in enumerate(prompts, start=1))
+      content = f"Run the following scheduled tasks together and reply in one message:\n{numbered_prompts}"
+
+    with TRACER.span("scheduler.run", root=True, channel_id=channel_id, prompts=len(prompts)):
       final_state = await bot.meowgent.app.ainvoke(
         {
-          "messages": [{"role": "user", "content": prompt}],
+          "messages": [{"role": "user", "content": content}],
           "current_channel_id": channel_id
         },
 
         config={"configurable": {"thread_id": channel_id, "recursion_limit": 5}}
       )
       message = final_state['messages'][-1]
-      await bot.get_channel(channel_id).send(f"{message.content}")
-    except Exception as e:
-      logger.error(f"error: {e}")
-
-  def create_task(channel_id: int, prompt: str, minutes_later: int):
-    """
-    Schedule a new task to run after a specified time.
-
-    Args:
-        channel_id (int): Discord channel ID where the task will run.
-        prompt (str): Content to execute as the task after the specified delay.
-        minutes_later (int): Minutes from now when the task will execute.
-
-    Example:
-        create_task(1234567890, "Check server status", 10)  # Executes 10 minutes later
-    """
+      with TRACER.span("discord.send"):
+        await bot.outbound.send(bot.get_channel(channel_id), f"{message.content}", priority=PRIORITY_NOTIFICATION)
+    return final_state.get("usage")
 
-    try:
-      # 現在時刻から指定された分だけ後の時刻を計算
-      scheduled_time = datetime.now() + timedelta(minutes=minutes_later)
-
-      # タスクをスケジュール
-      task_manager.add_task(task, scheduled_time, [channel_id, prompt])
-      return f"Successfully scheduled.: {scheduled_time.isoformat()}."
-    except Exception as e:
-      return f"Error: {str(e)}"
-
-  # tools settings
-  tools = [
-    ToolDefinition(
-      name="web_search",
-      description="Search the web for the given query.",
-      parameters={
-        "type": "object",
-        "properties": {
-          "query": {
-            "type": "string",
-            "description": "Search query.",
-          },
-        },
-        "required": ["query"],
-      },
-      handler=web_search,
-    ),
-    ToolDefinition(
-      name="create_task",
-      description="Schedule a task to run after the specified number of minutes.",
-      parameters={
-        "type": "object",
-        "properties": {
-          "channel_id": {
-            "type": "integer",
-            "description": "Discord channel ID where the task will run.",
-          },
-          "prompt": {
-            "type": "string",
-            "description": "Prompt to run as the scheduled task.",
-          },
-          "minutes_later": {
-            "type": "integer",
-            "description": "Minutes from now when the task will execute.",
-          },
-        },
-        "required": ["channel_id", "prompt", "minutes_later"],
-      },
-      handler=create_task,
-    ),
-    ToolDefinition(
-      name="get_current_time",
-      description="Get current time in the specified timezone.",
-      parameters={
-        "type": "object",
-        "properties": {
-          "timezone_name": {
-            "type": "string",
-            "description": "Timezone name, e.g. Asia/Tokyo.",
-          },
-        },
-        "required": ["timezone_name"],
-      },
-      handler=get_current_time,
-    ),
-  ]
+  task_manager.set_prompt_runner(run_scheduled_prompts)
 
-  # character settings
-  runtime_prompt = f"- Your Discord user ID is {bot.user.id}"
-  system_prompt = f"{runtime_prompt}\n\n{config.character_prompt}"
+  # tools settings: src/tools/ のモジュールから集める。読み込みとクライアントの準備は裏で進める
+  tools = ToolRegistry(context={"task_manager": task_manager}, select=config.tool_selection)
+  tools.start_warming()
 
   # Meowgent initialize
   bot.meowgent = Meowgent(
     provider=provider,
     tools=tools,
-    system_prompt=system_prompt
+    system_prompt=build_system_prompt(config),
+    clock_timezones=config.clock_timezones,
   )
 
+  if config.worker.enabled:
+    # LLMの処理はワーカープロセスに任せ、このプロセスのイベントループはDiscordとの接続に専念させる
+    from work_queue import RemoteMeowgentApp, WorkQueue, WorkQueueClient
+
+    work_queue = WorkQueue(
+      config.sharding.partition_path(config.worker.queue_path),
+      lease_seconds=config.worker.lease_seconds,
+      max_pending=config.worker.max_pending,
+    )
+    work_queue.purge_finished()
+    bot.meowgent.app = RemoteMeowgentApp(
+      bot.meowgent,
+      WorkQueueClient(work_queue),
+      timeout=work_queue.lease_seconds * work_queue.max_attempts + 30,
+    )
+    logger.info(f"Agent runs are handed to worker processes via {work_queue.path}")
+
   async def on_stamina_change(stamina: int, max_stamina: int):
     """スタミナ変更時に呼び出される処理"""
     logger.info(f"[EventsCog] Meowgent's stamina updated: {stamina}")
@@ -159,21 +176,150 @@ async def on_ready():
     bar = "█" * filled_length + "-" * (bar_length - filled_length)
     return f"[{bar}]"
 
+  STAMINA.set_function(lambda: bot.meowgent.stamina)
   bot.meowgent.add_stamina_listener(on_stamina_change)
   bot.meowgent.start_stamina_recovery(interval=360, recovery_amount=1) # 8時間で80くらい回復してほしい
 
   logger.info("Meowgent instance has been initialized.")
 
+  bot.task_manager = task_manager
+  restore_runtime_state()
   task_manager.start_scheduler()
+  mark_startup_phase("runtime")
+
+
+def restore_runtime_state():
+  """前回の終了時に保存したスタミナと予約タスクを戻す (会話の記憶は setup_hook で戻している)"""
+  state = bot.restored_state
+  if not state:
+    return
+  if state.get("stamina") is not None:
+    bot.meowgent.stamina = max(0, min(bot.meowgent.max_stamina, state["stamina"]))
+  restored = bot.task_manager.restore(state.get("tasks", []))
+  logger.info(f"Restored stamina {bot.meowgent.stamina} and {restored} scheduled tasks")
+  bot.restored_state = None
+
+
+async def shutdown():
+  """Stop taking new work, let in-flight replies finish within the deadline, then snapshot state to disk."""
+  deadline = config.shutdown.drain_seconds
+  started = time.monotonic()
+  logger.info(f"Shutting down. Waiting up to {deadline}s for in-flight replies.")
+  events_cog = bot.get_cog("EventsCog")
+  drains = []
+  if events_cog is not None:
+    drains.append(events_cog.drain(deadline))
+  if bot.task_manager is not None:
+    drains.append(bot.task_manager.shutdown(deadline))
+  await asyncio.gather(*drains)
+  if bot.meowgent is not None:
+    bot.meowgent.stop_stamina_recovery()
+    await bot.meowgent.tools.close()
+  # キューに残っているスパンを書き出してからファイルを閉じる
+  await asyncio.to_thread(TRACER.close)
+
+  state = {}
+  if events_cog is not None:
+    state["memory"] = events_cog.short_term_memory.snapshot()
+  if bot.meowgent is not None:
+    state["stamina"] = bot.meowgent.stamina
+  if bot.task_manager is not None:
+    state["tasks"] = bot.task_manager.snapshot()
+  elif bot.restored_state:
+    # ランタイムを組み立てる前に止まった場合は、読み込んだ予約をそのまま書き戻す
+    state["tasks"] = bot.restored_state.get("tasks", [])
+    state["stamina"] = bot.restored_state.get("stamina")
+  save_snapshot(config.sharding.partition_path(config.shutdown.snapshot_path), state)
+  logger.info(f"Shutdown finished in {time.monotonic() - started:.1f}s")
+
+
+def build_system_prompt(app_config) -> str:
+  # character settings
+  runtime_prompt = f"- Your Discord user ID is {bot.user.id}"
+  return f"{runtime_prompt}\n\n{app_config.character_prompt}"
+
+
+def apply_config(old_config, new_config):
+  """再読み込みした設定のうち、再起動しなくても変えられるものを反映する"""
+  global config
+  config = new_config
+  if bot.meowgent is None:
+    return
+  # 録画中のプロバイダは中身に転送する。再生中は設定を使わないので何もしない
+  if hasattr(bot.meowgent.provider, "configure"):
+    bot.meowgent.provider.configure(**new_config.openai.provider_settings())
+  bot.meowgent.system_prompt = build_system_prompt(new_config)
+  bot.meowgent.clock_timezones = tuple(new_config.clock_timezones)
+  bot.meowgent.tools.select_tools = new_config.tool_selection
+  logger.info(f"Applied reloaded config (model: {new_config.openai.model})")
+
+
+async def sync_command_tree():
+  """アプリコマンドの定義が前回同期したときから変わった場合だけ同期する"""
+  commands_payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+  digest = hashlib.sha256(
+    json.dumps([bot.application_id, commands_payload], sort_keys=True, default=str).encode("utf-8")
+  ).hexdigest()
+  state_path = Path(config.command_sync_state_path)
+  try:
+    if state_path.read_text().strip() == digest:
+      logger.info("Command tree is unchanged. Skipping sync.")
+      return
+  except OSError:
+    pass
+
+  await bot.tree.sync()
+  try:
+    state_path.write_text(digest)
+  except OSError:
+    logger.warning(f"Failed to write command sync state to {state_path}")
+  logger.info("Command tree has been synced.")
 
 
 @bot.event
 async def setup_hook():
+  bot.warm_imports_task = asyncio.create_task(asyncio.to_thread(warm_imports))
+
+  # SIGHUP か .env の変更で設定を読み直す
+  add_reload_listener(apply_config)
+  bot.config_watch_task = install_reload_triggers(asyncio.get_running_loop())
+
   # Cogロード
   await bot.load_extension("cogs.proposal_cog")
   await bot.load_extension("cogs.events_cog")
 
-  # コマンド反映
-  await bot.tree.sync()
+  # 前回の終了時に保存した会話の記憶を戻す。スタミナと予約タスクはランタイムを作ったあと on_ready で戻す
+  bot.restored_state = load_snapshot(config.sharding.partition_path(config.shutdown.snapshot_path))
+  if bot.restored_state and bot.restored_state.get("memory"):
+    bot.get_cog("EventsCog").short_term_memory.restore(bot.restored_state["memory"])
+
+  # SIGTERM (デプロイ時など) でも終了処理を通す
+  def close_on_sigterm():
+    # タスクを持っておかないと終了処理の途中でGCに回収されることがある
+    if bot.close_task is None:
+      bot.close_task = asyncio.create_task(bot.close())
+
+  loop = asyncio.get_running_loop()
+  try:
+    loop.add_signal_handler(signal.SIGTERM, close_on_sigterm)
+  except (NotImplementedError, RuntimeError):
+    pass
+
+  # コマンド反映 (アプリ全体で共通なので、複数プロセスのときは最初のグループだけ)
+  if config.sharding.group == 0:
+    await sync_command_tree()
+  mark_startup_phase("setup_hook")
+
+  # イベントループの監視 (遅延のメトリクスも兼ねる)
+  if config.event_loop.monitor_enabled:
+    bot.loop_monitor = LoopMonitor(threshold=config.event_loop.stall_threshold_ms / 1000).start()
+
+  # メトリクス
+  if config.metrics.enabled:
+    bot.metrics_runner = await start_metrics_server(config.metrics.host, config.metrics.port + config.sharding.group)
+    if not config.event_loop.monitor_enabled:
+      bot.loop_lag_task = asyncio.create_task(sample_event_loop_lag())
 
-bot.run(config.discord_token)
+install_event_loop(config.event_loop.name)
+# discord.py独自のハンドラは使わず、キュー経由のロガーに流す
+bot.run(config.discord_token, log_handler=None)
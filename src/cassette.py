@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import deque
+from dataclasses import dataclass
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Optional
+
+from llm import LLMMessage, LLMProvider, LLMResponse, ToolDefinition, to_llm_message
+from tools.get_current_time import CLOCK_CONTEXT_PREFIX
+
+logger = getLogger(__name__)
+
+
+def _canonical(value: Any) -> str:
+  return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+
+
+def _digest(value: Any) -> str:
+  return hashlib.sha256(_canonical(value).encode("utf-8")).hexdigest()[:16]
+
+
+def normalize_request(
+  messages: list[LLMMessage | dict[str, Any]],
+  tools: Optional[list[ToolDefinition]] = None,
+  max_tokens: Optional[int] = None,
+  tool_choice: Optional[str | dict[str, Any]] = None,
+) -> dict[str, Any]:
+  """The parts of a provider request that identify it, in a JSON-friendly form.
+
+  Tool call IDs are random per run, so they are left out, and so is the
+  time in the clock system message.
+  """
+  normalized = []
+  for message in messages:
+    message = dict(to_llm_message(message).to_openai())
+    message.pop("tool_call_id", None)
+    content = message.get("content")
+    if message["role"] == "system" and isinstance(content, str) and content.startswith(CLOCK_CONTEXT_PREFIX):
+      message["content"] = CLOCK_CONTEXT_PREFIX
+    if message.get("tool_calls"):
+      message["tool_calls"] = [
+        {key: value for key, value in tool_call.items() if key != "id"}
+        for tool_call in message["tool_calls"]
+      ]
+    normalized.append(message)
+  return {
+    "messages": normalized,
+    "tools": [tool.name for tool in tools or []],
+    "max_tokens": max_tokens,
+    "tool_choice": tool_choice,
+  }
+
+
+def keys_for_request(request: dict[str, Any]) -> tuple[str, str]:
+  """Return (exact, loose) keys for a request from normalize_request().
+
+  The loose key only looks at the shape of the conversation and is used
+  when time-dependent content (e.g. tool results) differs between runs.
+  """
+  messages = request["messages"]
+  rest = [request["tools"], request["max_tokens"], request["tool_choice"]]
+  exact = _digest([messages, *rest])
+  loose = _digest([[message["role"] for message in messages], *rest])
+  return exact, loose
+
+
+def request_keys(
+  messages: list[LLMMessage | dict[str, Any]],
+  tools: Optional[list[ToolDefinition]] = None,
+  max_tokens: Optional[int] = None,
+  tool_choice: Optional[str | dict[str, Any]] = None,
+) -> tuple[str, str]:
+  """Return (exact, loose) keys identifying a provider request."""
+  return keys_for_request(normalize_request(messages, tools, max_tokens, tool_choice))
+
+
+@dataclass
+class CassetteEntry:
+  key: str
+  loose_key: str
+  elapsed: float
+  content: Any
+  tool_calls: list[dict[str, Any]]
+  finish_reason: Optional[str]
+  usage: Optional[dict[str, int]] = None
+  message_count: int = 0
+  # 正規化したリクエスト。再生で外れたときの調査や、キーの付け直しに使う
+  request: Optional[dict[str, Any]] = None
+
+  def to_response(self) -> LLMResponse:
+    return LLMResponse(
+      content=self.content,
+      tool_calls=list(self.tool_calls),
+      finish_reason=self.finish_reason,
+      raw=None,
+      usage=self.usage,
+    )
+
+
+class RecordingProvider:
+  """Wrap a provider and append every request/response pair to a JSON Lines cassette."""
+
+  def __init__(self, provider: LLMProvider, path: str | Path):
+    self.provider = provider
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    # 書き込みはスレッドで行うので、呼ばれた順に1行ずつ書けるように
+    self._write_lock = asyncio.Lock()
+
+  def __getattr__(self, name):
+    return getattr(self.provider, name)
+
+  async def generate(
+    self,
+    messages: list[LLMMessage | dict[str, Any]],
+    tools: Optional[list[ToolDefinition]] = None,
+    max_tokens: Optional[int] = None,
+    tool_choice: Optional[str | dict[str, Any]] = None,
+  ) -> LLMResponse:
+    started = time.perf_counter()
+    response = await self.provider.generate(messages, tools, max_tokens=max_tokens, tool_choice=tool_choice)
+    elapsed = time.perf_counter() - started
+
+    request = normalize_request(messages, tools, max_tokens, tool_choice)
+    key, loose_key = keys_for_request(request)
+    record = {
+      "key": key,
+      "loose_key": loose_key,
+      "request": request,
+      "elapsed": round(elapsed, 4),
+      "content": response.content,
+      "tool_calls": response.tool_calls,
+      "finish_reason": response.finish_reason,
+      "usage": response.usage,
+      "message_count": len(messages),
+    }
+    line = _canonical(record) + "\n"
+    async with self._write_lock:
+      await asyncio.to_thread(self._append, line)
+    return response
+
+  def _append(self, line: str):
+    with self.path.open("a", encoding="utf-8") as file:
+      file.write(line)
+
+
+@dataclass
+class ReplayStats:
+  calls: int = 0
+  exact_hits: int = 0
+  loose_hits: int = 0
+  sequential_hits: int = 0
+  recorded_elapsed: float = 0.0
+
+
+class ReplayProvider:
+  """Serve recorded responses deterministically.
+
+  speed=None (or 0) returns immediately, 1.0 reproduces the recorded
+  latency and larger values replay that many times faster.
+  """
+
+  def __init__(self, path: str | Path, speed: Optional[float] = None):
+    self.path = Path(path)
+    self.speed = speed
+    self.entries = load_cassette(self.path)
+    self.stats = ReplayStats()
+    self._used: set[int] = set()
+    self._by_key: dict[str, deque[int]] = {}
+    self._by_loose_key: dict[str, deque[int]] = {}
+    for index, entry in enumerate(self.entries):
+      self._by_key.setdefault(entry.key, deque()).append(index)
+      self._by_loose_key.setdefault(entry.loose_key, deque()).append(index)
+
+  def _take(self, queue: Optional[deque[int]]) -> Optional[int]:
+    while queue:
+      index = queue.popleft()
+      if index not in self._used:
+        return index
+    return None
+
+  def _next_sequential(self) -> Optional[int]:
+    for index in range(len(self.entries)):
+      if index not in self._used:
+        return index
+    return None
+
+  async def generate(
+    self,
+    messages: list[LLMMessage | dict[str, Any]],
+    tools: Optional[list[ToolDefinition]] = None,
+    max_tokens: Optional[int] = None,
+    tool_choice: Optional[str | dict[str, Any]] = None,
+  ) -> LLMResponse:
+    key, loose_key = request_keys(messages, tools, max_tokens, tool_choice)
+    self.stats.calls += 1
+
+    index = self._take(self._by_key.get(key))
+    if index is not None:
+      self.stats.exact_hits += 1
+    else:
+      index = self._take(self._by_loose_key.get(loose_key))
+      if index is not None:
+        self.stats.loose_hits += 1
+      else:
+        index = self._next_sequential()
+        if index is None:
+          raise LookupError(f"Cassette {self.path} has no recorded response left (call {self.stats.calls}).")
+        self.stats.sequential_hits += 1
+        logger.warning(f"Cassette miss for request {key}; serving entry {index} in recorded order.")
+
+    self._used.add(index)
+    entry = self.entries[index]
+    self.stats.recorded_elapsed += entry.elapsed
+    if self.speed:
+      await asyncio.sleep(entry.elapsed / self.speed)
+    return entry.to_response()
+
+
+def load_cassette(path: str | Path) -> list[CassetteEntry]:
+  entries = []
+  with Path(path).open(encoding="utf-8") as file:
+    for line in file:
+      line = line.strip()
+      if not line:
+        continue
+      try:
+        entries.append(CassetteEntry(**json.loads(line)))
+      except (json.JSONDecodeError, TypeError):
+        # 書き込み途中で落ちた最終行などは読み飛ばす
+        logger.warning(f"Skipping malformed cassette line in {path}")
+  return entries
+
+
+def summarize_cassette(path: str | Path) -> dict[str, Any]:
+  entries = load_cassette(path)
+  finish_reasons: dict[str, int] = {}
+  for entry in entries:
+    finish_reasons[str(entry.finish_reason)] = finish_reasons.get(str(entry.finish_reason), 0) + 1
+  elapsed = sorted(entry.elapsed for entry in entries)
+  return {
+    "calls": len(entries),
+    "tool_call_responses": sum(1 for entry in entries if entry.tool_calls),
+    "finish_reasons": finish_reasons,
+    "total_elapsed": round(sum(elapsed), 3),
+    "p50_elapsed": elapsed[len(elapsed) // 2] if elapsed else 0.0,
+    "max_elapsed": elapsed[-1] if elapsed else 0.0,
+    "prompt_tokens": sum((entry.usage or {}).get("prompt_tokens", 0) for entry in entries),
+    "completion_tokens": sum((entry.usage or {}).get("completion_tokens", 0) for entry in entries),
+  }
+
+
+def wrap_provider(provider: LLMProvider, mode: Optional[str], path: str, speed: Optional[float] = None) -> LLMProvider:
+  """Apply the configured cassette mode ("record" / "replay") to a provider."""
+  if mode == "record":
+    logger.info(f"Recording LLM traffic to {path}")
+    return RecordingProvider(provider, path)
+  if mode == "replay":
+    logger.info(f"Replaying LLM traffic from {path}")
+    return ReplayProvider(path, speed=speed)
+  return provider
+
+
+if __name__ == "__main__":
+  import sys
+
+  for cassette_path in sys.argv[1:]:
+    print(cassette_path, json.dumps(summarize_cassette(cassette_path), ensure_ascii=False))
@@ -1,21 +1,46 @@
 import asyncio
 import copy
-from dataclasses import dataclass
-from datetime import timedelta
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
 from typing import Any
 
 import discord
 from discord.ext import commands
 import re
-import random
-from logging import getLogger
+from logging import DEBUG, getLogger
 
-from config import load_config
+from config import add_reload_listener, get_config, remove_reload_listener
+from conversation_budget import ConversationBudget
+from image_cache import ImageCache, choose_details, image_size, thumbnail_url
 from llm import LLMMessage
+from metrics import (
+  BACKGROUND_SUMMARIES,
+  HISTORY_FETCHES,
+  HISTORY_FETCH_SECONDS,
+  IMAGE_CONTEXT_PARTS,
+  MESSAGES_CLASSIFIED,
+  REPLY_COMPRESSIONS,
+  REPLY_FAILURES,
+  REPLY_PROVIDER_CALLS,
+  REPLY_RETRIES,
+  REPLY_SECONDS,
+  mark_startup_phase,
+)
+from outbound import MAX_MESSAGE_LENGTH, PRIORITY_CHAT, PRIORITY_NOTIFICATION
+from summaries import BackgroundLane, ChannelSummary, SummaryCache
+from tracing import TRACER, traced
 
 logger = getLogger(__name__)
 
 MessageContent = str | list[dict[str, Any]]
+# on_message での振り分け
+MESSAGE_DROP = "drop"  # 保存も返信もしない
+MESSAGE_STORE = "store"  # 履歴に保存するだけ
+MESSAGE_MENTION = "mention"  # botに向けたメッセージ
+MESSAGE_CHAT = "chat"  # 保存して、ランダム返信の対象にする
 VOICE_STATE_UPDATE_PATTERN = re.compile(r'^.*が(.*)(からきえてくにゃ・・・|に入ったにゃ！)$')
 
 
@@ -36,7 +61,18 @@ def get_user_nickname(member):
   return str(member)
 
 
-@dataclass
+def chunk_lines(lines: list[str], max_length: int) -> list[str]:
+  """Join lines with newlines into as few texts of at most ``max_length`` as possible."""
+  chunks = []
+  for line in lines:
+    if chunks and len(chunks[-1]) + 1 + len(line) <= max_length:
+      chunks[-1] += "\n" + line
+    else:
+      chunks.append(line[:max_length])
+  return chunks
+
+
+@dataclass(frozen=True, slots=True)
 class ConversationMessage:
   message_id: int
   channel_id: int
@@ -45,12 +81,17 @@ class ConversationMessage:
   role: str
   content: MessageContent
   created_at: Any
+  _llm_message: dict[str, Any] = field(init=False, repr=False, compare=False)
+
+  def __post_init__(self):
+    # 同じ名前やロールが何千件も並ぶので intern して1つの文字列を共有する
+    object.__setattr__(self, "author_name", sys.intern(self.author_name))
+    object.__setattr__(self, "role", sys.intern(self.role))
+    object.__setattr__(self, "_llm_message", {"role": self.role, "content": self.content})
 
   def to_llm_message(self) -> dict[str, Any]:
-    return {
-      "role": self.role,
-      "content": self.content,
-    }
+    """Return the LLM message dict. It is shared, so treat it as read-only."""
+    return self._llm_message
 
 
 class ShortTermMemory:
@@ -68,30 +109,160 @@ class ShortTermMemory:
   def get(self, channel_id: int) -> list[ConversationMessage]:
     return list(self._messages_by_channel.get(channel_id, []))
 
+  def channel_ids(self) -> list[int]:
+    return list(self._messages_by_channel)
+
   def merge(self, channel_id: int, messages: list[ConversationMessage]) -> list[ConversationMessage]:
     for message in messages:
       self.add(message)
     return self.get(channel_id)
 
+  def snapshot(self) -> list[dict[str, Any]]:
+    return [
+      {
+        "message_id": message.message_id,
+        "channel_id": message.channel_id,
+        "author_id": message.author_id,
+        "author_name": message.author_name,
+        "role": message.role,
+        "content": message.content,
+        "created_at": message.created_at.isoformat(),
+      }
+      for messages in self._messages_by_channel.values()
+      for message in messages
+    ]
+
+  def restore(self, items: list[dict[str, Any]]):
+    for item in items:
+      self.add(ConversationMessage(**{**item, "created_at": datetime.fromisoformat(item["created_at"])}))
+
 
 class EventsCog(commands.Cog):
   MAX_HISTORY_LENGTH = 10
   RANDOM_REPLY_CHANCE = 36
   HISTORY_FETCH_MIN_MESSAGES = 3
   HISTORY_FETCH_GAP = timedelta(minutes=5)
+  # 起動直後に履歴を先読みするチャンネル数と同時取得数 (レート制限に配慮して少なめ)
+  HISTORY_WARM_CHANNELS = 20
+  HISTORY_WARM_CONCURRENCY = 2
+  HISTORY_WARM_INTERVAL = 0.5
+  HISTORY_WARM_MAX_AGE = timedelta(hours=6)
+  # 1回の返信でモデルを呼び出せる回数の上限 (リトライを含む)
+  MAX_PROVIDER_CALLS_PER_REPLY = 8
+  # モデルやワーカーに届かなかったときの返信
+  FAILURE_REPLY = "…"
+  # 1回の返信で作る画像の説明文の数と、1枚あたりに使うスタミナ
+  IMAGE_DESCRIPTIONS_PER_REPLY = 1
+  IMAGE_DESCRIPTION_STAMINA = 1
+  # 入退室通知をまとめる時間。この間の入退室は1通のメッセージで送る
+  VOICE_NOTIFICATION_WINDOW = 3.0
+  # 会話が途切れたチャンネルの履歴を、空いている間に要約しておく (長さ超過時のリトライですぐ使う)
+  SUMMARY_INTERVAL = 60.0
+  SUMMARY_IDLE = timedelta(minutes=3)
+  SUMMARY_MIN_MESSAGES = 6
+  SUMMARY_BATCH_SIZE = 5
+  SUMMARY_CONCURRENCY = 1
+  # スタミナが最大のこの割合以上あるときだけ要約し、1回ごとにスタミナを使う
+  SUMMARY_MIN_STAMINA_RATIO = 0.5
+  SUMMARY_STAMINA = 1
 
   def __init__(self, bot):
     self.bot = bot
     self.short_term_memory = ShortTermMemory(self.MAX_HISTORY_LENGTH)
     self.channel_message_history = {}
-    config = load_config()
+    config = get_config()
+    # guild_id -> 通知先チャンネル (見つからなかった場合は None)。チャンネルが変わったら捨てる
+    self.notification_channels: dict[int, Any] = {}
+    # 通知先チャンネルID -> {member_id: 通知文}。送るまでに同じ人が動いたら最新の状態だけ残す
+    self.pending_voice_notifications: dict[int, dict[int, str]] = {}
+    self.voice_notification_tasks: dict[int, asyncio.Task] = {}
+    # channel_id -> botが発言できるか
+    self.reply_channels: dict[int, bool] = {}
+    # wait_reply が返信を待っているbotのメッセージID
+    self.waiting_replies: set[int] = set()
+    self.conversation_budget = ConversationBudget(
+      max_bot_chain=config.reply_budget.max_bot_chain,
+      decay=config.reply_budget.decay,
+      max_replies=config.reply_budget.max_replies,
+      window=config.reply_budget.window_seconds,
+    )
+    self.history_warm_task = None
+    # 裏で作っておいた要約と、長さ超過のリトライで作った要約。次のリトライで使う
+    self.summary_task = None
+    self.summary_cache = SummaryCache()
+    # ワーカーにモデルの実行を任せているときは、ゲートウェイ側で要約しない
+    self.background_summaries = not config.worker.enabled
+    self.image_max_side = config.images.max_side
+    self.image_max_per_message = config.images.max_per_message
+    self.image_token_budget = config.images.token_budget
+    self.image_describe = config.images.describe
+    self.image_cache = ImageCache(config.images.cache_dir, config.images.cache_max_bytes)
+    self.image_description_tasks: dict[str, asyncio.Task] = {}
+    # 返信とは別に裏で動かすタスク (履歴の先読み・要約・画像の説明)。終了時に止める
+    self.background_tasks: set[asyncio.Task] = set()
+    # 終了処理が始まったら新しい返信は始めず、生成中の返信だけ待つ
+    self.accepting_replies = True
+    self.active_replies = 0
+    self.replies_idle = asyncio.Event()
+    self.replies_idle.set()
+    self.apply_config(None, config)
+    add_reload_listener(self.apply_config)
+
+  def apply_config(self, old_config, config):
+    """起動時と設定の再読み込み時に、再起動しなくても変えられる設定を反映する"""
     self.voice_notification_enabled = config.voice_notification.enabled
     self.leave_message = config.voice_notification.leave_message
     self.join_message = config.voice_notification.join_message
-    self.notification_channel_name = config.voice_notification.channel_name
+    if getattr(self, "notification_channel_name", None) != config.voice_notification.channel_name:
+      self.notification_channel_name = config.voice_notification.channel_name
+      self.notification_channels = {}
     self.initial_max_tokens = config.openai.max_tokens
     self.current_max_tokens = self.initial_max_tokens
 
+  async def cog_unload(self):
+    remove_reload_listener(self.apply_config)
+    self.stop_summaries()
+
+  @contextmanager
+  def track_reply(self):
+    self.active_replies += 1
+    self.replies_idle.clear()
+    try:
+      yield
+    finally:
+      self.active_replies -= 1
+      if not self.active_replies:
+        self.replies_idle.set()
+
+  def start_background(self, coroutine) -> asyncio.Task:
+    task = asyncio.create_task(coroutine)
+    self.background_tasks.add(task)
+    task.add_done_callback(self.background_tasks.discard)
+    return task
+
+  async def stop_background_tasks(self):
+    tasks = list(self.background_tasks)
+    for task in tasks:
+      task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+  async def drain(self, timeout: float) -> bool:
+    """Stop starting new replies and wait up to ``timeout`` for the ones in progress. False if some didn't finish.
+
+    Background work (history warming, summaries, image descriptions) is
+    cancelled first so it can't call the provider or touch memory after
+    the state snapshot.
+    """
+    self.accepting_replies = False
+    self.summary_task = None
+    await self.stop_background_tasks()
+    try:
+      await asyncio.wait_for(self.replies_idle.wait(), timeout)
+      return True
+    except asyncio.TimeoutError:
+      logger.warning(f"{self.active_replies} replies were still running at shutdown")
+      return False
+
 
   @commands.Cog.listener()
   async def on_ready(self):
@@ -102,44 +273,99 @@ class EventsCog(commands.Cog):
     for guild in self.bot.guilds:
       logger.info(f'{guild.name} {guild.id}')
 
+    if self.history_warm_task is None:
+      self.history_warm_task = self.start_background(self.warm_channel_history())
+    if self.summary_task is None and self.background_summaries:
+      self.summary_task = self.start_background(self.summarize_idle_channels())
+
   @commands.Cog.listener()
   async def on_message(self, message):
-    # メッセージ履歴にメッセージを追加
-    if message.author != self.bot.user:
-      self.add_message_to_history(message)
+    if not self.accepting_replies:
+      return
+    action = self.classify_message(message)
+    MESSAGES_CLASSIFIED.labels(action).inc()
+    if action == MESSAGE_DROP:
+      return
 
-    # メッセージがbot自身からのものであれば、何もしない
-    if message.author.id == self.bot.user.id:
+    # メッセージ履歴にメッセージを追加
+    self.add_message_to_history(message)
+    channel_id = message.channel.id
+    if not message.author.bot:
+      self.conversation_budget.record_human(channel_id)
+    if action == MESSAGE_STORE:
       return
 
-    if str(self.bot.user.id) in message.content:
+    random_chance = 1 / self.RANDOM_REPLY_CHANCE
+    if action == MESSAGE_MENTION:
       if message.author.bot:  # 相手がbotの場合
-        if random.randint(1, self.RANDOM_REPLY_CHANCE) == 1 and self.has_enough_context(message.channel.id):
+        if self.has_enough_context(channel_id) and self.conversation_budget.allow(channel_id, True, random_chance):
           await self.reply_to(message)  # ランダムに返信
         return
-      else:  # 相手が人間の場合は必ず返信
+      else:  # 相手が人間の場合は必ず返信 (チャンネルの上限にも数えない)
         await self.reply_to(message)
         return
 
-    if random.randint(1, self.RANDOM_REPLY_CHANCE) == 1 and self.has_enough_context(message.channel.id):
-      async with message.channel.typing():
-        messages = await self.get_reply(message)
-        final_msg = messages[-1]
-        if self.is_tool_message(final_msg) or self.get_tool_calls(final_msg):
-          logger.error("Random reply failed: final message is a tool call")
-          return
-        content = self.get_message_content(final_msg)
-        if not content or (isinstance(content, str) and not content.strip()) or (isinstance(content, list) and len(content) == 0):
-          logger.error("Random reply failed: final message has no textual content")
-          return
-        # Format and guard against empty content
-        random_reply_text = self.safe_text_from_content(content)
-        m = await message.channel.send(random_reply_text)
-        self.add_message_to_history(m, role="assistant")
+    if self.has_enough_context(channel_id) and self.conversation_budget.allow(channel_id, message.author.bot, random_chance):
+      with self.track_reply(), TRACER.span("events.random_reply", root=True, channel_id=message.channel.id) as span:
+        self.trace_event_age(span, message)
+        async with message.channel.typing():
+          messages = await self.get_reply(message)
+          final_msg = messages[-1]
+          if self.is_tool_message(final_msg) or self.get_tool_calls(final_msg):
+            logger.error("Random reply failed: final message is a tool call")
+            return
+          content = self.get_message_content(final_msg)
+          if not content or (isinstance(content, str) and not content.strip()) or (isinstance(content, list) and len(content) == 0):
+            logger.error("Random reply failed: final message has no textual content")
+            return
+          # Format and guard against empty content
+          random_reply_text = self.safe_text_from_content(content)
+          with TRACER.span("discord.send"):
+            m = await self.bot.outbound.send(message.channel, random_reply_text, priority=PRIORITY_CHAT)
+          mark_startup_phase("first_reply")
+          self.add_message_to_history(m, role="assistant")
 
       await self.wait_reply(m, messages)
       return
 
+  def classify_message(self, message) -> str:
+    """Decide once, without formatting anything, what to do with an incoming message."""
+    bot_user = self.bot.user
+    # bot自身のメッセージは送信したときに履歴に入れている
+    if message.author.id == bot_user.id:
+      return MESSAGE_DROP
+    if not message.content and not getattr(message, "attachments", None):
+      return MESSAGE_DROP
+    if not self.can_reply_in(message.channel):
+      return MESSAGE_DROP
+
+    reference = getattr(message, "reference", None)
+    if getattr(reference, "message_id", None) in self.waiting_replies:
+      # 返信を待っているbotの発言への返信は wait_reply が受け取る
+      return MESSAGE_STORE
+    if any(user.id == bot_user.id for user in getattr(message, "mentions", None) or ()):
+      return MESSAGE_MENTION
+    return MESSAGE_CHAT
+
+  def can_reply_in(self, channel) -> bool:
+    """発言できないチャンネルのメッセージは保存しない。権限の計算結果はチャンネルごとに覚えておく"""
+    allowed = self.reply_channels.get(channel.id)
+    if allowed is not None:
+      return allowed
+    me = getattr(getattr(channel, "guild", None), "me", None)
+    allowed = me is None or channel.permissions_for(me).send_messages
+    self.reply_channels[channel.id] = allowed
+    return allowed
+
+  @commands.Cog.listener()
+  async def on_guild_role_update(self, before, after):
+    self.reply_channels.clear()
+
+  @commands.Cog.listener()
+  async def on_member_update(self, before, after):
+    if after.id == self.bot.user.id:
+      self.reply_channels.clear()
+
   @commands.Cog.listener()
   async def on_voice_state_update(self, member, before, after):
     # 通知機能が無効の場合は何もしない
@@ -152,25 +378,71 @@ class EventsCog(commands.Cog):
 
     # 通知先のテキストチャンネル取得
     server = before.channel.guild if after.channel is None else after.channel.guild
-    channel = discord.utils.get(server.channels, name=self.notification_channel_name, type=discord.ChannelType.text)
+    channel = self.get_notification_channel(server)
 
     if channel is None:
-      logger.warning(f"Notification channel '{self.notification_channel_name}' not found in server '{server.name}'.")
       return
 
     name = get_user_nickname(member)
 
-    # 入退室メッセージ送信
+    # 入退室メッセージ
     if after.channel is None:
       message = self.leave_message.format(name=name, channel=before.channel.name)
     else:
       message = self.join_message.format(name=name, channel=after.channel.name)
 
-    async with channel.typing():
-      sent = await channel.send(message)
+    pending = self.pending_voice_notifications.setdefault(channel.id, {})
+    pending.pop(member.id, None)
+    pending[member.id] = message
+    if channel.id not in self.voice_notification_tasks:
+      self.voice_notification_tasks[channel.id] = asyncio.create_task(self.flush_voice_notifications(channel))
+
+  def get_notification_channel(self, guild):
+    if guild.id in self.notification_channels:
+      return self.notification_channels[guild.id]
+    channel = discord.utils.get(guild.channels, name=self.notification_channel_name, type=discord.ChannelType.text)
+    if channel is None:
+      logger.warning(f"Notification channel '{self.notification_channel_name}' not found in server '{guild.name}'.")
+    self.notification_channels[guild.id] = channel
+    return channel
+
+  @commands.Cog.listener()
+  async def on_guild_channel_create(self, channel):
+    self.notification_channels.pop(channel.guild.id, None)
+
+  @commands.Cog.listener()
+  async def on_guild_channel_delete(self, channel):
+    self.notification_channels.pop(channel.guild.id, None)
+    self.reply_channels.pop(channel.id, None)
 
-    # bot メッセージも履歴に追加する
-    self.add_message_to_history(sent, role="assistant")
+  @commands.Cog.listener()
+  async def on_guild_channel_update(self, before, after):
+    self.notification_channels.pop(after.guild.id, None)
+    self.reply_channels.pop(after.id, None)
+
+  async def flush_voice_notifications(self, channel):
+    """VOICE_NOTIFICATION_WINDOW の間に溜まった入退室をまとめて送る"""
+    task = asyncio.current_task()
+    try:
+      async with channel.typing():
+        await asyncio.sleep(self.VOICE_NOTIFICATION_WINDOW)
+        # ここから先に届いた入退室は次のまとまりになる
+        self.voice_notification_tasks.pop(channel.id, None)
+        lines = list(self.pending_voice_notifications.pop(channel.id, {}).values())
+        for text in chunk_lines(lines, MAX_MESSAGE_LENGTH):
+          sent = await self.bot.outbound.send(
+            channel,
+            text,
+            priority=PRIORITY_NOTIFICATION,
+            merge_key="voice_notification",
+          )
+          # bot メッセージも履歴に追加する
+          self.add_message_to_history(sent, role="assistant")
+    except Exception:
+      logger.warning(f"Failed to send voice notification to {channel.id}", exc_info=True)
+    finally:
+      if self.voice_notification_tasks.get(channel.id) is task:
+        del self.voice_notification_tasks[channel.id]
 
   def has_enough_context(self, channel_id: int) -> bool:
     return len(self.short_term_memory.get(channel_id)) > 2
@@ -182,7 +454,12 @@ class EventsCog(commands.Cog):
 
     self.short_term_memory.add(conversation_message)
     self.sync_legacy_history(conversation_message.channel_id)
-    logger.info(self.channel_message_history)
+    if logger.isEnabledFor(DEBUG):
+      logger.debug(
+        "Channel %s history: %s",
+        conversation_message.channel_id,
+        self.channel_message_history[conversation_message.channel_id],
+      )
     return True
 
   def to_conversation_message(self, message, role="user") -> ConversationMessage | None:
@@ -191,34 +468,37 @@ class EventsCog(commands.Cog):
     content = message.content or ""
     name = get_user_nickname(message.author)
     text = content.strip()
-    first_image_url = None
-    attachments = getattr(message, "attachments", [])
-    if attachments:
-      for attachment in message.attachments:
-        if attachment.content_type and 'image' in attachment.content_type:
-          first_image_url = attachment.url
-          break
+    # 画像はDiscordのメディアプロキシで縮小したものを使う
+    image_urls = [
+      thumbnail_url(attachment, self.image_max_side)
+      for attachment in getattr(message, "attachments", None) or []
+      if attachment.content_type and 'image' in attachment.content_type
+    ][:self.image_max_per_message]
 
     normalized_role = role
     normalized_content: MessageContent | None = None
-    if first_image_url is not None:
+    if image_urls:
       normalized_content = [
         {
           "type": "text",
           "text": f"{name}:{author_id} {text}"
         },
-        {
-          "type": "image_url",
-          "image_url": {
-            "url": first_image_url
+        *(
+          {
+            "type": "image_url",
+            "image_url": {
+              "url": image_url
+            }
           }
-        },
+          for image_url in image_urls
+        ),
       ]
     elif text:
       if role == "user":
         normalized_content = f"{name}:{author_id} {text}"
       elif role == "assistant":
-        if VOICE_STATE_UPDATE_PATTERN.match(content):
+        # 入退室通知はまとめて1通で送られることがあるので行ごとに判定する
+        if all(VOICE_STATE_UPDATE_PATTERN.match(line) for line in text.splitlines()):
           normalized_role = "system"
           normalized_content = text
         else:
@@ -245,26 +525,78 @@ class EventsCog(commands.Cog):
       for message in self.short_term_memory.get(channel_id)
     ]
 
+  @traced("events.build_conversation_messages")
   async def build_conversation_messages(self, message) -> list[ConversationMessage]:
     channel_id = message.channel.id
     memory_messages = self.short_term_memory.get(channel_id)
     if self.should_fetch_discord_history(message, memory_messages):
+      started = time.perf_counter()
       try:
-        fetched_messages = []
-        async for history_message in message.channel.history(limit=self.MAX_HISTORY_LENGTH):
-          conversation_message = self.to_conversation_message(
-            history_message,
-            role="assistant" if history_message.author.id == self.bot.user.id else "user",
-          )
-          if conversation_message is not None:
-            fetched_messages.append(conversation_message)
-        memory_messages = self.short_term_memory.merge(channel_id, fetched_messages)
-        self.sync_legacy_history(channel_id)
+        await self.fetch_channel_history(message.channel)
+        HISTORY_FETCHES.labels("ok").inc()
       except Exception:
+        HISTORY_FETCHES.labels("error").inc()
         logger.exception("Failed to fetch Discord channel history.")
+      HISTORY_FETCH_SECONDS.observe(time.perf_counter() - started)
 
     return self.short_term_memory.get(channel_id)
 
+  async def fetch_channel_history(self, channel) -> list[ConversationMessage]:
+    fetched_messages = []
+    with TRACER.span("discord.channel.history", limit=self.MAX_HISTORY_LENGTH):
+      async for history_message in channel.history(limit=self.MAX_HISTORY_LENGTH):
+        conversation_message = self.to_conversation_message(
+          history_message,
+          role="assistant" if history_message.author.id == self.bot.user.id else "user",
+        )
+        if conversation_message is not None:
+          fetched_messages.append(conversation_message)
+    memory_messages = self.short_term_memory.merge(channel.id, fetched_messages)
+    self.sync_legacy_history(channel.id)
+    return memory_messages
+
+  def select_channels_to_warm(self, now=None) -> list:
+    """最近メッセージがあったチャンネルを新しい順に選ぶ"""
+    now = now or discord.utils.utcnow()
+    candidates = []
+    for guild in self.bot.guilds:
+      me = getattr(guild, "me", None)
+      for channel in getattr(guild, "text_channels", []):
+        last_message_id = getattr(channel, "last_message_id", None)
+        if last_message_id is None or self.short_term_memory.get(channel.id):
+          continue
+        if now - discord.utils.snowflake_time(last_message_id) > self.HISTORY_WARM_MAX_AGE:
+          continue
+        if me is not None and not channel.permissions_for(me).read_message_history:
+          continue
+        candidates.append(channel)
+    candidates.sort(key=lambda channel: channel.last_message_id, reverse=True)
+    return candidates[:self.HISTORY_WARM_CHANNELS]
+
+  async def warm_channel_history(self):
+    """起動直後に最近使われたチャンネルの履歴を先読みし、最初の返信で履歴取得を待たなくて済むようにする"""
+    channels = self.select_channels_to_warm()
+    if not channels:
+      return
+    semaphore = asyncio.Semaphore(self.HISTORY_WARM_CONCURRENCY)
+
+    async def warm(channel):
+      async with semaphore:
+        # 返信のための取得などで既に埋まっていれば何もしない
+        if self.short_term_memory.get(channel.id):
+          return
+        try:
+          await self.fetch_channel_history(channel)
+          HISTORY_FETCHES.labels("warmed").inc()
+        except Exception:
+          HISTORY_FETCHES.labels("error").inc()
+          logger.warning(f"Failed to warm history for channel {channel.id}", exc_info=True)
+        await asyncio.sleep(self.HISTORY_WARM_INTERVAL)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(warm(channel) for channel in channels))
+    logger.info(f"Warmed history for {len(channels)} channels in {time.perf_counter() - started:.2f}s")
+
   async def build_conversation_context(self, message):
     return [
       conversation_message.to_llm_message()
@@ -280,8 +612,8 @@ class EventsCog(commands.Cog):
     reference_message_id = getattr(reference, "message_id", None)
     if reference_message_id is not None and not any(item.message_id == reference_message_id for item in memory_messages):
       return True
-    content = getattr(message, "content", "") or ""
-    if str(self.bot.user.id) in content and len(memory_messages) < self.MAX_HISTORY_LENGTH:
+    mentioned = any(user.id == self.bot.user.id for user in getattr(message, "mentions", None) or ())
+    if mentioned and len(memory_messages) < self.MAX_HISTORY_LENGTH:
       return True
 
     previous_messages = [
@@ -309,7 +641,14 @@ class EventsCog(commands.Cog):
       conversation_messages[latest_non_bot_index:],
     )
 
-  async def compress_old_conversation_messages(self, messages: list[ConversationMessage]) -> dict[str, str] | None:
+  @staticmethod
+  def summary_message(summary: str) -> dict[str, str]:
+    return {
+      "role": "system",
+      "content": f"Conversation summary before the latest user message:\n{summary}",
+    }
+
+  async def summarize_messages(self, messages: list[ConversationMessage], provider, previous_summary: str | None = None) -> str | None:
     if not messages:
       return None
 
@@ -317,7 +656,9 @@ class EventsCog(commands.Cog):
       self.render_conversation_message_for_summary(message)
       for message in messages
     )
-    response = await self.bot.meowgent.provider.generate(
+    if previous_summary:
+      rendered_messages = f"Summary of earlier messages:\n{previous_summary}\n\n{rendered_messages}"
+    response = await provider.generate(
       [
         LLMMessage(
           role="system",
@@ -335,10 +676,7 @@ class EventsCog(commands.Cog):
     summary = self.safe_text_from_content(response.content)
     if summary == "…":
       return None
-    return {
-      "role": "system",
-      "content": f"Conversation summary before the latest user message:\n{summary}",
-    }
+    return summary
 
   def render_conversation_message_for_summary(self, message: ConversationMessage) -> str:
     if isinstance(message.content, list):
@@ -350,65 +688,292 @@ class EventsCog(commands.Cog):
           parts.append(str(part.get("text", "")))
         elif part.get("type") == "image_url":
           image_url = part.get("image_url", {}).get("url")
-          if image_url:
+          description = self.image_cache.description(image_url) if image_url and self.image_cache else None
+          if description:
+            parts.append(f"[image: {description}]")
+          elif image_url:
             parts.append(f"[image: {image_url}]")
       content = " ".join(part for part in parts if part).strip() or "…"
     else:
       content = self.safe_text_from_content(message.content)
     return f"{message.created_at.isoformat()} {message.role} {message.author_name}:{message.author_id} {content}"
 
+  async def prepare_image_context(
+    self,
+    messages: list[dict[str, Any]],
+    describe: dict[str, str] | None = None,
+  ) -> list[dict[str, Any]]:
+    """Rewrite image parts for the model.
+
+    Images that already have a description are sent as text. The rest are
+    sent from the local cache at a detail level that fits the image token
+    budget (newest first), or left out when the budget runs out. Images
+    that are sent are added to ``describe`` (url -> image to describe).
+    """
+    if self.image_cache is None:
+      return messages
+
+    images = []
+    for message_index, message in enumerate(messages):
+      content = message.get("content") if isinstance(message, dict) else None
+      if not isinstance(content, list):
+        continue
+      for part_index, part in enumerate(content):
+        if isinstance(part, dict) and part.get("type") == "image_url":
+          url = part.get("image_url", {}).get("url")
+          if url and not url.startswith("data:"):
+            images.append((message_index, part_index, url))
+    if not images:
+      return messages
+
+    replacements = {}
+    pending = []
+    for message_index, part_index, url in images:
+      description = self.image_cache.description(url)
+      if description:
+        IMAGE_CONTEXT_PARTS.labels("description").inc()
+        replacements[(message_index, part_index)] = {"type": "text", "text": f"[image: {description}]"}
+      else:
+        pending.append((message_index, part_index, url))
+
+    details = choose_details([image_size(url) for _, _, url in pending], self.image_token_budget)
+    data_urls = await asyncio.gather(*(
+      self.image_cache.data_url(url) if detail else asyncio.sleep(0)
+      for (_, _, url), detail in zip(pending, details)
+    ))
+    for (message_index, part_index, url), detail, data_url in zip(pending, details, data_urls):
+      if detail is None:
+        IMAGE_CONTEXT_PARTS.labels("omitted").inc()
+        replacements[(message_index, part_index)] = {"type": "text", "text": "[image omitted]"}
+        continue
+      IMAGE_CONTEXT_PARTS.labels(detail).inc()
+      if describe is not None:
+        describe.setdefault(url, data_url or url)
+      replacements[(message_index, part_index)] = {
+        "type": "image_url",
+        "image_url": {"url": data_url or url, "detail": detail},
+      }
+
+    # 保存している履歴は書き換えず、コピーを返す
+    rewritten = {message_index for message_index, _ in replacements}
+    return [
+      {
+        **message,
+        "content": [replacements.get((message_index, part_index), part) for part_index, part in enumerate(message["content"])],
+      } if message_index in rewritten else message
+      for message_index, message in enumerate(messages)
+    ]
+
+  def schedule_image_descriptions(self, images: dict[str, str], budget: int) -> int:
+    """Start describing up to ``budget`` of the images a reply sent. Returns how many model calls were started."""
+    if not self.image_describe or not self.accepting_replies:
+      return 0
+    limit = min(self.IMAGE_DESCRIPTIONS_PER_REPLY, budget)
+    started = 0
+    for url, image_ref in images.items():
+      if started >= limit:
+        break
+      if url in self.image_description_tasks or self.image_cache.description(url):
+        continue
+      task = self.start_background(self.describe_image(url, image_ref))
+      self.image_description_tasks[url] = task
+      task.add_done_callback(lambda _, url=url: self.image_description_tasks.pop(url, None))
+      started += 1
+    return started
+
+  async def describe_image(self, url: str, image_ref: str):
+    """次の返信から画像の代わりに使う説明文を作っておく"""
+    try:
+      response = await self.model_provider().generate(
+        [
+          LLMMessage(
+            role="system",
+            content=(
+              "Describe this image in one or two sentences so the description can stand in for it "
+              "later in a conversation. Include any readable text."
+            ),
+          ),
+          LLMMessage(role="user", content=[{"type": "image_url", "image_url": {"url": image_ref, "detail": "low"}}]),
+        ],
+        tools=[],
+        max_tokens=120,
+      )
+    except Exception:
+      logger.warning("Failed to describe image", exc_info=True)
+      return
+    await self.bot.meowgent.reduce_stamina(self.IMAGE_DESCRIPTION_STAMINA)
+    description = self.safe_text_from_content(response.content)
+    if description != "…":
+      await self.image_cache.set_description(url, description)
+
+  def is_busy(self) -> bool:
+    """返信の生成中や送信待ちがある間は、裏の要約を始めない"""
+    outbound = getattr(self.bot, "outbound", None)
+    return self.active_replies > 0 or (outbound is not None and outbound.pending_count() > 0)
+
+  def has_spare_stamina(self) -> bool:
+    meowgent = self.bot.meowgent
+    return meowgent.stamina >= meowgent.max_stamina * self.SUMMARY_MIN_STAMINA_RATIO
+
+  def select_channels_to_summarize(self, now=None) -> list[int]:
+    """履歴が溜まったまま会話が途切れていて、まだ要約に入っていないメッセージがあるチャンネルを選ぶ"""
+    now = now or discord.utils.utcnow()
+    candidates = []
+    for channel_id in self.short_term_memory.channel_ids():
+      messages = self.short_term_memory.get(channel_id)
+      if len(messages) < self.SUMMARY_MIN_MESSAGES:
+        continue
+      latest_message = messages[-1]
+      if now - latest_message.created_at < self.SUMMARY_IDLE:
+        continue
+      cached = self.summary_cache.get(channel_id)
+      if cached is not None and cached.last_message_id == latest_message.message_id:
+        continue
+      candidates.append((latest_message.created_at, channel_id))
+    candidates.sort(reverse=True)
+    return [channel_id for _, channel_id in candidates[:self.SUMMARY_BATCH_SIZE]]
+
+  async def summarize_channel(self, channel_id: int, provider):
+    messages = self.short_term_memory.get(channel_id)
+    if not messages or not self.has_spare_stamina():
+      return
+    # 前回の要約に続きがあれば、増えた分だけを前回の要約と合わせて要約し直す
+    previous_summary = None
+    cached = self.summary_cache.lookup(channel_id, messages)
+    if cached is not None:
+      previous_summary, messages = cached
+      if not messages:
+        return
+    try:
+      summary = await self.summarize_messages(messages, provider, previous_summary)
+    except Exception:
+      BACKGROUND_SUMMARIES.labels("error").inc()
+      logger.warning(f"Failed to summarize channel {channel_id}", exc_info=True)
+      return
+    await self.bot.meowgent.reduce_stamina(self.SUMMARY_STAMINA)
+    if summary is None:
+      BACKGROUND_SUMMARIES.labels("empty").inc()
+      return
+    self.summary_cache.put(channel_id, ChannelSummary(messages[-1].message_id, summary))
+    BACKGROUND_SUMMARIES.labels("ok").inc()
+
+  async def summarize_idle_channels(self):
+    lane = BackgroundLane(self.bot.meowgent.provider, self.SUMMARY_CONCURRENCY, self.is_busy)
+    while self.accepting_replies:
+      await asyncio.sleep(self.SUMMARY_INTERVAL)
+      if self.is_busy() or not self.has_spare_stamina():
+        continue
+      # 設定の再読み込みでプロバイダが変わっていても追従する
+      lane.provider = self.bot.meowgent.provider
+      channel_ids = self.select_channels_to_summarize()
+      if channel_ids:
+        await asyncio.gather(*(self.summarize_channel(channel_id, lane) for channel_id in channel_ids))
+
+  def stop_summaries(self):
+    if self.summary_task is not None:
+      self.summary_task.cancel()
+      self.summary_task = None
+
+  @traced("events.compress_history")
   async def build_compressed_retry_context(self, conversation_record_messages: list[ConversationMessage]):
     older_messages, raw_messages = self.split_for_compression(conversation_record_messages)
     if not older_messages:
+      REPLY_COMPRESSIONS.labels("skipped").inc()
       return [
         message.to_llm_message()
         for message in conversation_record_messages
       ]
 
+    # 裏や前のリトライで作った要約があれば使い回し、それより後に増えた分だけを要約に足す
+    channel_id = older_messages[0].channel_id
+    previous_summary = None
+    uncovered_messages = older_messages
+    cached = self.summary_cache.lookup(channel_id, older_messages)
+    if cached is not None:
+      previous_summary, uncovered_messages = cached
+      if not uncovered_messages:
+        REPLY_COMPRESSIONS.labels("cached").inc()
+        return [
+          self.summary_message(previous_summary),
+          *[message.to_llm_message() for message in raw_messages],
+        ]
+
     try:
-      summary_message = await self.compress_old_conversation_messages(older_messages)
+      summary = await self.summarize_messages(uncovered_messages, self.model_provider(), previous_summary)
     except Exception:
+      REPLY_COMPRESSIONS.labels("error").inc()
       logger.exception("Failed to compress conversation history.")
       return [
         message.to_llm_message()
         for message in conversation_record_messages
       ]
 
-    if summary_message is None:
+    if summary is None:
+      REPLY_COMPRESSIONS.labels("empty").inc()
       return [
         message.to_llm_message()
         for message in conversation_record_messages
       ]
 
+    self.summary_cache.put(channel_id, ChannelSummary(older_messages[-1].message_id, summary))
+    REPLY_COMPRESSIONS.labels("ok").inc()
     return [
-      summary_message,
+      self.summary_message(summary),
       *[message.to_llm_message() for message in raw_messages],
     ]
 
+  def model_provider(self):
+    """エージェントを通さない1回だけの呼び出しに使うプロバイダ。ワーカーモードではワーカーが呼び出す"""
+    app = getattr(self.bot.meowgent, "app", None)
+    return getattr(app, "provider", None) or self.bot.meowgent.provider
 
+  def failure_message(self, error: Exception) -> LLMMessage:
+    REPLY_FAILURES.labels(type(error).__name__).inc()
+    logger.error(f"Model call for a reply failed: {type(error).__name__}: {error}", exc_info=error)
+    return LLMMessage(role="assistant", content=self.FAILURE_REPLY)
 
+  @traced("events.get_reply")
   async def get_reply(self, message, conversation_messages=None):
+    started = time.perf_counter()
     conversation_record_messages = None
+    # この返信でモデルに見せた画像。返信のあとで説明文を作る
+    images_to_describe: dict[str, str] = {}
     if conversation_messages is None:
       conversation_record_messages = await self.build_conversation_messages(message)
-      conversation_messages = [
+      conversation_messages = await self.prepare_image_context([
         conversation_message.to_llm_message()
         for conversation_message in conversation_record_messages
-      ]
+      ], images_to_describe)
     else:
       conversation_messages = copy.deepcopy(conversation_messages)
     max_retries = 3
     retries = 0
+    provider_calls = 0
 
     while retries < max_retries:
-      # run agent
-      final_state = await self.bot.meowgent.app.ainvoke(
-        {
-          "messages": conversation_messages,
-          "current_channel_id": message.channel.id,
-        },
-        config={"configurable": {"thread_id": message.channel.id, "recursion_limit": 5}}
-      )
+      remaining_calls = self.MAX_PROVIDER_CALLS_PER_REPLY - provider_calls
+      if remaining_calls <= 0:
+        REPLY_RETRIES.labels("budget").inc()
+        logger.error("Provider call budget for this reply is used up")
+        break
+
+      # run agent (ワーカーモードではキューが一杯だったり、結果が時間内に戻らなかったりする)
+      try:
+        final_state = await self.bot.meowgent.app.ainvoke(
+          {
+            "messages": conversation_messages,
+            "current_channel_id": message.channel.id,
+          },
+          config={"configurable": {
+            "thread_id": message.channel.id,
+            "recursion_limit": 5,
+            "max_provider_calls": remaining_calls,
+          }}
+        )
+      except Exception as e:
+        conversation_messages.append(self.failure_message(e))
+        break
+      provider_calls += (final_state.get("usage") or {}).get("provider_calls", 0)
 
       # 追加されたメッセージを履歴に格納
       new_messages = final_state['messages'][len(conversation_messages):]
@@ -420,22 +985,33 @@ class EventsCog(commands.Cog):
       if response_metadata:
         finish_reason = response_metadata.get("finish_reason")
       if finish_reason == "length":
+        REPLY_RETRIES.labels("length").inc()
+        if provider_calls >= self.MAX_PROVIDER_CALLS_PER_REPLY:
+          logger.error("Token limit reached but the provider call budget is used up")
+          break
         logger.warning("Token limit reached. Compressing history and retrying without tools.")
         if conversation_messages:
           conversation_messages.pop()
         retry_messages = conversation_messages
         if conversation_record_messages is not None:
-          retry_messages = await self.build_compressed_retry_context(conversation_record_messages)
+          retry_messages = await self.prepare_image_context(
+            await self.build_compressed_retry_context(conversation_record_messages),
+            images_to_describe,
+          )
         provider_messages = [
-          LLMMessage(role="system", content=self.bot.meowgent.system_prompt or ""),
-          LLMMessage(role="system", content=f"current_channel_id: {message.channel.id}"),
+          *self.bot.meowgent.context_messages(message.channel.id),
           *retry_messages,
         ]
-        response = await self.bot.meowgent.provider.generate(
-          provider_messages,
-          tools=[],
-          max_tokens=self.current_max_tokens,
-        )
+        try:
+          response = await self.model_provider().generate(
+            provider_messages,
+            tools=[],
+            max_tokens=self.current_max_tokens,
+          )
+        except Exception as e:
+          conversation_messages.append(self.failure_message(e))
+          break
+        provider_calls += 1
         response_message = response.to_message()
         reply_text = self.safe_text_from_content(response_message.content)
         if reply_text == "…":
@@ -447,6 +1023,7 @@ class EventsCog(commands.Cog):
 
       if self.is_tool_message(last_message) or self.get_tool_calls(last_message):
         logger.error("Agent returned a tool call without a final text response")
+        REPLY_RETRIES.labels("tool_call").inc()
         retries += 1
         continue
 
@@ -454,6 +1031,7 @@ class EventsCog(commands.Cog):
       # content が空の場合は再試行
       if not content or (isinstance(content, str) and not content.strip()) or (isinstance(content, list) and len(content) == 0):
         retries += 1
+        REPLY_RETRIES.labels("empty").inc()
         logger.warning(f"Empty content received, retrying ({retries}/{max_retries})")
         continue
 
@@ -466,26 +1044,48 @@ class EventsCog(commands.Cog):
       # 最大リトライ回数超過
       logger.error("Failed to obtain textual response after retries")
 
+    # 説明文づくりもこの返信のモデル呼び出しとして数える
+    if images_to_describe and self.image_cache is not None:
+      provider_calls += self.schedule_image_descriptions(
+        images_to_describe,
+        self.MAX_PROVIDER_CALLS_PER_REPLY - provider_calls,
+      )
+    REPLY_SECONDS.observe(time.perf_counter() - started)
+    REPLY_PROVIDER_CALLS.observe(provider_calls)
     return conversation_messages
 
   async def reply_to(self, message, conversation_messages=None):
-    async with message.channel.typing():
-      messages = await self.get_reply(message, conversation_messages)
-    final_msg = messages[-1]
-    if self.is_tool_message(final_msg) or self.get_tool_calls(final_msg):
-      logger.error("Reply failed: final message is a tool call")
-      return
-    content = self.get_message_content(final_msg)
-    if not content or (isinstance(content, str) and not content.strip()) or (isinstance(content, list) and len(content) == 0):
-      logger.error("Reply failed: final message has no textual content")
+    if not self.accepting_replies:
       return
-    # Format and guard against empty content
-    reply_text = self.safe_text_from_content(content)
-    reply_message = await message.reply(reply_text)
-    self.add_message_to_history(reply_message, role="assistant")
+    with self.track_reply(), TRACER.span("events.reply", root=True, channel_id=message.channel.id) as span:
+      self.trace_event_age(span, message)
+      async with message.channel.typing():
+        messages = await self.get_reply(message, conversation_messages)
+      final_msg = messages[-1]
+      if self.is_tool_message(final_msg) or self.get_tool_calls(final_msg):
+        logger.error("Reply failed: final message is a tool call")
+        return
+      content = self.get_message_content(final_msg)
+      if not content or (isinstance(content, str) and not content.strip()) or (isinstance(content, list) and len(content) == 0):
+        logger.error("Reply failed: final message has no textual content")
+        return
+      # Format and guard against empty content
+      reply_text = self.safe_text_from_content(content)
+      with TRACER.span("discord.reply"):
+        reply_message = await self.bot.outbound.reply(message, reply_text)
+      mark_startup_phase("first_reply")
+      self.add_message_to_history(reply_message, role="assistant")
 
     await self.wait_reply(reply_message, messages)
 
+  def trace_event_age(self, span, message):
+    """ゲートウェイでメッセージが作られてから処理を始めるまでの時間をスパンに記録"""
+    if span is None:
+      return
+    created_at = getattr(message, "created_at", None)
+    if created_at is not None:
+      span.set("event_age_ms", round((discord.utils.utcnow() - created_at).total_seconds() * 1000, 1))
+
   async def wait_reply(self, message, gpt_messages):
     def check(m):
       return (
@@ -493,22 +1093,26 @@ class EventsCog(commands.Cog):
         and m.reference.message_id == message.id
       )
 
+    self.waiting_replies.add(message.id)
     try:
       msg = await self.bot.wait_for('message', timeout=180.0, check=check)
 
       # メッセージがbotから送信された場合
       if msg.author.bot:
-        if random.randint(1, self.RANDOM_REPLY_CHANCE) == 1:  # ランダム返信
+        if self.conversation_budget.allow(msg.channel.id, True, 1 / self.RANDOM_REPLY_CHANCE):  # ランダム返信
           self.add_message_to_history(msg)
           await self.reply_to(msg)
       else:
         # 人間から送信された場合、通常の処理
         self.add_message_to_history(msg)
+        self.conversation_budget.record_human(msg.channel.id)
         await self.reply_to(msg)
 
     except asyncio.TimeoutError:
       # メッセージが一定時間内に返信されなかった場合
       pass
+    finally:
+      self.waiting_replies.discard(message.id)
 
   def safe_text_from_content(self, content) -> str:
     """Extract a safe, non-empty text from model content.
@@ -1,28 +1,200 @@
+import asyncio
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from logging import getLogger
+from pathlib import Path
+from typing import Optional
+
 import discord
 from discord import app_commands
 from discord.ext import commands
 
+from config import get_config
+
+logger = getLogger(__name__)
+
+VOTE_OPTIONS = {
+  "🆗": "Yes",
+  "🙅": "No",
+  "💤": "Abstain",
+  "💢": "No with Veto",
+}
+
+
+@dataclass
+class Proposal:
+  channel_id: int
+  title: str
+  description: str
+  # user_id -> 投票した絵文字。1人1票で、別の選択肢を押したら票を移す
+  votes: dict[int, str] = field(default_factory=dict)
+  counts: Counter = field(default_factory=Counter)
+  dirty: bool = False
+  # 票が変わるたびに増える。保存中に届いた票を取りこぼさないために使う
+  revision: int = 0
+
+  def __post_init__(self):
+    self.counts = Counter(self.votes.values())
+
+  def vote(self, user_id: int, emoji: str) -> bool:
+    previous = self.votes.get(user_id)
+    if previous == emoji:
+      return False
+    if previous is not None:
+      self.counts[previous] -= 1
+    self.votes[user_id] = emoji
+    self.counts[emoji] += 1
+    self.dirty = True
+    self.revision += 1
+    return True
+
+  def unvote(self, user_id: int, emoji: str) -> bool:
+    # 移した後で古いリアクションを外したときは票を消さない
+    if self.votes.get(user_id) != emoji:
+      return False
+    del self.votes[user_id]
+    self.counts[emoji] -= 1
+    self.dirty = True
+    self.revision += 1
+    return True
+
+  def to_dict(self) -> dict:
+    return {
+      "channel_id": self.channel_id,
+      "title": self.title,
+      "description": self.description,
+      "votes": {str(user_id): emoji for user_id, emoji in self.votes.items()},
+    }
+
+  @classmethod
+  def from_dict(cls, data: dict) -> "Proposal":
+    return cls(
+      channel_id=data["channel_id"],
+      title=data["title"],
+      description=data["description"],
+      votes={int(user_id): emoji for user_id, emoji in data.get("votes", {}).items()},
+    )
+
+
+class ProposalStore:
+  """Proposals and their votes, kept in memory and saved to a local JSON file."""
+
+  def __init__(self, path: str):
+    self.path = Path(path)
+    self.proposals: dict[int, Proposal] = {}
+    try:
+      data = json.loads(self.path.read_text())
+    except (OSError, ValueError):
+      data = {}
+    for message_id, proposal in data.items():
+      self.proposals[int(message_id)] = Proposal.from_dict(proposal)
+
+  def get(self, message_id: int) -> Optional[Proposal]:
+    return self.proposals.get(message_id)
+
+  def add(self, message_id: int, proposal: Proposal):
+    self.proposals[message_id] = proposal
+
+  async def save(self):
+    text = json.dumps(
+      {str(message_id): proposal.to_dict() for message_id, proposal in self.proposals.items()},
+      ensure_ascii=False,
+    )
+    await asyncio.to_thread(self._write, text)
+
+  def _write(self, text: str):
+    temporary_path = self.path.with_suffix(self.path.suffix + ".tmp")
+    temporary_path.write_text(text)
+    os.replace(temporary_path, self.path)
+
 
 class ProposalCog(commands.Cog):
+  # 票が動いてから埋め込みを更新するまでの間隔。この間の票はまとめて1回の編集になる
+  EDIT_INTERVAL = 5.0
+  # 保存や編集がこの回数続けて失敗したら諦める
+  MAX_REFRESH_FAILURES = 3
+
   def __init__(self, bot):
     self.bot = bot
+    config = get_config()
+    self.store = ProposalStore(config.sharding.partition_path(config.proposal_store_path))
+    self.refresh_tasks: dict[int, asyncio.Task] = {}
 
   @app_commands.command(name="proposal", description="Governance Proposal")
   @app_commands.describe(title="タイトル", description="提案内容")
   async def proposal(self, interaction, title: str, description: str):
     await interaction.response.defer()
-    embed = discord.Embed(title=title, description=description)
+    proposal = Proposal(channel_id=interaction.channel_id, title=title, description=description)
+
+    message = await interaction.followup.send(embed=self.build_embed(proposal))
+    self.store.add(message.id, proposal)
+    await self.store.save()
+
+    # 送信キューにまとめて積む。優先度とレート制限はキューの側で守る
+    await asyncio.gather(*(self.bot.outbound.add_reaction(message, emoji) for emoji in VOTE_OPTIONS))
+
+  def build_embed(self, proposal: Proposal) -> discord.Embed:
+    embed = discord.Embed(title=proposal.title, description=proposal.description)
     embed.add_field(name="Vote", value="🆗:Yes\n🙅:No \n💤:Abstain\n💢:No with Veto", inline=False)
-    # embed.add_field(name="Yes",value="0")
-    # embed.add_field(name="No",value="0")
-    # embed.add_field(name="Abstain",value="0")
-    # embed.add_field(name="No with Veto",value="0")
+    for emoji, label in VOTE_OPTIONS.items():
+      embed.add_field(name=label, value=str(proposal.counts[emoji]))
+    return embed
+
+  def get_vote(self, payload) -> Optional[tuple[Proposal, str]]:
+    proposal = self.store.get(payload.message_id)
+    if proposal is None or payload.user_id == self.bot.user.id:
+      return None
+    emoji = str(payload.emoji)
+    if emoji not in VOTE_OPTIONS:
+      return None
+    return proposal, emoji
+
+  @commands.Cog.listener()
+  async def on_raw_reaction_add(self, payload):
+    vote = self.get_vote(payload)
+    if vote is not None and vote[0].vote(payload.user_id, vote[1]):
+      self.schedule_refresh(payload.message_id)
+
+  @commands.Cog.listener()
+  async def on_raw_reaction_remove(self, payload):
+    vote = self.get_vote(payload)
+    if vote is not None and vote[0].unvote(payload.user_id, vote[1]):
+      self.schedule_refresh(payload.message_id)
 
-    message = await interaction.followup.send(embed=embed)
-    emoji = "🆗🙅💤💢"
+  def schedule_refresh(self, message_id: int):
+    if message_id not in self.refresh_tasks:
+      self.refresh_tasks[message_id] = asyncio.create_task(self.refresh_later(message_id))
 
-    for i in range(4):
-      await message.add_reaction(emoji[i])
+  async def refresh_later(self, message_id: int):
+    """票が落ち着くまで EDIT_INTERVAL ごとに保存と埋め込みの更新を行う"""
+    failures = 0
+    try:
+      while True:
+        await asyncio.sleep(self.EDIT_INTERVAL)
+        proposal = self.store.get(message_id)
+        if proposal is None or not proposal.dirty:
+          return
+        revision = proposal.revision
+        try:
+          await self.store.save()
+          channel = self.bot.get_channel(proposal.channel_id)
+          if channel is not None:
+            await self.bot.outbound.edit(channel.get_partial_message(message_id), embed=self.build_embed(proposal))
+        except Exception:
+          # 反映できなかったので dirty のまま次の間隔でやり直す
+          failures += 1
+          logger.warning(f"Failed to update proposal {message_id} ({failures}/{self.MAX_REFRESH_FAILURES})", exc_info=True)
+          if failures >= self.MAX_REFRESH_FAILURES:
+            return
+          continue
+        failures = 0
+        # 保存や編集の間に新しい票が届いていれば、次の間隔でもう一度反映する
+        if proposal.revision == revision:
+          proposal.dirty = False
+    finally:
+      self.refresh_tasks.pop(message_id, None)
 
 
 async def setup(bot: commands.Bot):
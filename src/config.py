@@ -1,10 +1,16 @@
+import asyncio
 import os
+import signal
 from dataclasses import dataclass
+from logging import getLogger
+from typing import Callable
 
-from dotenv import load_dotenv
+from dotenv import find_dotenv, load_dotenv
 
+logger = getLogger(__name__)
 
-load_dotenv()
+ENV_PATH = find_dotenv()
+load_dotenv(ENV_PATH)
 
 
 def _int_env(name: str, default: int = 0) -> int:
@@ -28,6 +34,18 @@ def _bool_env(name: str, default: bool = False) -> bool:
   return value.lower() == "true"
 
 
+def _int_list_env(name: str) -> list[int] | None:
+  value = os.environ.get(name)
+  if not value:
+    return None
+  return [int(item) for item in value.split(",") if item.strip()]
+
+
+def _str_list_env(name: str, default: str = "") -> tuple[str, ...]:
+  value = os.environ.get(name, default)
+  return tuple(item.strip() for item in value.split(",") if item.strip())
+
+
 @dataclass(frozen=True)
 class OpenAIConfig:
   api_key: str | None
@@ -36,6 +54,16 @@ class OpenAIConfig:
   max_tokens: int
   temperature: float
 
+  def provider_settings(self) -> dict:
+    """Keyword arguments for OpenAICompatibleChatProvider (and its configure())."""
+    return {
+      "model": self.model,
+      "api_key": self.api_key,
+      "base_url": self.api_url,
+      "max_tokens": self.max_tokens,
+      "temperature": self.temperature,
+    }
+
 
 @dataclass(frozen=True)
 class VoiceNotificationConfig:
@@ -45,19 +73,119 @@ class VoiceNotificationConfig:
   channel_name: str
 
 
+@dataclass(frozen=True)
+class LLMCassetteConfig:
+  mode: str | None
+  path: str
+  speed: float
+
+
+@dataclass(frozen=True)
+class MetricsConfig:
+  enabled: bool
+  host: str
+  port: int
+
+
+@dataclass(frozen=True)
+class TracingConfig:
+  sample_rate: float
+  path: str
+
+
+@dataclass(frozen=True)
+class LoggingConfig:
+  level: str
+  format: str
+  max_length: int
+
+
+@dataclass(frozen=True)
+class ShardingConfig:
+  enabled: bool
+  shard_count: int | None
+  shard_ids: list[int] | None
+  group: int
+
+  def partition_path(self, path: str) -> str:
+    """シャードグループごとに別ファイルにする (jobs.sqlite -> jobs.shard1.sqlite)"""
+    if not self.enabled or self.group == 0:
+      return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{self.group}{ext}"
+
+
+@dataclass(frozen=True)
+class WorkerConfig:
+  enabled: bool
+  queue_path: str
+  max_pending: int
+  lease_seconds: float
+  concurrency: int
+
+
+@dataclass(frozen=True)
+class EventLoopConfig:
+  name: str
+  monitor_enabled: bool
+  stall_threshold_ms: int
+
+
+@dataclass(frozen=True)
+class ImageConfig:
+  cache_dir: str
+  cache_max_bytes: int
+  max_side: int
+  max_per_message: int
+  token_budget: int
+  describe: bool
+
+
+@dataclass(frozen=True)
+class ReplyBudgetConfig:
+  max_bot_chain: int
+  decay: float
+  max_replies: int
+  window_seconds: float
+
+
+@dataclass(frozen=True)
+class ShutdownConfig:
+  snapshot_path: str
+  drain_seconds: float
+
+
 @dataclass(frozen=True)
 class AppConfig:
   discord_token: str | None
   character_prompt: str
+  config_reload_interval: float
+  clock_timezones: tuple[str, ...]
+  tool_selection: bool
   serp_api_key: str | None
   openai: OpenAIConfig
   voice_notification: VoiceNotificationConfig
+  llm_cassette: LLMCassetteConfig
+  metrics: MetricsConfig
+  tracing: TracingConfig
+  logging: LoggingConfig
+  command_sync_state_path: str
+  proposal_store_path: str
+  sharding: ShardingConfig
+  worker: WorkerConfig
+  event_loop: EventLoopConfig
+  images: ImageConfig
+  reply_budget: ReplyBudgetConfig
+  shutdown: ShutdownConfig
 
 
 def load_config() -> AppConfig:
   return AppConfig(
     discord_token=os.environ.get("DISCORD_BOT_TOKEN"),
     character_prompt=os.environ.get("CHARACTER_PROMPT") or "",
+    config_reload_interval=_float_env("CONFIG_RELOAD_INTERVAL", 5),
+    clock_timezones=_str_list_env("CLOCK_TIMEZONES", "Asia/Tokyo"),
+    tool_selection=_bool_env("TOOL_SELECTION", True),
     serp_api_key=os.environ.get("SERP_API_KEY"),
     openai=OpenAIConfig(
       api_key=os.environ.get("OPEN_AI_API_KEY"),
@@ -72,4 +200,138 @@ def load_config() -> AppConfig:
       join_message=os.environ.get("VOICE_JOIN_MESSAGE", "{name}が{channel}に入ったにゃ！"),
       channel_name=os.environ.get("VOICE_NOTIFICATION_CHANNEL", "general"),
     ),
+    llm_cassette=LLMCassetteConfig(
+      mode=os.environ.get("LLM_CASSETTE_MODE") or None,
+      path=os.environ.get("LLM_CASSETTE_PATH", "llm_cassette.jsonl"),
+      speed=_float_env("LLM_CASSETTE_SPEED"),
+    ),
+    metrics=MetricsConfig(
+      enabled=_bool_env("METRICS_ENABLED"),
+      host=os.environ.get("METRICS_HOST", "127.0.0.1"),
+      port=_int_env("METRICS_PORT", 9108),
+    ),
+    tracing=TracingConfig(
+      sample_rate=_float_env("TRACE_SAMPLE_RATE"),
+      path=os.environ.get("TRACE_PATH", "traces.json"),
+    ),
+    logging=LoggingConfig(
+      level=os.environ.get("LOG_LEVEL", "INFO"),
+      format=os.environ.get("LOG_FORMAT", "text"),
+      max_length=_int_env("LOG_MAX_LENGTH", 2000),
+    ),
+    command_sync_state_path=os.environ.get("COMMAND_SYNC_STATE_PATH", ".command_tree.sha256"),
+    proposal_store_path=os.environ.get("PROPOSAL_STORE_PATH", "proposals.json"),
+    sharding=ShardingConfig(
+      enabled=_bool_env("AUTO_SHARD"),
+      shard_count=_int_env("SHARD_COUNT") or None,
+      shard_ids=_int_list_env("SHARD_IDS"),
+      group=_int_env("SHARD_GROUP"),
+    ),
+    worker=WorkerConfig(
+      enabled=_bool_env("WORKER_MODE"),
+      queue_path=os.environ.get("WORK_QUEUE_PATH", "work_queue.sqlite"),
+      max_pending=_int_env("WORK_QUEUE_MAX_PENDING", 100),
+      lease_seconds=_float_env("WORK_QUEUE_LEASE_SECONDS", 300),
+      concurrency=_int_env("WORKER_CONCURRENCY", 4),
+    ),
+    event_loop=EventLoopConfig(
+      name=os.environ.get("EVENT_LOOP", "asyncio"),
+      monitor_enabled=_bool_env("LOOP_MONITOR_ENABLED"),
+      stall_threshold_ms=_int_env("LOOP_STALL_THRESHOLD_MS", 250),
+    ),
+    images=ImageConfig(
+      cache_dir=os.environ.get("IMAGE_CACHE_DIR", ".image_cache"),
+      cache_max_bytes=_int_env("IMAGE_CACHE_MAX_MB", 100) * 1024 * 1024,
+      max_side=_int_env("IMAGE_MAX_SIDE", 1024),
+      max_per_message=_int_env("IMAGE_MAX_PER_MESSAGE", 4),
+      token_budget=_int_env("IMAGE_TOKEN_BUDGET", 2000),
+      describe=_bool_env("IMAGE_DESCRIBE", True),
+    ),
+    reply_budget=ReplyBudgetConfig(
+      max_bot_chain=_int_env("BOT_CHAIN_MAX", 3),
+      decay=_float_env("BOT_CHAIN_DECAY", 0.5),
+      max_replies=_int_env("CHANNEL_REPLY_LIMIT", 20),
+      window_seconds=_float_env("CHANNEL_REPLY_WINDOW_SECONDS", 600),
+    ),
+    shutdown=ShutdownConfig(
+      snapshot_path=os.environ.get("STATE_SNAPSHOT_PATH", "state_snapshot.json"),
+      drain_seconds=_float_env("SHUTDOWN_DRAIN_SECONDS", 20),
+    ),
   )
+
+
+ReloadListener = Callable[[AppConfig, AppConfig], None]
+
+_config: AppConfig | None = None
+_reload_listeners: list[ReloadListener] = []
+
+
+def get_config() -> AppConfig:
+  """Return the current config. It is replaced as a whole on reload, so readers never see a half-updated one."""
+  global _config
+  if _config is None:
+    _config = load_config()
+  return _config
+
+
+def add_reload_listener(listener: ReloadListener):
+  _reload_listeners.append(listener)
+
+
+def remove_reload_listener(listener: ReloadListener):
+  if listener in _reload_listeners:
+    _reload_listeners.remove(listener)
+
+
+def reload_config() -> AppConfig:
+  """Re-read .env and the environment, swap in the new config and notify listeners.
+
+  Values in .env take precedence over the process environment on reload.
+  If the new values can't be parsed the current config is kept.
+  """
+  global _config
+  old_config = get_config()
+  try:
+    load_dotenv(ENV_PATH, override=True)
+    new_config = load_config()
+  except Exception:
+    logger.exception("Failed to reload config. Keeping the current one.")
+    return old_config
+  _config = new_config
+  for listener in list(_reload_listeners):
+    try:
+      listener(old_config, new_config)
+    except Exception:
+      logger.exception(f"Config reload listener {listener!r} failed")
+  logger.info("Config reloaded.")
+  return new_config
+
+
+def _env_mtime() -> float | None:
+  try:
+    return os.stat(ENV_PATH).st_mtime if ENV_PATH else None
+  except OSError:
+    return None
+
+
+async def watch_config(interval: float):
+  """.env が書き換えられたら読み直す"""
+  last_mtime = _env_mtime()
+  while True:
+    await asyncio.sleep(interval)
+    mtime = _env_mtime()
+    if mtime != last_mtime:
+      last_mtime = mtime
+      reload_config()
+
+
+def install_reload_triggers(loop: asyncio.AbstractEventLoop) -> asyncio.Task | None:
+  """Reload on SIGHUP and, when CONFIG_RELOAD_INTERVAL is set, whenever .env changes."""
+  try:
+    loop.add_signal_handler(signal.SIGHUP, reload_config)
+  except (AttributeError, NotImplementedError, RuntimeError):
+    logger.warning("SIGHUP is not available. Config reload only follows .env changes.")
+  interval = get_config().config_reload_interval
+  if interval > 0 and ENV_PATH:
+    return loop.create_task(watch_config(interval))
+  return None
@@ -0,0 +1,94 @@
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from logging import getLogger
+
+from metrics import LLM_CALLS_PREVENTED
+
+logger = getLogger(__name__)
+
+
+@dataclass
+class ChannelBudget:
+  # 人間の発言を挟まずに、他のbotへ返信した回数
+  bot_chain: int = 0
+  last_bot_reply: float = 0.0
+  replies: deque = field(default_factory=deque)
+
+
+class ConversationBudget:
+  """Per-channel limits on how often the bot starts an LLM run.
+
+  Replies to other bots get less likely with every turn of a bot-to-bot
+  chain (``decay`` per turn) and stop at ``max_bot_chain`` until a human
+  speaks or the chain goes quiet for ``window`` seconds. Replies to bots
+  and random replies are also capped at ``max_replies`` per channel per
+  ``window``. Humans talking to the bot directly are always answered and
+  don't go through the budget, so they never use up the channel's limit.
+  """
+
+  def __init__(
+    self,
+    max_bot_chain: int = 3,
+    decay: float = 0.5,
+    max_replies: int = 20,
+    window: float = 600.0,
+    rng: random.Random | None = None,
+    clock=time.monotonic,
+  ):
+    self.max_bot_chain = max_bot_chain
+    self.decay = decay
+    self.max_replies = max_replies
+    self.window = window
+    self.rng = rng or random
+    self.clock = clock
+    self._channels: dict[int, ChannelBudget] = {}
+
+  def _channel(self, channel_id: int, now: float) -> ChannelBudget:
+    budget = self._channels.setdefault(channel_id, ChannelBudget())
+    while budget.replies and now - budget.replies[0] > self.window:
+      budget.replies.popleft()
+    if budget.bot_chain and now - budget.last_bot_reply > self.window:
+      budget.bot_chain = 0
+    return budget
+
+  def record_human(self, channel_id: int):
+    """人間が発言したらbot同士の応酬は途切れたとみなす"""
+    budget = self._channels.get(channel_id)
+    if budget is not None:
+      budget.bot_chain = 0
+
+  def allow(self, channel_id: int, from_bot: bool, probability: float = 1.0) -> bool:
+    """Decide whether to reply and, if so, count the reply against the channel's budget.
+
+    ``probability`` is the chance the caller would reply without a budget.
+    """
+    now = self.clock()
+    budget = self._channel(channel_id, now)
+    roll = self.rng.random()
+    if roll >= probability:
+      return False
+
+    if from_bot and budget.bot_chain >= self.max_bot_chain:
+      return self._prevent(channel_id, "bot_chain")
+    if from_bot and roll >= probability * self.decay ** budget.bot_chain:
+      return self._prevent(channel_id, "decay")
+    if len(budget.replies) >= self.max_replies:
+      return self._prevent(channel_id, "channel_limit")
+
+    budget.replies.append(now)
+    if from_bot:
+      budget.bot_chain += 1
+      budget.last_bot_reply = now
+    return True
+
+  def bot_chain(self, channel_id: int) -> int:
+    budget = self._channels.get(channel_id)
+    return budget.bot_chain if budget else 0
+
+  @staticmethod
+  def _prevent(channel_id: int, reason: str) -> bool:
+    LLM_CALLS_PREVENTED.labels(reason).inc()
+    logger.debug(f"Skipped a reply in channel {channel_id} ({reason})")
+    return False
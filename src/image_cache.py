@@ -0,0 +1,217 @@
+import asyncio
+import base64
+import hashlib
+import json
+import math
+from collections import OrderedDict
+from logging import getLogger
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
+
+from metrics import IMAGE_CACHE_REQUESTS
+
+logger = getLogger(__name__)
+
+# OpenAIの画像トークン計算 (detail=low は固定、high は512pxのタイル数に比例)
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+
+Fetcher = Callable[[str], Awaitable[tuple[bytes, str]]]
+
+
+def thumbnail_url(attachment, max_side: int) -> str:
+  """Return a Discord media proxy URL that serves the attachment scaled to fit ``max_side``."""
+  url = getattr(attachment, "proxy_url", None) or attachment.url
+  width = getattr(attachment, "width", None)
+  height = getattr(attachment, "height", None)
+  if not width or not height:
+    return url
+  scale = min(1.0, max_side / max(width, height))
+  parts = urlsplit(url)
+  query = parse_qs(parts.query)
+  query["width"] = [str(max(1, round(width * scale)))]
+  query["height"] = [str(max(1, round(height * scale)))]
+  return urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+
+
+def cache_key(url: str) -> str:
+  """Discordの署名付きURLは取得するたびにクエリが変わるので、パスとサイズだけで識別する"""
+  parts = urlsplit(url)
+  query = parse_qs(parts.query)
+  size = "x".join(query.get(name, [""])[0] for name in ("width", "height"))
+  return f"{parts.netloc}{parts.path}?{size}"
+
+
+def image_size(url: str) -> Optional[tuple[int, int]]:
+  query = parse_qs(urlsplit(url).query)
+  try:
+    return int(query["width"][0]), int(query["height"][0])
+  except (KeyError, ValueError):
+    return None
+
+
+def estimate_image_tokens(size: Optional[tuple[int, int]], detail: str) -> int:
+  if detail == "low":
+    return LOW_DETAIL_TOKENS
+  width, height = size or (1024, 1024)
+  scale = min(1.0, 2048 / max(width, height))
+  width, height = width * scale, height * scale
+  scale = min(1.0, 768 / min(width, height))
+  width, height = width * scale, height * scale
+  return LOW_DETAIL_TOKENS + TILE_TOKENS * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def choose_details(sizes: list[Optional[tuple[int, int]]], budget: int) -> list[Optional[str]]:
+  """Pick a detail level for each image, newest last in ``sizes``.
+
+  Newer images get ``high`` while the budget allows, then ``low``; images
+  that no longer fit get ``None`` and should be left out.
+  """
+  details: list[Optional[str]] = [None] * len(sizes)
+  remaining = budget
+  for index in range(len(sizes) - 1, -1, -1):
+    for detail in ("high", "low"):
+      cost = estimate_image_tokens(sizes[index], detail)
+      if cost <= remaining:
+        details[index] = detail
+        remaining -= cost
+        break
+  return details
+
+
+async def fetch_url(url: str) -> tuple[bytes, str]:
+  import aiohttp
+
+  async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+    async with session.get(url) as response:
+      response.raise_for_status()
+      return await response.read(), response.content_type
+
+
+class ImageCache:
+  """Content-addressed on-disk cache of downscaled attachment images.
+
+  Files are named by the sha256 of their bytes and evicted least recently
+  used first once ``max_bytes`` is exceeded. Textual descriptions of
+  images are kept alongside so later turns can send text instead.
+  """
+
+  def __init__(self, directory: str | Path, max_bytes: int, fetcher: Fetcher = fetch_url):
+    # ディレクトリは最初に書き込むときに作る
+    self.directory = Path(directory)
+    self.max_bytes = max_bytes
+    self.fetcher = fetcher
+    self._index_path = self.directory / "index.json"
+    # cache_key -> {"digest", "mime", "size", "description"}。並び順がLRU
+    self._entries: OrderedDict[str, dict] = OrderedDict()
+    self._fetching: dict[str, asyncio.Task] = {}
+    # index.json の書き込みを1つずつにする
+    self._save_lock = asyncio.Lock()
+    self._load()
+
+  def _load(self):
+    try:
+      entries = json.loads(self._index_path.read_text())
+    except (OSError, ValueError):
+      return
+    for key, entry in entries.items():
+      digest = entry.get("digest")
+      if digest and not (self.directory / digest).exists():
+        entry.update(digest=None, size=0)
+      if entry.get("digest") or entry.get("description"):
+        self._entries[key] = entry
+
+  async def _save(self, remove: tuple[Path, ...] = ()):
+    async with self._save_lock:
+      # インデックスはループのスレッドで文字列にしてから、書き込みだけ別スレッドで行う
+      text = json.dumps(self._entries, ensure_ascii=False)
+
+      def write():
+        for path in remove:
+          path.unlink(missing_ok=True)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._index_path.write_text(text)
+
+      await asyncio.to_thread(write)
+
+  @property
+  def total_bytes(self) -> int:
+    return sum(entry.get("size", 0) for entry in self._entries.values())
+
+  def description(self, url: str) -> Optional[str]:
+    entry = self._entries.get(cache_key(url))
+    return entry.get("description") if entry else None
+
+  async def set_description(self, url: str, description: str):
+    entry = self._entries.setdefault(cache_key(url), {"digest": None, "mime": None, "size": 0})
+    entry["description"] = description
+    await self._save()
+
+  async def data_url(self, url: str) -> Optional[str]:
+    """Return the image as a data URL, downloading it on first use. ``None`` if it can't be fetched."""
+    key = cache_key(url)
+    entry = self._entries.get(key)
+    if entry and entry.get("digest"):
+      try:
+        data = await asyncio.to_thread((self.directory / entry["digest"]).read_bytes)
+        self._entries.move_to_end(key)
+        IMAGE_CACHE_REQUESTS.labels("hit").inc()
+        return self._to_data_url(data, entry["mime"])
+      except OSError:
+        entry.update(digest=None, size=0)
+
+    task = self._fetching.get(key)
+    if task is None:
+      task = self._fetching[key] = asyncio.create_task(self._fetch(key, url))
+      task.add_done_callback(lambda _: self._fetching.pop(key, None))
+    try:
+      data, mime = await task
+    except Exception:
+      IMAGE_CACHE_REQUESTS.labels("error").inc()
+      logger.warning(f"Failed to fetch image {key}", exc_info=True)
+      return None
+    IMAGE_CACHE_REQUESTS.labels("miss").inc()
+    return self._to_data_url(data, mime)
+
+  async def _fetch(self, key: str, url: str) -> tuple[bytes, str]:
+    data, mime = await self.fetcher(url)
+    digest = hashlib.sha256(data).hexdigest()
+    path = self.directory / digest
+    if not path.exists():
+      def write():
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(data)
+
+      await asyncio.to_thread(write)
+    entry = self._entries.setdefault(key, {})
+    entry.update(digest=digest, mime=mime, size=len(data))
+    self._entries.move_to_end(key)
+    await self._save(remove=self._evict())
+    return data, mime
+
+  def _evict(self) -> tuple[Path, ...]:
+    """Drop least recently used images until the cache fits ``max_bytes``; return files to delete."""
+    total = self.total_bytes
+    removed = []
+    for key in list(self._entries):
+      if total <= self.max_bytes:
+        break
+      entry = self._entries[key]
+      if not entry.get("size"):
+        continue
+      total -= entry["size"]
+      digest = entry["digest"]
+      if entry.get("description"):
+        # 説明文は小さいので残し、画像だけ消す
+        entry.update(digest=None, size=0)
+      else:
+        del self._entries[key]
+      # 同じ画像を別のURLから参照していることがあるので、最後の参照が消えたときだけファイルを消す
+      if not any(other.get("digest") == digest for other in self._entries.values()):
+        removed.append(self.directory / digest)
+    return tuple(removed)
+
+  @staticmethod
+  def _to_data_url(data: bytes, mime: str) -> str:
+    return f"data:{mime or 'image/png'};base64,{base64.b64encode(data).decode('ascii')}"
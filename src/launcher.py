@@ -0,0 +1,130 @@
+"""Run Meowgent as several processes, each owning a group of gateway shards.
+
+  uv run python src/launcher.py --processes 4
+  uv run python src/launcher.py --processes 2 --workers 2
+
+Each child process runs src/bot.py as an AutoShardedBot with its own
+SHARD_IDS, so gateway handling, context building and LLM orchestration
+for different guilds run on different cores. With --workers, every shard
+group also gets that many src/worker.py processes and runs in WORKER_MODE.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+from logging import basicConfig, getLogger, INFO
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+logger = getLogger(__name__)
+
+BOT_PATH = Path(__file__).resolve().parent / "bot.py"
+WORKER_PATH = Path(__file__).resolve().parent / "worker.py"
+RESTART_BACKOFF = (1, 5, 15, 60)
+
+
+def split_shards(shard_count: int, processes: int) -> list[list[int]]:
+  """Distribute shard IDs round-robin so each process gets a similar number of guilds."""
+  processes = max(1, min(processes, shard_count))
+  return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+
+def recommended_shard_count(token: str) -> int:
+  import requests
+
+  response = requests.get(
+    "https://discord.com/api/v10/gateway/bot",
+    headers={"Authorization": f"Bot {token}"},
+    timeout=10,
+  )
+  response.raise_for_status()
+  return int(response.json()["shards"])
+
+
+def child_environment(shard_count: int, shard_ids: list[int], group: int, workers: int = 0) -> dict[str, str]:
+  env = dict(os.environ)
+  env["AUTO_SHARD"] = "true"
+  env["SHARD_COUNT"] = str(shard_count)
+  env["SHARD_IDS"] = ",".join(str(shard_id) for shard_id in shard_ids)
+  env["SHARD_GROUP"] = str(group)
+  if workers:
+    env["WORKER_MODE"] = "true"
+  return env
+
+
+def build_children(shard_count: int, groups: list[list[int]], workers: int = 0) -> dict[str, tuple[Path, dict[str, str]]]:
+  """プロセス名 -> (実行するスクリプト, 環境変数)"""
+  children = {}
+  for group, shard_ids in enumerate(groups):
+    env = child_environment(shard_count, shard_ids, group, workers)
+    children[f"shard-group-{group}"] = (BOT_PATH, env)
+    for index in range(workers):
+      children[f"worker-{group}-{index}"] = (WORKER_PATH, env)
+  return children
+
+
+def spawn(name: str, script: Path, env: dict[str, str]) -> subprocess.Popen:
+  logger.info(f"Starting {name} (shards {env['SHARD_IDS']})")
+  return subprocess.Popen([sys.executable, str(script)], env=env)
+
+
+def supervise(specs: dict[str, tuple[Path, dict[str, str]]]):
+  children = {name: spawn(name, *spec) for name, spec in specs.items()}
+  restarts = {name: 0 for name in children}
+  stopping = False
+
+  def stop(signum, frame):
+    nonlocal stopping
+    stopping = True
+    for child in children.values():
+      if child.poll() is None:
+        child.send_signal(signum)
+
+  def reload(signum, frame):
+    # 設定の再読み込みは子プロセスに任せる
+    for child in children.values():
+      if child.poll() is None:
+        child.send_signal(signum)
+
+  signal.signal(signal.SIGINT, stop)
+  signal.signal(signal.SIGTERM, stop)
+  signal.signal(signal.SIGHUP, reload)
+
+  while children:
+    time.sleep(1)
+    for name, child in list(children.items()):
+      code = child.poll()
+      if code is None:
+        continue
+      if stopping:
+        del children[name]
+        continue
+      delay = RESTART_BACKOFF[min(restarts[name], len(RESTART_BACKOFF) - 1)]
+      restarts[name] += 1
+      logger.warning(f"{name} exited with {code}. Restarting in {delay}s.")
+      time.sleep(delay)
+      children[name] = spawn(name, *specs[name])
+
+
+def main(argv=None):
+  basicConfig(level=INFO)
+  load_dotenv()
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+  parser.add_argument("--workers", type=int, default=0, help="LLM worker processes per shard group (enables WORKER_MODE).")
+  parser.add_argument("--shards", type=int, default=None, help="Total shard count (default: SHARD_COUNT or Discord's recommendation).")
+  args = parser.parse_args(argv)
+
+  shard_count = args.shards or int(os.environ.get("SHARD_COUNT") or 0)
+  if not shard_count:
+    shard_count = recommended_shard_count(os.environ["DISCORD_BOT_TOKEN"])
+  groups = split_shards(shard_count, args.processes)
+  logger.info(f"Running {shard_count} shards in {len(groups)} processes")
+  supervise(build_children(shard_count, groups, args.workers))
+
+
+if __name__ == "__main__":
+  main()
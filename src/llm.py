@@ -1,14 +1,16 @@
 import inspect
 import json
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from typing import Any, Callable, Optional, Protocol
 
-from openai import AsyncOpenAI
+from metrics import PROVIDER_ERRORS, observe_llm_response
+from tracing import TRACER
 
 MessageContent = str | list[dict[str, Any]]
 
 
-@dataclass
+@dataclass(slots=True)
 class LLMMessage:
   role: str
   content: Optional[MessageContent] = None
@@ -16,8 +18,17 @@ class LLMMessage:
   tool_call_id: Optional[str] = None
   name: Optional[str] = None
   response_metadata: Optional[dict[str, Any]] = None
+  _openai: Optional[dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)
+
+  def __setattr__(self, name: str, value: Any):
+    # 変更されたらリクエスト用の辞書を作り直す
+    object.__setattr__(self, name, value)
+    object.__setattr__(self, "_openai", None)
 
   def to_openai(self) -> dict[str, Any]:
+    """Return the request dict. It is cached, so treat it as read-only."""
+    if self._openai is not None:
+      return self._openai
     message = {"role": self.role}
     if self.content is not None:
       message["content"] = self.content
@@ -27,6 +38,7 @@ class LLMMessage:
       message["tool_call_id"] = self.tool_call_id
     if self.name and self.role != "tool":
       message["name"] = self.name
+    object.__setattr__(self, "_openai", message)
     return message
 
   def __getitem__(self, key: str) -> Any:
@@ -39,6 +51,7 @@ class LLMResponse:
   tool_calls: list[dict[str, Any]]
   finish_reason: Optional[str]
   raw: Any
+  usage: Optional[dict[str, int]] = None
 
   def to_message(self) -> LLMMessage:
     return LLMMessage(
@@ -49,22 +62,68 @@ class LLMResponse:
     )
 
 
+def estimate_tokens(text: str) -> int:
+  """Rough token count (about 4 bytes of UTF-8 per token)."""
+  return (len(text.encode("utf-8")) + 3) // 4
+
+
+def encode_compact(value: Any) -> str:
+  return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def project_fields(value: Any, fields: tuple[str, ...]) -> Any:
+  if isinstance(value, dict):
+    return {key: value[key] for key in fields if key in value}
+  if isinstance(value, list):
+    return [project_fields(item, fields) for item in value]
+  return value
+
+
 @dataclass
 class ToolDefinition:
   name: str
   description: str
   parameters: dict[str, Any]
   handler: Callable[..., Any]
+  # 結果のうちモデルに渡す項目と、渡す最大文字数
+  result_fields: Optional[tuple[str, ...]] = None
+  result_budget: Optional[int] = 4000
+  # 最新のユーザー発言にどれかが含まれるときだけスキーマを送る (空なら毎回送る)
+  keywords: tuple[str, ...] = ()
+  _openai_tool: Optional[dict[str, Any]] = field(default=None, init=False, repr=False, compare=False)
 
   def to_openai_tool(self) -> dict[str, Any]:
-    return {
-      "type": "function",
-      "function": {
-        "name": self.name,
-        "description": self.description,
-        "parameters": self.parameters,
-      },
-    }
+    if self._openai_tool is None:
+      self._openai_tool = {
+        "type": "function",
+        "function": {
+          "name": self.name,
+          "description": self.description,
+          "parameters": self.parameters,
+        },
+      }
+    return self._openai_tool
+
+  def encode_result(self, result: Any) -> tuple[str, bool]:
+    """Encode a handler result for a tool message.
+
+    Keeps only ``result_fields``, uses compact JSON and fits the text into
+    ``result_budget`` characters, dropping trailing list items before
+    cutting the text. Returns the text and whether anything was cut.
+    """
+    if isinstance(result, str):
+      text = result
+    else:
+      if self.result_fields:
+        result = project_fields(result, self.result_fields)
+      text = encode_compact(result)
+      if self.result_budget and isinstance(result, list):
+        while len(text) > self.result_budget and len(result) > 1:
+          result = result[:-1]
+          text = encode_compact(result)
+    if self.result_budget and len(text) > self.result_budget:
+      return f"{text[:self.result_budget]}…(truncated {len(text) - self.result_budget} chars)", True
+    return text, False
 
   async def ainvoke(self, args: Any) -> Any:
     if args is None:
@@ -72,10 +131,11 @@ class ToolDefinition:
     if not isinstance(args, dict):
       args = {"input": args}
 
-    result = self.handler(**args)
-    if inspect.isawaitable(result):
-      return await result
-    return result
+    with TRACER.span("tool.ainvoke", tool=self.name):
+      result = self.handler(**args)
+      if inspect.isawaitable(result):
+        return await result
+      return result
 
 
 class LLMProvider(Protocol):
@@ -98,13 +158,29 @@ class OpenAICompatibleChatProvider:
     max_tokens: Optional[int] = None,
     temperature: Optional[float] = None,
   ):
+    self.client = None
+    self.configure(model, api_key, base_url, max_tokens, temperature)
+
+  def configure(
+    self,
+    model: Optional[str] = None,
+    api_key: Optional[str] = None,
+    base_url: Optional[str] = None,
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+  ):
+    """Apply new settings. Requests already in flight keep the settings they started with."""
+    if self.client is None or (api_key, base_url or None) != self._credentials:
+      # openaiの読み込みは重いので、プロバイダを作るときまで遅らせる
+      from openai import AsyncOpenAI
+      self.client = AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url or None,
+      )
+      self._credentials = (api_key, base_url or None)
     self.model = model
     self.max_tokens = max_tokens
     self.temperature = temperature
-    self.client = AsyncOpenAI(
-      api_key=api_key,
-      base_url=base_url or None,
-    )
 
   async def generate(
     self,
@@ -113,8 +189,11 @@ class OpenAICompatibleChatProvider:
     max_tokens: Optional[int] = None,
     tool_choice: Optional[str | dict[str, Any]] = None,
   ) -> LLMResponse:
+    # 設定の再読み込みで途中から変わらないよう、最初に読んだ値を使う
+    model = self.model
+    client = self.client
     request = {
-      "model": self.model,
+      "model": model,
       "messages": [to_llm_message(message).to_openai() for message in messages],
     }
     request_max_tokens = max_tokens if max_tokens is not None else self.max_tokens
@@ -127,7 +206,14 @@ class OpenAICompatibleChatProvider:
     if tool_choice is not None:
       request["tool_choice"] = tool_choice
 
-    completion = await self._create_completion(request)
+    with TRACER.span("llm.generate", model=model, messages=len(messages)) as span:
+      started = time.perf_counter()
+      try:
+        completion = await self._create_completion(request, client)
+      except Exception:
+        PROVIDER_ERRORS.labels(model or "unknown").inc()
+        raise
+      elapsed = time.perf_counter() - started
     choice = completion.choices[0]
     message = choice.message
     tool_calls = []
@@ -140,15 +226,21 @@ class OpenAICompatibleChatProvider:
           "arguments": tool_call.function.arguments,
         },
       })
-    return LLMResponse(
+    response = LLMResponse(
       content=message.content,
       tool_calls=tool_calls,
       finish_reason=choice.finish_reason,
       raw=completion,
+      usage=to_usage_dict(getattr(completion, "usage", None)),
     )
+    observe_llm_response(model, elapsed, response)
+    if span is not None:
+      span.set("finish_reason", response.finish_reason)
+      span.set("usage", response.usage)
+    return response
 
-  async def _create_completion(self, request: dict[str, Any]):
-    return await self.client.chat.completions.create(**request)
+  async def _create_completion(self, request: dict[str, Any], client=None):
+    return await (client or self.client).chat.completions.create(**request)
 
 
 def to_llm_message(message: LLMMessage | dict[str, Any]) -> LLMMessage:
@@ -164,6 +256,15 @@ def to_llm_message(message: LLMMessage | dict[str, Any]) -> LLMMessage:
   )
 
 
+def to_usage_dict(usage: Any) -> Optional[dict[str, int]]:
+  if usage is None:
+    return None
+  return {
+    "prompt_tokens": getattr(usage, "prompt_tokens", None) or 0,
+    "completion_tokens": getattr(usage, "completion_tokens", None) or 0,
+  }
+
+
 def parse_tool_arguments(arguments: Any) -> dict[str, Any]:
   if arguments is None:
     return {}
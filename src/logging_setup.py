@@ -0,0 +1,143 @@
+import atexit
+import hashlib
+import json
+import logging
+import queue
+import re
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Optional
+
+DATA_URL_PATTERN = re.compile(r"data:([\w/+.-]+);base64,[A-Za-z0-9+/=]{64,}")
+SECRET_PATTERN = re.compile(r"\b(sk-[A-Za-z0-9_-]{8})[A-Za-z0-9_-]{8,}")
+
+# LogRecordが標準で持つ属性。これ以外は extra として JSON に含める
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def _digest(text: str) -> str:
+  return hashlib.sha256(text.encode("utf-8", "replace")).hexdigest()[:12]
+
+
+def redact(text: str, max_length: int) -> str:
+  """Mask secrets and inline images, then truncate ``text`` to ``max_length`` characters.
+
+  Truncated text keeps a hash of the full payload so identical payloads
+  can still be correlated across log lines.
+  """
+  text = DATA_URL_PATTERN.sub(lambda match: f"data:{match.group(1)};base64,<{_digest(match.group(0))}>", text)
+  text = SECRET_PATTERN.sub(r"\1***", text)
+  if max_length and len(text) > max_length:
+    return f"{text[:max_length]}…(+{len(text) - max_length} chars, sha256:{_digest(text)})"
+  return text
+
+
+class LazyQueueHandler(QueueHandler):
+  """Hand records to the listener thread without formatting them.
+
+  The stock QueueHandler renders the message on the calling thread, which
+  here is the event loop. Formatting is left to the listener instead, so
+  arguments that may still change (anything but plain values and
+  LazyPayload) are turned into strings here first.
+  """
+
+  def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+    if record.exc_info and not record.exc_text:
+      # tracebackは呼び出し元のスレッドで文字列にしておく
+      record.exc_text = logging.Formatter().formatException(record.exc_info)
+    record.exc_info = None
+    if isinstance(record.args, tuple):
+      record.args = tuple(snapshot_arg(arg) for arg in record.args)
+    elif isinstance(record.args, dict):
+      record.args = {key: snapshot_arg(value) for key, value in record.args.items()}
+    return record
+
+
+def snapshot_arg(arg):
+  if arg is None or isinstance(arg, (str, int, float, LazyPayload)):
+    return arg
+  return str(arg)
+
+
+class RedactingFormatter(logging.Formatter):
+  def __init__(self, fmt: Optional[str] = None, max_length: int = 2000):
+    super().__init__(fmt or "%(asctime)s %(levelname)s %(name)s: %(message)s")
+    self.max_length = max_length
+
+  def format(self, record: logging.LogRecord) -> str:
+    record.message = redact(record.getMessage(), self.max_length)
+    if self.usesTime():
+      record.asctime = self.formatTime(record)
+    text = self.formatMessage(record)
+    if record.exc_text:
+      text = f"{text}\n{record.exc_text}"
+    return text
+
+
+class JsonFormatter(RedactingFormatter):
+  def format(self, record: logging.LogRecord) -> str:
+    payload: dict[str, Any] = {
+      "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+      "level": record.levelname,
+      "logger": record.name,
+      "msg": redact(record.getMessage(), self.max_length),
+    }
+    for key, value in vars(record).items():
+      if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+        payload[key] = value if isinstance(value, (int, float, bool)) or value is None else redact(str(value), self.max_length)
+    if record.exc_text:
+      payload["exc"] = record.exc_text
+    return json.dumps(payload, ensure_ascii=False)
+
+
+class LazyPayload:
+  """Defer rendering of a large log argument until a handler formats it.
+
+  Rendering happens on the logging thread, so ``args`` must not change
+  after the call; pass a snapshot rather than objects the loop mutates.
+  """
+
+  __slots__ = ("function", "args")
+
+  def __init__(self, function, *args):
+    self.function = function
+    self.args = args
+
+  def __str__(self) -> str:
+    return str(self.function(*self.args))
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(level: str = "INFO", log_format: str = "text", max_length: int = 2000, stream=None) -> QueueListener:
+  """Route all logging through a queue drained by a background writer thread."""
+  global _listener
+  stop_logging()
+
+  formatter = JsonFormatter(max_length=max_length) if log_format == "json" else RedactingFormatter(max_length=max_length)
+  stream_handler = logging.StreamHandler(stream or sys.stderr)
+  stream_handler.setFormatter(formatter)
+
+  log_queue: queue.SimpleQueue = queue.SimpleQueue()
+  root = logging.getLogger()
+  for handler in list(root.handlers):
+    root.removeHandler(handler)
+  root.addHandler(LazyQueueHandler(log_queue))
+  root.setLevel(level.upper())
+
+  _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+  _listener.start()
+  return _listener
+
+
+def stop_logging():
+  """Flush queued records and stop the writer thread."""
+  global _listener
+  if _listener is not None:
+    _listener.stop()
+    _listener = None
+
+
+atexit.register(stop_logging)
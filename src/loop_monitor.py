@@ -0,0 +1,101 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from logging import getLogger
+from typing import Optional
+
+from metrics import EVENT_LOOP_LAG_SECONDS, EVENT_LOOP_STALL_SECONDS
+
+logger = getLogger(__name__)
+
+
+def install_event_loop(name: str) -> str:
+  """Install the requested event loop policy and return the one in effect.
+
+  uvloop is optional; when it isn't installed the default asyncio loop is kept.
+  """
+  if name != "uvloop":
+    return "asyncio"
+  try:
+    import uvloop
+  except ImportError:
+    logger.warning("EVENT_LOOP=uvloop but uvloop is not installed. Using the default asyncio loop.")
+    return "asyncio"
+  asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+  logger.info("Using uvloop event loop.")
+  return "uvloop"
+
+
+@dataclass
+class LoopStall:
+  started_at: float
+  duration: float
+  stack: str
+
+
+class LoopMonitor:
+  """Detect event loop stalls and record what the loop was running.
+
+  A heartbeat task on the loop stamps the time every ``interval`` seconds.
+  A watchdog thread notices when the stamp stops moving for longer than
+  ``threshold`` and grabs the loop thread's stack at that moment, which
+  points at the blocking call inside the offending coroutine.
+  """
+
+  def __init__(self, threshold: float = 0.25, interval: float = 0.1, history: int = 20):
+    self.threshold = threshold
+    self.interval = interval
+    self.stalls: deque[LoopStall] = deque(maxlen=history)
+    self._last_beat = time.monotonic()
+    self._loop_thread_id: Optional[int] = None
+    self._stack: Optional[str] = None
+    self._stop = threading.Event()
+    self._heartbeat: Optional[asyncio.Task] = None
+    self._watchdog: Optional[threading.Thread] = None
+
+  def start(self) -> "LoopMonitor":
+    self._loop_thread_id = threading.get_ident()
+    self._last_beat = time.monotonic()
+    self._heartbeat = asyncio.get_running_loop().create_task(self._beat())
+    self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+    self._watchdog.start()
+    logger.info("Event loop monitor started (stall threshold %.0f ms)", self.threshold * 1000)
+    return self
+
+  def stop(self):
+    self._stop.set()
+    if self._heartbeat is not None:
+      self._heartbeat.cancel()
+    if self._watchdog is not None:
+      self._watchdog.join(timeout=1)
+
+  async def _beat(self):
+    while True:
+      self._last_beat = time.monotonic()
+      await asyncio.sleep(self.interval)
+      lag = max(0.0, time.monotonic() - self._last_beat - self.interval)
+      EVENT_LOOP_LAG_SECONDS.observe(lag)
+      if lag >= self.threshold:
+        self._record_stall(lag)
+
+  def _record_stall(self, lag: float):
+    stack = self._stack or "<stack not captured>"
+    self._stack = None
+    self.stalls.append(LoopStall(started_at=self._last_beat + self.interval, duration=lag, stack=stack))
+    EVENT_LOOP_STALL_SECONDS.observe(lag)
+    logger.warning("Event loop stalled for %.0f ms in:\n%s", lag * 1000, stack)
+
+  def _watch(self):
+    while not self._stop.wait(self.interval / 2):
+      if self._stack is not None:
+        continue
+      if time.monotonic() - self._last_beat - self.interval < self.threshold:
+        continue
+      # ループのスレッドが止まっている間に、何を実行しているかを取っておく
+      frame = sys._current_frames().get(self._loop_thread_id)
+      if frame is not None:
+        self._stack = "".join(traceback.format_stack(frame))
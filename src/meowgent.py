@@ -1,23 +1,46 @@
 import asyncio
 import json
-from logging import getLogger
+import time
+from logging import DEBUG, getLogger
 from typing import Callable, List
 
 from llm import (
   LLMMessage,
   LLMProvider,
-  ToolDefinition,
+  encode_compact,
+  estimate_tokens,
   parse_tool_arguments,
   to_llm_message,
 )
+from logging_setup import LazyPayload
+from metrics import (
+  AGENT_FINAL_ITERATIONS,
+  TOOL_CALL_ERRORS,
+  TOOL_CALL_REPEATS,
+  TOOL_CALL_SECONDS,
+  TOOL_RESULT_TOKENS_SAVED,
+  TOOL_RESULT_TRUNCATIONS,
+)
+from tools.get_current_time import clock_context
+from tools.registry import CURRENT_CHANNEL_ID, ToolRegistry
+from tracing import traced
 
 logger = getLogger(__name__)
 
 
+def message_contents(messages) -> list:
+  return [message.content for message in messages]
+
+
 class MeowgentApp:
   def __init__(self, meowgent: "Meowgent"):
     self.meowgent = meowgent
 
+  @property
+  def provider(self):
+    """Provider for single model calls made next to the agent runs."""
+    return self.meowgent.provider
+
   async def ainvoke(self, state, config=None):
     return await self.meowgent.ainvoke(state, config=config)
 
@@ -30,8 +53,10 @@ class MeowgentApp:
 
 
 class Meowgent:
-  def __init__(self, provider: LLMProvider, tools, system_prompt, checkpointer=None):
+  def __init__(self, provider: LLMProvider, tools, system_prompt, checkpointer=None, clock_timezones=()):
     self.system_prompt = system_prompt
+    # よく使うタイムゾーンの現在時刻は毎回システムメッセージに入れ、時刻を聞くだけのツール呼び出しを省く
+    self.clock_timezones = tuple(clock_timezones)
     self.provider = provider
     self.model = provider
     self.checkpointer = checkpointer
@@ -39,62 +64,137 @@ class Meowgent:
     self.stamina = self.max_stamina
     self._stamina_updated_listeners: List[Callable[[int, int], None]] = []  # スタミナ変更リスナー
     self._stamina_recovery_task = None  # スタミナ回復用のタスク
-    self.tools: dict[str, ToolDefinition] = {tool.name: tool for tool in tools}
+    # ツールの一覧を渡された場合は、そのツールだけを持つレジストリにする
+    self.tools: ToolRegistry = tools if isinstance(tools, ToolRegistry) else ToolRegistry.from_tools(tools)
     self.app = MeowgentApp(self)
     logger.info("Meowgent runtime has been initialized.")
 
+  def context_messages(self, channel_id, system_prompt=None) -> list[LLMMessage]:
+    """System messages placed before the conversation on every run."""
+    messages = [
+      LLMMessage(role="system", content=(self.system_prompt if system_prompt is None else system_prompt) or ""),
+      LLMMessage(role="system", content=f"current_channel_id: {channel_id}"),
+    ]
+    clock = clock_context(self.clock_timezones)
+    if clock:
+      messages.append(LLMMessage(role="system", content=clock))
+    return messages
+
+  @traced("meowgent.ainvoke")
   async def ainvoke(self, state, config=None):
     configurable = (config or {}).get("configurable", {})
     recursion_limit = configurable.get("recursion_limit", 5)
     channel_id = state["current_channel_id"]
     conversation_messages = [to_llm_message(message) for message in state["messages"]]
+    # ワーカープロセスではジョブごとにゲートウェイ側のシステムプロンプトを受け取る
+    system_prompt = state.get("system_prompt", self.system_prompt)
     messages = [
-      LLMMessage(role="system", content=self.system_prompt or ""),
-      LLMMessage(role="system", content=f"current_channel_id: {channel_id}"),
+      *self.context_messages(channel_id, system_prompt),
       *conversation_messages,
     ]
     output_messages = list(conversation_messages)
-
-    for _ in range(recursion_limit):
-      logger.info(f"[ainvoke] Messages passed to the provider: {[message.content for message in messages]}")
-      response = await self.provider.generate(messages, list(self.tools.values()))
+    usage = {"provider_calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "stamina": 0}
+
+    # 1回の返信で使えるモデル呼び出しの残り (get_replyのリトライをまたいで数える)
+    max_provider_calls = configurable.get("max_provider_calls")
+    limit = recursion_limit if max_provider_calls is None else min(recursion_limit, max_provider_calls)
+    tool_results: dict[str, str] = {}
+    force_final = False
+    # 関係ありそうなツールのスキーマだけを送る
+    tools = await self.tools.aselect(conversation_messages)
+
+    for iteration in range(limit):
+      # 最後の1回はツールを使わせずに答えさせる
+      final = force_final or iteration == limit - 1
+      if final and tools:
+        AGENT_FINAL_ITERATIONS.labels("repeat" if force_final else "limit").inc()
+      if logger.isEnabledFor(DEBUG):
+        # メッセージはこの後も書き換わるので、中身の一覧だけを渡して文字列にするのは書き出すスレッドに任せる
+        logger.debug("[ainvoke] Messages passed to the provider: %s", LazyPayload(str, message_contents(messages)))
+      response = await self.provider.generate(
+        messages,
+        tools,
+        tool_choice="none" if final and tools else None,
+      )
+      usage["provider_calls"] += 1
+      if response.usage:
+        usage["prompt_tokens"] += response.usage.get("prompt_tokens", 0)
+        usage["completion_tokens"] += response.usage.get("completion_tokens", 0)
       assistant_message = response.to_message()
       messages.append(assistant_message)
       output_messages.append(assistant_message)
-      logger.info(f"[ainvoke] Response from the provider: {response.raw}")
+      logger.info(
+        "[ainvoke] Provider responded: finish_reason=%s tool_calls=%d usage=%s",
+        response.finish_reason,
+        len(response.tool_calls),
+        response.usage,
+      )
+      if logger.isEnabledFor(DEBUG):
+        logger.debug("[ainvoke] Response from the provider: %s", response.raw)
       await self.reduce_stamina(5) # スタミナ使う
+      usage["stamina"] += 5
 
       if not response.tool_calls:
-        return {"messages": output_messages}
+        return {"messages": output_messages, "usage": usage}
+      if final:
+        break
 
       logger.info("[ainvoke] Tool calls have been detected.")
-      await self.reduce_stamina(5) # スタミナ使う
       for tool_call in response.tool_calls:
         function = tool_call.get("function", {})
         tool_name = function.get("name")
         tool_args = parse_tool_arguments(function.get("arguments"))
         tool_id = tool_call.get("id")
-        tool = self.tools.get(tool_name)
-        try:
-          if tool is None:
-            result = f"Tool {tool_name} not found"
-          else:
-            result = await tool.ainvoke(tool_args)
-        except Exception as e:
-          logger.exception(f"Tool {tool_name} execution failed: {e}")
-          result = str(e)
+        signature = f"{tool_name}:{json.dumps(tool_args, sort_keys=True, ensure_ascii=False, default=str)}"
+        content = tool_results.get(signature)
+        if content is not None:
+          # 同じ呼び出しを繰り返しているので、前の結果を渡して次で答えさせる
+          TOOL_CALL_REPEATS.labels(tool_name).inc()
+          logger.info("[ainvoke] Repeated tool call %s. Reusing the previous result.", tool_name)
+          force_final = True
+        else:
+          tool = self.tools.get(tool_name)
+          started = time.perf_counter()
+          channel_token = CURRENT_CHANNEL_ID.set(channel_id)
+          try:
+            if tool is None:
+              TOOL_CALL_ERRORS.labels(tool_name).inc()
+              result = f"Tool {tool_name} not found"
+            else:
+              result = await tool.ainvoke(tool_args)
+          except Exception as e:
+            TOOL_CALL_ERRORS.labels(tool_name).inc()
+            logger.exception(f"Tool {tool_name} execution failed: {e}")
+            result = str(e)
+          finally:
+            CURRENT_CHANNEL_ID.reset(channel_token)
+          TOOL_CALL_SECONDS.labels(tool_name).observe(time.perf_counter() - started)
+          content = tool_results[signature] = self.encode_tool_result(tool, tool_name, result)
 
         tool_message = LLMMessage(
           role="tool",
-          content=json.dumps(result, ensure_ascii=False) if not isinstance(result, str) else result,
+          content=content,
           tool_call_id=tool_id,
           name=tool_name,
         )
         messages.append(tool_message)
         output_messages.append(tool_message)
 
-    logger.error("Meowgent recursion limit reached before final response.")
-    return {"messages": output_messages}
+    logger.error("Meowgent stopped before a final response (provider calls: %s).", usage["provider_calls"])
+    return {"messages": output_messages, "usage": usage}
+
+  def encode_tool_result(self, tool, tool_name: str, result) -> str:
+    """ツールの結果を予算内の短い文字列にし、以前の形式より減ったトークン数を記録する"""
+    if tool is None:
+      return result if isinstance(result, str) else encode_compact(result)
+    content, truncated = tool.encode_result(result)
+    if truncated:
+      TOOL_RESULT_TRUNCATIONS.labels(tool_name).inc()
+    if not isinstance(result, str):
+      saved = estimate_tokens(json.dumps(result, ensure_ascii=False, default=str)) - estimate_tokens(content)
+      if saved > 0:
+        TOOL_RESULT_TOKENS_SAVED.labels(tool_name).inc(saved)
+    return content
 
   def add_stamina_listener(self, listener: Callable[[int, int], None]):
     """スタミナ変更時に呼び出されるリスナーを追加"""
@@ -110,7 +210,7 @@ class Meowgent:
 
   async def reduce_stamina(self, amount):
     self.stamina = max(0, self.stamina - amount)
-    logger.info(f"Stamina reduced by {amount}. Current stamina: {self.stamina}")
+    logger.info("Stamina reduced by %s. Current stamina: %s", amount, self.stamina)
     await self._notify_stamina_change()
 
   async def recover_stamina(self, amount):
@@ -0,0 +1,364 @@
+import abc
+import asyncio
+import bisect
+import math
+import time
+from logging import getLogger
+from typing import Callable, Iterable, Optional
+
+logger = getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+  if math.isnan(value):
+    return "NaN"
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  if value == int(value):
+    return str(int(value))
+  return repr(value)
+
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+  pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+  if extra:
+    pairs.append(extra)
+  return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric(abc.ABC):
+  type_name = "untyped"
+
+  def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = ()):
+    self.name = name
+    self.help = help_text
+    self.labelnames = tuple(labelnames)
+    self._children: dict[tuple[str, ...], object] = {}
+
+  def labels(self, *values, **kwargs):
+    """Return the child for the given label values, creating it on first use."""
+    if kwargs:
+      values = tuple(str(kwargs[name]) for name in self.labelnames)
+    else:
+      values = tuple(str(value) for value in values)
+    child = self._children.get(values)
+    if child is None:
+      if len(values) != len(self.labelnames):
+        raise ValueError(f"{self.name} expects labels {self.labelnames}")
+      child = self._children[values] = self._new_child()
+    return child
+
+  @abc.abstractmethod
+  def _new_child(self):
+    ...
+
+  def _unlabeled(self):
+    return self.labels()
+
+  def render(self) -> list[str]:
+    lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+    for values, child in self._children.items():
+      lines.extend(self._render_child(values, child))
+    return lines
+
+  def _render_child(self, values, child) -> list[str]:
+    return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"]
+
+
+class _Value:
+  __slots__ = ("value", "function")
+
+  def __init__(self):
+    self.value = 0.0
+    self.function: Optional[Callable[[], float]] = None
+
+  def inc(self, amount: float = 1.0):
+    self.value += amount
+
+  def dec(self, amount: float = 1.0):
+    self.value -= amount
+
+  def set(self, value: float):
+    self.value = value
+
+  def set_function(self, function: Callable[[], float]):
+    """Evaluate ``function`` at scrape time instead of tracking the value."""
+    self.function = function
+
+  def get(self) -> float:
+    if self.function is not None:
+      try:
+        return float(self.function())
+      except Exception:
+        return float("nan")
+    return self.value
+
+
+class Counter(_Metric):
+  type_name = "counter"
+
+  def _new_child(self):
+    return _Value()
+
+  def inc(self, amount: float = 1.0):
+    self._unlabeled().inc(amount)
+
+
+class Gauge(_Metric):
+  type_name = "gauge"
+
+  def _new_child(self):
+    return _Value()
+
+  def inc(self, amount: float = 1.0):
+    self._unlabeled().inc(amount)
+
+  def dec(self, amount: float = 1.0):
+    self._unlabeled().dec(amount)
+
+  def set(self, value: float):
+    self._unlabeled().set(value)
+
+  def set_function(self, function: Callable[[], float]):
+    self._unlabeled().set_function(function)
+
+
+class _HistogramValue:
+  __slots__ = ("buckets", "counts", "sum", "count")
+
+  def __init__(self, buckets: tuple[float, ...]):
+    self.buckets = buckets
+    self.counts = [0] * (len(buckets) + 1)
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value: float):
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+
+class Histogram(_Metric):
+  type_name = "histogram"
+
+  def __init__(self, name: str, help_text: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+    super().__init__(name, help_text, labelnames)
+    self.buckets = tuple(sorted(buckets))
+
+  def _new_child(self):
+    return _HistogramValue(self.buckets)
+
+  def observe(self, value: float):
+    self._unlabeled().observe(value)
+
+  def _render_child(self, values, child) -> list[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip((*self.buckets, float("inf")), child.counts):
+      cumulative += count
+      le = f'le="{_format_value(bound)}"'
+      lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+    labels = _format_labels(self.labelnames, values)
+    lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+    lines.append(f"{self.name}_count{labels} {child.count}")
+    return lines
+
+
+class MetricsRegistry:
+  def __init__(self):
+    self._metrics: dict[str, _Metric] = {}
+
+  def _register(self, metric: _Metric):
+    if metric.name in self._metrics:
+      return self._metrics[metric.name]
+    self._metrics[metric.name] = metric
+    return metric
+
+  def counter(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Counter:
+    return self._register(Counter(name, help_text, labelnames))
+
+  def gauge(self, name: str, help_text: str, labelnames: Iterable[str] = ()) -> Gauge:
+    return self._register(Gauge(name, help_text, labelnames))
+
+  def histogram(
+    self,
+    name: str,
+    help_text: str,
+    labelnames: Iterable[str] = (),
+    buckets: Iterable[float] = DEFAULT_BUCKETS,
+  ) -> Histogram:
+    return self._register(Histogram(name, help_text, labelnames, buckets))
+
+  def render(self) -> str:
+    lines = []
+    for metric in self._metrics.values():
+      lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+PROVIDER_REQUEST_SECONDS = REGISTRY.histogram(
+  "meowgent_provider_request_seconds", "LLM provider request latency.", ["model"],
+)
+PROVIDER_ERRORS = REGISTRY.counter(
+  "meowgent_provider_errors_total", "LLM provider requests that raised.", ["model"],
+)
+PROVIDER_TOKENS = REGISTRY.counter(
+  "meowgent_provider_tokens_total", "Tokens reported by the LLM provider.", ["model", "type"],
+)
+PROVIDER_FINISH_REASONS = REGISTRY.counter(
+  "meowgent_provider_finish_reason_total", "Completions by finish_reason.", ["finish_reason"],
+)
+TOOL_CALL_SECONDS = REGISTRY.histogram(
+  "meowgent_tool_call_seconds", "Tool execution latency.", ["tool"],
+)
+TOOL_CALL_ERRORS = REGISTRY.counter(
+  "meowgent_tool_call_errors_total", "Tool executions that raised or were not found.", ["tool"],
+)
+TOOL_CALL_REPEATS = REGISTRY.counter(
+  "meowgent_tool_call_repeats_total", "Identical tool calls answered from the earlier result.", ["tool"],
+)
+AGENT_FINAL_ITERATIONS = REGISTRY.counter(
+  "meowgent_agent_final_iterations_total", "Agent iterations sent with tool_choice=none.", ["reason"],
+)
+REPLY_PROVIDER_CALLS = REGISTRY.histogram(
+  "meowgent_reply_provider_calls", "Provider calls spent on one reply, including retries.",
+  buckets=(1, 2, 3, 4, 5, 6, 8, 10, 15),
+)
+TOOL_SCHEMAS_OMITTED = REGISTRY.counter(
+  "meowgent_tool_schemas_omitted_total", "Tool schemas left out of a request as irrelevant.", ["tool"],
+)
+TOOL_RESULT_TOKENS_SAVED = REGISTRY.counter(
+  "meowgent_tool_result_tokens_saved_total", "Estimated prompt tokens saved by projecting and compactly encoding tool results.", ["tool"],
+)
+TOOL_RESULT_TRUNCATIONS = REGISTRY.counter(
+  "meowgent_tool_result_truncations_total", "Tool results cut down to the tool's result budget.", ["tool"],
+)
+REPLY_RETRIES = REGISTRY.counter(
+  "meowgent_reply_retries_total", "Agent reruns in EventsCog.get_reply.", ["reason"],
+)
+REPLY_FAILURES = REGISTRY.counter(
+  "meowgent_reply_failures_total", "Replies answered with the fallback because the model call raised.", ["error"],
+)
+REPLY_COMPRESSIONS = REGISTRY.counter(
+  "meowgent_reply_compressions_total", "Length retries that compressed history.", ["result"],
+)
+BACKGROUND_SUMMARIES = REGISTRY.counter(
+  "meowgent_background_summaries_total", "Idle channel summaries made for later retries.", ["result"],
+)
+REPLY_SECONDS = REGISTRY.histogram(
+  "meowgent_reply_seconds", "Time spent producing a reply in EventsCog.get_reply.",
+)
+LLM_CALLS_PREVENTED = REGISTRY.counter(
+  "meowgent_llm_calls_prevented_total", "Replies skipped by the per-channel conversation budget.", ["reason"],
+)
+MESSAGES_CLASSIFIED = REGISTRY.counter(
+  "meowgent_messages_classified_total", "Incoming messages by on_message pre-classification.", ["action"],
+)
+HISTORY_FETCHES = REGISTRY.counter(
+  "meowgent_history_fetches_total", "Discord channel history fetches.", ["result"],
+)
+HISTORY_FETCH_SECONDS = REGISTRY.histogram(
+  "meowgent_history_fetch_seconds", "Discord channel history fetch latency.",
+)
+SCHEDULED_RUN_SECONDS = REGISTRY.histogram(
+  "meowgent_scheduled_run_seconds", "Latency from a scheduled prompt firing to its reply.",
+)
+SCHEDULED_PROMPTS = REGISTRY.counter(
+  "meowgent_scheduled_prompts_total", "Scheduled prompts executed.", ["result"],
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+  "meowgent_queue_depth", "Items waiting in internal queues.", ["queue"],
+)
+OUTBOUND_QUEUE_SECONDS = REGISTRY.histogram(
+  "meowgent_outbound_queue_seconds", "Time Discord sends waited in the outbound queue.", ["kind"],
+)
+OUTBOUND_MERGED = REGISTRY.counter(
+  "meowgent_outbound_merged_total", "Pending sends folded into another message.",
+)
+WORK_QUEUE_JOBS = REGISTRY.counter(
+  "meowgent_work_queue_jobs_total", "Jobs handed to worker processes by outcome.", ["result"],
+)
+WORK_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+  "meowgent_work_queue_wait_seconds", "Time from submitting a job until its result came back.",
+)
+IMAGE_CACHE_REQUESTS = REGISTRY.counter(
+  "meowgent_image_cache_requests_total", "Image cache lookups by result.", ["result"],
+)
+IMAGE_CONTEXT_PARTS = REGISTRY.counter(
+  "meowgent_image_context_parts_total", "Images in model context by how they were sent.", ["mode"],
+)
+STAMINA = REGISTRY.gauge(
+  "meowgent_stamina", "Current Meowgent stamina.",
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+  "meowgent_startup_seconds", "Seconds from process start until each startup phase was first reached.", ["phase"],
+)
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+  "meowgent_event_loop_lag_seconds", "Extra delay observed by the event loop lag sampler.",
+  buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+EVENT_LOOP_STALL_SECONDS = REGISTRY.histogram(
+  "meowgent_event_loop_stall_seconds", "Event loop stalls longer than LOOP_STALL_THRESHOLD_MS.",
+  buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+
+_startup_origin = time.monotonic()
+_startup_phases: set[str] = set()
+
+
+def set_startup_origin(origin: float):
+  global _startup_origin
+  _startup_origin = origin
+
+
+def mark_startup_phase(phase: str):
+  """起動からその段階に初めて到達するまでの時間を記録 (2回目以降は無視)"""
+  if phase in _startup_phases:
+    return
+  _startup_phases.add(phase)
+  elapsed = time.monotonic() - _startup_origin
+  STARTUP_SECONDS.labels(phase).set(elapsed)
+  logger.info("Startup phase %s reached after %.2fs", phase, elapsed)
+
+
+def observe_llm_response(model: Optional[str], elapsed: float, response) -> None:
+  model = model or "unknown"
+  PROVIDER_REQUEST_SECONDS.labels(model).observe(elapsed)
+  PROVIDER_FINISH_REASONS.labels(str(response.finish_reason)).inc()
+  if response.usage:
+    PROVIDER_TOKENS.labels(model, "prompt").inc(response.usage.get("prompt_tokens", 0))
+    PROVIDER_TOKENS.labels(model, "completion").inc(response.usage.get("completion_tokens", 0))
+
+
+async def sample_event_loop_lag(interval: float = 0.5):
+  """sleepが予定よりどれだけ遅れて戻ったかをイベントループの遅延として記録"""
+  loop = asyncio.get_running_loop()
+  while True:
+    started = loop.time()
+    await asyncio.sleep(interval)
+    EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
+
+
+async def start_metrics_server(host: str, port: int, registry: MetricsRegistry = REGISTRY):
+  """Serve ``registry`` in the Prometheus text format on ``/metrics``."""
+  from aiohttp import web
+
+  async def handle_metrics(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+  app = web.Application()
+  app.router.add_get("/metrics", handle_metrics)
+  runner = web.AppRunner(app, access_log=None)
+  await runner.setup()
+  await web.TCPSite(runner, host, port).start()
+  logger.info(f"Metrics endpoint is listening on http://{host}:{port}/metrics")
+  return runner
@@ -0,0 +1,230 @@
+import asyncio
+import heapq
+import itertools
+import time
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Optional
+
+from metrics import OUTBOUND_MERGED, OUTBOUND_QUEUE_SECONDS, QUEUE_DEPTH
+
+logger = getLogger(__name__)
+
+# 数字が小さいほど先に送る
+PRIORITY_REPLY = 0
+PRIORITY_CHAT = 1
+PRIORITY_NOTIFICATION = 2
+PRIORITY_REACTION = 3
+
+MAX_MESSAGE_LENGTH = 2000
+
+
+class RateLimitBucket:
+  """Token bucket approximating a Discord per-channel rate limit.
+
+  discord.py doesn't expose the rate limit headers of successful requests,
+  so the rate is a fixed estimate. When Discord answers 429 anyway,
+  ``pause`` empties the bucket for the ``retry_after`` it sent.
+  """
+
+  def __init__(self, rate: int, per: float):
+    self.rate = rate
+    self.per = per
+    self.tokens = float(rate)
+    self.updated = time.monotonic()
+    self.paused_until = 0.0
+
+  def pause(self, seconds: float):
+    self.tokens = 0.0
+    self.updated = time.monotonic()
+    self.paused_until = max(self.paused_until, self.updated + seconds)
+
+  def _refill(self):
+    now = time.monotonic()
+    self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+    self.updated = now
+
+  async def acquire(self):
+    while True:
+      paused = self.paused_until - time.monotonic()
+      if paused > 0:
+        await asyncio.sleep(paused)
+        continue
+      self._refill()
+      if self.tokens >= 1:
+        self.tokens -= 1
+        return
+      await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+  """Seconds Discord asked us to wait, if ``error`` is a rate limit (discord.RateLimited or an HTTP 429)."""
+  seconds = getattr(error, "retry_after", None)
+  if seconds is not None:
+    return float(seconds)
+  if getattr(error, "status", None) != 429:
+    return None
+  headers = getattr(getattr(error, "response", None), "headers", None) or {}
+  for name in ("X-RateLimit-Reset-After", "Retry-After"):
+    try:
+      return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+      continue
+  return 1.0
+
+
+@dataclass(order=True)
+class OutboundJob:
+  priority: int
+  sequence: int
+  kind: str = field(compare=False)
+  bucket: str = field(compare=False)
+  content: Any = field(compare=False)
+  run: Callable[[Any], Awaitable[Any]] = field(compare=False)
+  merge_key: Optional[str] = field(default=None, compare=False)
+  future: asyncio.Future = field(default=None, compare=False)
+  enqueued_at: float = field(default_factory=time.monotonic, compare=False)
+  attempts: int = field(default=0, compare=False)
+
+
+class OutboundQueue:
+  """Per-channel outbound queue for Discord sends, replies and reactions.
+
+  Each channel has one worker that drains its jobs in priority order and
+  waits on local estimates of Discord's per-channel buckets, so bursts
+  queue up here instead of stalling callers inside discord.py's 429
+  handling. A 429 that gets through pauses the bucket and resends the job.
+  Pending notifications that share a merge_key go out as one message.
+  """
+
+  MESSAGE_RATE = (5, 5.0)
+  REACTION_RATE = (1, 0.25)
+  # 429が返ってきたときに送り直す回数
+  MAX_RATE_LIMIT_RETRIES = 3
+
+  def __init__(self):
+    self._pending: dict[int, list[OutboundJob]] = {}
+    self._workers: dict[int, asyncio.Task] = {}
+    self._buckets: dict[tuple[int, str], RateLimitBucket] = {}
+    self._sequence = itertools.count()
+    QUEUE_DEPTH.labels("outbound").set_function(self.pending_count)
+
+  def pending_count(self) -> int:
+    return sum(len(jobs) for jobs in self._pending.values())
+
+  async def send(self, channel, content: str, priority: int = PRIORITY_CHAT, merge_key: Optional[str] = None, **kwargs):
+    return await self._enqueue(
+      channel.id,
+      "send",
+      "message",
+      priority,
+      content,
+      lambda text: channel.send(text, **kwargs),
+      merge_key=merge_key,
+    )
+
+  async def reply(self, message, content: str, priority: int = PRIORITY_REPLY, **kwargs):
+    return await self._enqueue(
+      message.channel.id,
+      "reply",
+      "message",
+      priority,
+      content,
+      lambda text: message.reply(text, **kwargs),
+    )
+
+  async def add_reaction(self, message, emoji, priority: int = PRIORITY_REACTION):
+    return await self._enqueue(
+      message.channel.id,
+      "reaction",
+      "reaction",
+      priority,
+      emoji,
+      message.add_reaction,
+    )
+
+  async def edit(self, message, priority: int = PRIORITY_NOTIFICATION, **kwargs):
+    return await self._enqueue(
+      message.channel.id,
+      "edit",
+      "message",
+      priority,
+      None,
+      lambda _: message.edit(**kwargs),
+    )
+
+  async def _enqueue(self, channel_id, kind, bucket, priority, content, run, merge_key=None):
+    job = OutboundJob(
+      priority=priority,
+      sequence=next(self._sequence),
+      kind=kind,
+      bucket=bucket,
+      content=content,
+      run=run,
+      merge_key=merge_key,
+      future=asyncio.get_running_loop().create_future(),
+    )
+    heapq.heappush(self._pending.setdefault(channel_id, []), job)
+    if channel_id not in self._workers:
+      self._workers[channel_id] = asyncio.create_task(self._drain(channel_id))
+    return await job.future
+
+  def _take_batch(self, jobs: list[OutboundJob]) -> list[OutboundJob]:
+    batch = [heapq.heappop(jobs)]
+    if batch[0].merge_key is None:
+      return batch
+    length = len(batch[0].content)
+    while jobs and jobs[0].merge_key == batch[0].merge_key:
+      length += len(jobs[0].content) + 1
+      if length > MAX_MESSAGE_LENGTH:
+        break
+      batch.append(heapq.heappop(jobs))
+    return batch
+
+  def _bucket(self, channel_id: int, name: str) -> RateLimitBucket:
+    bucket = self._buckets.get((channel_id, name))
+    if bucket is None:
+      rate, per = self.REACTION_RATE if name == "reaction" else self.MESSAGE_RATE
+      bucket = self._buckets[(channel_id, name)] = RateLimitBucket(rate, per)
+    return bucket
+
+  async def _drain(self, channel_id: int):
+    jobs = self._pending[channel_id]
+    try:
+      while jobs:
+        # 枠が空くのを待ってから取り出すことで、待っている間に届いた返信を優先し、通知もまとめられる
+        await self._bucket(channel_id, jobs[0].bucket).acquire()
+        batch = self._take_batch(jobs)
+        first = batch[0]
+        content = "\n".join(job.content for job in batch) if len(batch) > 1 else first.content
+        if len(batch) > 1:
+          OUTBOUND_MERGED.inc(len(batch) - 1)
+        now = time.monotonic()
+        for job in batch:
+          OUTBOUND_QUEUE_SECONDS.labels(job.kind).observe(now - job.enqueued_at)
+        try:
+          result = await first.run(content)
+        except Exception as e:
+          wait = retry_after(e)
+          if wait is not None and first.attempts < self.MAX_RATE_LIMIT_RETRIES:
+            # Discordの本当の枠に合わせて待ってから、同じ順番で送り直す
+            logger.warning(f"Rate limited in channel {channel_id}; retrying in {wait:.2f}s")
+            self._bucket(channel_id, first.bucket).pause(wait)
+            for job in batch:
+              job.attempts += 1
+              heapq.heappush(jobs, job)
+            continue
+          for job in batch:
+            if not job.future.done():
+              job.future.set_exception(e)
+          continue
+        for job in batch:
+          if not job.future.done():
+            job.future.set_result(result)
+    finally:
+      del self._workers[channel_id]
+      self._pending.pop(channel_id, None)
+      # キャンセルされた場合に待っている呼び出し元を取り残さない
+      for job in jobs:
+        if not job.future.done():
+          job.future.cancel()
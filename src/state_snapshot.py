@@ -0,0 +1,39 @@
+import json
+import os
+from datetime import datetime, timezone
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Optional
+
+logger = getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(path: str | Path, state: dict[str, Any]):
+  """Write ``state`` atomically so a crash mid-write never leaves a broken snapshot."""
+  path = Path(path)
+  temporary_path = path.with_suffix(path.suffix + ".tmp")
+  data = {"version": SNAPSHOT_VERSION, "saved_at": datetime.now(timezone.utc).isoformat(), **state}
+  temporary_path.write_text(json.dumps(data, ensure_ascii=False, default=str))
+  os.replace(temporary_path, path)
+  logger.info(f"Saved state snapshot to {path}")
+
+
+def load_snapshot(path: str | Path) -> Optional[dict[str, Any]]:
+  """Read and remove the snapshot, so a later crash doesn't bring back stale state."""
+  path = Path(path)
+  try:
+    data = json.loads(path.read_text())
+  except FileNotFoundError:
+    return None
+  except (OSError, ValueError):
+    logger.warning(f"Ignoring unreadable state snapshot {path}", exc_info=True)
+    return None
+  finally:
+    path.unlink(missing_ok=True)
+  if data.get("version") != SNAPSHOT_VERSION:
+    logger.warning(f"Ignoring state snapshot {path} with version {data.get('version')}")
+    return None
+  logger.info(f"Loaded state snapshot saved at {data.get('saved_at')}")
+  return data
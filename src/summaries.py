@@ -0,0 +1,76 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from llm import LLMMessage, LLMProvider, LLMResponse, ToolDefinition
+
+
+class BackgroundLane:
+  """Low-priority access to a provider for maintenance work.
+
+  At most ``concurrency`` calls run at once, and a call only starts while
+  ``is_busy()`` is false so background work never competes with replies
+  someone is waiting for.
+  """
+
+  def __init__(
+    self,
+    provider: LLMProvider,
+    concurrency: int = 1,
+    is_busy: Callable[[], bool] = lambda: False,
+    poll_interval: float = 0.5,
+  ):
+    self.provider = provider
+    self.is_busy = is_busy
+    self.poll_interval = poll_interval
+    self._slots = asyncio.Semaphore(concurrency)
+
+  async def generate(
+    self,
+    messages: list[LLMMessage | dict[str, Any]],
+    tools: Optional[list[ToolDefinition]] = None,
+    max_tokens: Optional[int] = None,
+    tool_choice: Optional[str | dict[str, Any]] = None,
+  ) -> LLMResponse:
+    async with self._slots:
+      while self.is_busy():
+        await asyncio.sleep(self.poll_interval)
+      return await self.provider.generate(messages, tools=tools, max_tokens=max_tokens, tool_choice=tool_choice)
+
+
+@dataclass
+class ChannelSummary:
+  # 要約に含めた最後のメッセージ
+  last_message_id: int
+  text: str
+  created_at: float = field(default_factory=time.monotonic)
+
+
+class SummaryCache:
+  """Latest background or retry summary per channel, least recently used dropped first."""
+
+  def __init__(self, max_channels: int = 1000):
+    self.max_channels = max_channels
+    self._summaries: OrderedDict[int, ChannelSummary] = OrderedDict()
+
+  def get(self, channel_id: int) -> Optional[ChannelSummary]:
+    return self._summaries.get(channel_id)
+
+  def put(self, channel_id: int, summary: ChannelSummary):
+    self._summaries[channel_id] = summary
+    self._summaries.move_to_end(channel_id)
+    while len(self._summaries) > self.max_channels:
+      self._summaries.popitem(last=False)
+
+  def lookup(self, channel_id: int, messages: list) -> Optional[tuple[str, list]]:
+    """Return the cached summary and the messages it doesn't cover, if it covers any of ``messages``."""
+    summary = self._summaries.get(channel_id)
+    if summary is None:
+      return None
+    for index, message in enumerate(messages):
+      if message.message_id == summary.last_message_id:
+        self._summaries.move_to_end(channel_id)
+        return summary.text, messages[index + 1:]
+    return None
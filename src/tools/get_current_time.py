@@ -1,6 +1,19 @@
 from datetime import datetime
+from functools import lru_cache
 import pytz
 
+from llm import ToolDefinition
+
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S %Z%z"
+CLOCK_CONTEXT_PREFIX = "current_time:"
+
+
+@lru_cache(maxsize=64)
+def get_timezone(timezone_name: str):
+  # タイムゾーンの読み込みはファイルを読むので、一度作ったものを使い回す
+  return pytz.timezone(timezone_name)
+
+
 def get_current_time(timezone_name="Asia/Tokyo"):
   """
   Get current time in the specified timezone.
@@ -8,13 +21,54 @@ def get_current_time(timezone_name="Asia/Tokyo"):
   """
   try:
     # 指定されたタイムゾーンを取得
-    timezone = pytz.timezone(timezone_name)
+    timezone = get_timezone(timezone_name)
   except pytz.UnknownTimeZoneError:
     return {"error": f"Unknown timezone: {timezone_name}"}
 
   # 現在時刻を指定されたタイムゾーンで取得
   current_time = datetime.now(timezone)
-  return current_time.strftime("%Y-%m-%d %H:%M:%S %Z%z")
+  return current_time.strftime(TIME_FORMAT)
+
+
+def clock_context(timezone_names, now: datetime = None) -> str:
+  """Current time in each configured timezone, for the system context. Unknown zones are skipped."""
+  now = now or datetime.now(pytz.utc)
+  lines = []
+  for timezone_name in timezone_names:
+    try:
+      timezone = get_timezone(timezone_name)
+    except pytz.UnknownTimeZoneError:
+      continue
+    lines.append(f"{timezone_name}: {now.astimezone(timezone).strftime(TIME_FORMAT)}")
+  if not lines:
+    return ""
+  return CLOCK_CONTEXT_PREFIX + "\n" + "\n".join(lines)
+
+
+GET_CURRENT_TIME_TOOL = ToolDefinition(
+  name="get_current_time",
+  description=(
+    "Get current time in the specified timezone. "
+    "The current time in common timezones is already in the system context; "
+    "only call this for other timezones."
+  ),
+  parameters={
+    "type": "object",
+    "properties": {
+      "timezone_name": {
+        "type": "string",
+        "description": "Timezone name, e.g. America/New_York.",
+      },
+    },
+    "required": ["timezone_name"],
+  },
+  handler=get_current_time,
+  keywords=("time", "timezone", "時刻", "時間", "何時", "時差"),
+)
+
+
+def get_tools(context):
+  return [GET_CURRENT_TIME_TOOL]
 
 
 if __name__ == '__main__':
@@ -22,3 +76,4 @@ if __name__ == '__main__':
   print(get_current_time())
   print(get_current_time('Asia/Dubai'))
   print(get_current_time('America/New_York'))
+  print(clock_context(['Asia/Tokyo', 'Etc/UTC']))
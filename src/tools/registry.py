@@ -0,0 +1,212 @@
+import asyncio
+import importlib
+import pkgutil
+import re
+import threading
+from contextvars import ContextVar
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+from llm import LLMMessage, ToolDefinition
+from metrics import TOOL_SCHEMAS_OMITTED
+
+logger = getLogger(__name__)
+
+TOOLS_PACKAGE = "tools"
+TOOLS_PATH = Path(__file__).resolve().parent
+# 会話の記録では発言の先頭に "名前:ユーザーID " が付いている
+AUTHOR_PREFIX = re.compile(r"^.*?:\d+ ")
+# ツールを呼び出している会話のチャンネル。ツールが他のチャンネルを操作しないように使う
+CURRENT_CHANNEL_ID: ContextVar[Optional[int]] = ContextVar("meowgent_current_channel_id", default=None)
+
+
+class ToolRegistry:
+  """Tools discovered from the modules in ``src/tools/``.
+
+  A module joins the registry by defining ``get_tools(context)``, which
+  returns its ToolDefinitions (or none when ``context`` lacks what it
+  needs, e.g. ``task_manager``). It may also define ``warm()`` to set up
+  clients and caches ahead of the first call, and ``close()`` to release
+  them. Modules are imported on first use, not at startup.
+
+  When the latest user message mentions one of a tool's ``keywords`` (as
+  a whole word for ASCII keywords), only the matching tools, the tools
+  already called in the conversation and the tools without keywords are
+  sent to the model. When nothing matches, every tool is sent.
+  """
+
+  def __init__(
+    self,
+    context: Optional[dict[str, Any]] = None,
+    tools: Iterable[ToolDefinition] = (),
+    modules: Optional[Iterable[str]] = None,
+    select: bool = True,
+  ):
+    self.context = context or {}
+    self.select_tools = select
+    self._module_names = None if modules is None else list(modules)
+    self._modules: dict[str, Any] = {}
+    self._tools: Optional[dict[str, ToolDefinition]] = None
+    self._extra_tools = list(tools)
+    self._keyword_patterns: dict[str, re.Pattern] = {}
+    self._warm_task: Optional[asyncio.Task] = None
+    # warm() のスレッドと同時に読み込まないように
+    self._load_lock = threading.Lock()
+
+  @classmethod
+  def from_tools(cls, tools: Iterable[ToolDefinition], select: bool = True) -> "ToolRegistry":
+    """A registry holding only ``tools``, without looking at ``src/tools/``."""
+    return cls(tools=tools, modules=(), select=select)
+
+  def module_names(self) -> list[str]:
+    if self._module_names is None:
+      # import せずに名前だけ集める
+      self._module_names = sorted(
+        f"{TOOLS_PACKAGE}.{module.name}"
+        for module in pkgutil.iter_modules([str(TOOLS_PATH)])
+        if module.name != "registry"
+      )
+    return self._module_names
+
+  def load(self) -> dict[str, ToolDefinition]:
+    if self._tools is not None:
+      return self._tools
+    with self._load_lock:
+      if self._tools is None:
+        self._tools = self._load_modules()
+    return self._tools
+
+  async def aload(self) -> dict[str, ToolDefinition]:
+    """Like load(), but imports the modules in a thread instead of on the event loop."""
+    if self._tools is not None:
+      return self._tools
+    return await asyncio.to_thread(self.load)
+
+  def _load_modules(self) -> dict[str, ToolDefinition]:
+    tools: dict[str, ToolDefinition] = {}
+    for module_name in self.module_names():
+      try:
+        module = importlib.import_module(module_name)
+      except ImportError:
+        logger.warning(f"Failed to load tool module {module_name}", exc_info=True)
+        continue
+      get_tools = getattr(module, "get_tools", None)
+      if get_tools is None:
+        continue
+      self._modules[module_name] = module
+      for tool in get_tools(self.context):
+        tools[tool.name] = tool
+    for tool in self._extra_tools:
+      tools[tool.name] = tool
+    logger.info(f"Loaded {len(tools)} tools: {', '.join(tools)}")
+    return tools
+
+  def __bool__(self) -> bool:
+    return bool(self.load())
+
+  def __len__(self) -> int:
+    return len(self.load())
+
+  def names(self) -> list[str]:
+    return list(self.load())
+
+  def get(self, name: str) -> Optional[ToolDefinition]:
+    return self.load().get(name)
+
+  def all(self) -> list[ToolDefinition]:
+    return list(self.load().values())
+
+  async def aselect(self, messages: list[LLMMessage]) -> list[ToolDefinition]:
+    await self.aload()
+    return self.select(messages)
+
+  def select(self, messages: list[LLMMessage]) -> list[ToolDefinition]:
+    """Tool schemas to send for a conversation."""
+    tools = self.load()
+    if not self.select_tools:
+      return list(tools.values())
+    text = AUTHOR_PREFIX.sub("", latest_user_text(messages), count=1).lower()
+    called = called_tool_names(messages)
+    matched = {
+      tool.name for tool in tools.values()
+      if tool.keywords and (tool.name in called or self.keyword_pattern(tool).search(text))
+    }
+    if not matched:
+      return list(tools.values())
+    selected = []
+    for tool in tools.values():
+      if not tool.keywords or tool.name in matched:
+        selected.append(tool)
+      else:
+        TOOL_SCHEMAS_OMITTED.labels(tool.name).inc()
+    return selected
+
+  def keyword_pattern(self, tool: ToolDefinition) -> re.Pattern:
+    pattern = self._keyword_patterns.get(tool.name)
+    if pattern is None:
+      # 英語は単語単位で探す ("time" が "sometimes" に当たらないように)。日本語は区切りがないのでそのまま
+      alternatives = [
+        rf"(?<![a-z0-9]){re.escape(keyword.lower())}(?![a-z0-9])" if keyword.isascii() else re.escape(keyword.lower())
+        for keyword in tool.keywords
+      ]
+      pattern = self._keyword_patterns[tool.name] = re.compile("|".join(alternatives))
+    return pattern
+
+  async def warm(self):
+    """Import the tool modules off the event loop and let each one set up its clients."""
+    await self.aload()
+    for module_name, module in self._modules.items():
+      warm = getattr(module, "warm", None)
+      if warm is None:
+        continue
+      try:
+        if asyncio.iscoroutinefunction(warm):
+          await warm()
+        else:
+          await asyncio.to_thread(warm)
+      except Exception:
+        logger.warning(f"Failed to warm tool module {module_name}", exc_info=True)
+
+  def start_warming(self):
+    if self._warm_task is None:
+      self._warm_task = asyncio.create_task(self.warm())
+    return self._warm_task
+
+  async def close(self):
+    if self._warm_task is not None and not self._warm_task.done():
+      self._warm_task.cancel()
+    for module_name, module in self._modules.items():
+      close = getattr(module, "close", None)
+      if close is None:
+        continue
+      try:
+        if asyncio.iscoroutinefunction(close):
+          await close()
+        else:
+          close()
+      except Exception:
+        logger.warning(f"Failed to close tool module {module_name}", exc_info=True)
+
+
+def message_text(content) -> str:
+  if isinstance(content, str):
+    return content
+  if isinstance(content, list):
+    return " ".join(
+      str(part.get("text", ""))
+      for part in content
+      if isinstance(part, dict) and part.get("type") == "text"
+    )
+  return ""
+
+
+def latest_user_text(messages: list[LLMMessage]) -> str:
+  for message in reversed(messages):
+    if message.role == "user":
+      return message_text(message.content)
+  return ""
+
+
+def called_tool_names(messages: list[LLMMessage]) -> set[str]:
+  return {message.name for message in messages if message.role == "tool" and message.name}
@@ -1,26 +1,431 @@
 import asyncio
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
 from logging import getLogger
+from typing import Any, Awaitable, Callable, Optional
 
 import pytz
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from llm import ToolDefinition
+from metrics import QUEUE_DEPTH, SCHEDULED_PROMPTS, SCHEDULED_RUN_SECONDS
+from tools.registry import CURRENT_CHANNEL_ID
 
 logger = getLogger(__name__)
 
+PromptRunner = Callable[[int, list[str]], Awaitable[Optional[dict[str, Any]]]]
+
+
+@dataclass
+class ScheduledRunStats:
+  runs: int = 0
+  prompts: int = 0
+  failures: int = 0
+  provider_calls: int = 0
+  prompt_tokens: int = 0
+  completion_tokens: int = 0
+  total_latency: float = 0.0
+  max_latency: float = 0.0
+
+  def record(self, prompt_count: int, latency: float, usage: Optional[dict[str, Any]]):
+    self.runs += 1
+    self.prompts += prompt_count
+    self.total_latency += latency
+    self.max_latency = max(self.max_latency, latency)
+    if usage:
+      self.provider_calls += usage.get("provider_calls", 0)
+      self.prompt_tokens += usage.get("prompt_tokens", 0)
+      self.completion_tokens += usage.get("completion_tokens", 0)
+
+  @property
+  def batched_prompts(self) -> int:
+    """まとめて実行されたことで省略できたエージェント実行の回数"""
+    return self.prompts - self.runs
+
+
+@dataclass
+class PendingPrompt:
+  prompt: str
+  queued_at: float
+
+
 class TaskManager:
-  def __init__(self, db_url='sqlite:///jobs.sqlite', timezone='Asia/Tokyo'):
+  BATCH_WINDOW = 1.0
+  # 実行のたびにモデルを呼ぶので、繰り返しの間隔とチャンネルごとの予約数に上限を設ける
+  MIN_RECURRING_INTERVAL = timedelta(minutes=30)
+  MAX_TASKS_PER_CHANNEL = 10
+  # cron式の間隔は、この回数先までの実行時刻で確かめる
+  CRON_CHECK_RUNS = 24
+
+  def __init__(self, db_url='sqlite:///jobs.sqlite', timezone='Asia/Tokyo', batch_window: float = BATCH_WINDOW):
+    from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
     self.timezone = pytz.timezone(timezone)
     self.scheduler = AsyncIOScheduler(jobstores={
       # 'default': SQLAlchemyJobStore(url=db_url),
     }, event_loop=asyncio.get_event_loop())
+    self.batch_window = batch_window
+    self.stats = ScheduledRunStats()
+    self._prompt_runner: Optional[PromptRunner] = None
+    self._pending_prompts: dict[int, list[PendingPrompt]] = {}
+    # task_id -> 予約の内容。終了時に保存して次の起動で戻す
+    self._task_specs: dict[str, dict[str, Any]] = {}
+    self._running: set[asyncio.Task] = set()
+    QUEUE_DEPTH.labels("scheduled_prompts").set_function(self.pending_prompt_count)
+    QUEUE_DEPTH.labels("scheduled_jobs").set_function(lambda: len(self.scheduler.get_jobs()))
 
   def start_scheduler(self):
     """スケジューラを起動"""
     self.scheduler.start()
     logger.info("Scheduler has started!")
 
-  def add_task(self, func, run_date, args=None, task_id=None):
+  def set_prompt_runner(self, runner: PromptRunner):
+    """チャンネルごとにまとめたプロンプトを実行する関数を設定"""
+    self._prompt_runner = runner
+
+  def add_task(self, func, run_date, args=None, task_id=None, kwargs=None):
     """タスクを追加"""
     run_date = self.timezone.localize(run_date)
-    self.scheduler.add_job(func, 'date', run_date=run_date, args=args or [], id=task_id)
+    self.scheduler.add_job(func, 'date', run_date=run_date, args=args or [], kwargs=kwargs or {}, id=task_id)
     logger.info(f"Task has been added: {task_id}")
 
+  def add_prompt_task(self, channel_id: int, prompt: str, run_date, task_id=None) -> str:
+    """指定時刻に一度だけ実行するプロンプトを追加"""
+    self.check_channel_capacity(channel_id)
+    task_id = task_id or self.new_task_id()
+    # 実行したら予約の内容も消すように task_id を渡す
+    self.add_task(self.run_prompt, run_date, [channel_id, prompt], task_id=task_id, kwargs={"task_id": task_id})
+    self._task_specs[task_id] = {"channel_id": channel_id, "prompt": prompt, "run_date": run_date.isoformat()}
+    return task_id
+
+  def add_recurring_prompt_task(
+    self,
+    channel_id: int,
+    prompt: str,
+    interval_minutes: Optional[int] = None,
+    cron: Optional[str] = None,
+    task_id=None,
+  ) -> str:
+    """一定間隔、またはcron式で繰り返し実行するプロンプトを追加"""
+    self.check_channel_capacity(channel_id)
+    task_id = task_id or self.new_task_id()
+    self.scheduler.add_job(
+      self.run_prompt,
+      self.build_recurring_trigger(interval_minutes, cron),
+      args=[channel_id, prompt],
+      id=task_id,
+      name=f"{channel_id}:{prompt}",
+    )
+    self._task_specs[task_id] = {
+      "channel_id": channel_id,
+      "prompt": prompt,
+      "interval_minutes": interval_minutes,
+      "cron": cron,
+    }
+    logger.info(f"Recurring task has been added: {task_id}")
+    return task_id
+
+  def build_recurring_trigger(self, interval_minutes: Optional[int] = None, cron: Optional[str] = None):
+    from apscheduler.triggers.cron import CronTrigger
+    from apscheduler.triggers.interval import IntervalTrigger
+
+    if (interval_minutes is None) == (cron is None):
+      raise ValueError("Specify exactly one of interval_minutes or cron.")
+    minimum = int(self.MIN_RECURRING_INTERVAL.total_seconds() // 60)
+    if cron is not None:
+      trigger = CronTrigger.from_crontab(cron, timezone=self.timezone)
+      if self.shortest_cron_gap(trigger) < self.MIN_RECURRING_INTERVAL:
+        raise ValueError(f"cron must not run more often than every {minimum} minutes.")
+      return trigger
+    if interval_minutes < minimum:
+      raise ValueError(f"interval_minutes must be at least {minimum}.")
+    return IntervalTrigger(minutes=interval_minutes, timezone=self.timezone)
+
+  def shortest_cron_gap(self, trigger) -> timedelta:
+    shortest = timedelta.max
+    previous = trigger.get_next_fire_time(None, datetime.now(self.timezone))
+    for _ in range(self.CRON_CHECK_RUNS):
+      if previous is None:
+        break
+      following = trigger.get_next_fire_time(previous, previous + timedelta(seconds=1))
+      if following is None:
+        break
+      shortest = min(shortest, following - previous)
+      previous = following
+    return shortest
+
+  def check_channel_capacity(self, channel_id: int):
+    if len(self.list_tasks(channel_id)) >= self.MAX_TASKS_PER_CHANNEL:
+      raise ValueError(f"This channel already has {self.MAX_TASKS_PER_CHANNEL} scheduled tasks.")
+
+  def remove_task(self, task_id: str, channel_id: Optional[int] = None) -> bool:
+    """タスクを削除。``channel_id`` を渡したときは、そのチャンネルの予約だけを消す"""
+    job = self.scheduler.get_job(task_id)
+    if job is None:
+      return False
+    if channel_id is not None and (job.func != self.run_prompt or job.args[0] != channel_id):
+      return False
+    self.scheduler.remove_job(task_id)
+    self._task_specs.pop(task_id, None)
+    logger.info(f"Task has been removed: {task_id}")
+    return True
+
+  def snapshot(self) -> list[dict[str, Any]]:
+    """Pending tasks in a JSON-friendly form for restore()."""
+    return [
+      {"task_id": task_id, **spec}
+      for task_id, spec in self._task_specs.items()
+      if self.scheduler.get_job(task_id) is not None
+    ]
+
+  def restore(self, tasks: list[dict[str, Any]]) -> int:
+    restored = 0
+    for task in tasks:
+      try:
+        if task.get("run_date"):
+          # 止まっている間に時刻を過ぎたものはすぐに実行する
+          run_date = max(datetime.fromisoformat(task["run_date"]), datetime.now() + timedelta(seconds=5))
+          self.add_prompt_task(task["channel_id"], task["prompt"], run_date, task_id=task["task_id"])
+        else:
+          self.add_recurring_prompt_task(
+            task["channel_id"],
+            task["prompt"],
+            interval_minutes=task.get("interval_minutes"),
+            cron=task.get("cron"),
+            task_id=task["task_id"],
+          )
+        restored += 1
+      except Exception:
+        logger.exception(f"Failed to restore task {task.get('task_id')}")
+    return restored
+
+  async def shutdown(self, timeout: float):
+    """新しい予約の実行を止め、実行中のものを ``timeout`` 秒まで待つ"""
+    if self.scheduler.running:
+      self.scheduler.shutdown(wait=False)
+    if self._running:
+      _, pending = await asyncio.wait(self._running, timeout=timeout)
+      if pending:
+        logger.warning(f"{len(pending)} scheduled runs were still running at shutdown")
+
+  def list_tasks(self, channel_id: Optional[int] = None) -> list[dict[str, Any]]:
+    tasks = []
+    for job in self.scheduler.get_jobs():
+      if job.func != self.run_prompt:
+        continue
+      job_channel_id, prompt = job.args
+      if channel_id is not None and job_channel_id != channel_id:
+        continue
+      next_run_time = getattr(job, "next_run_time", None)
+      tasks.append({
+        "task_id": job.id,
+        "channel_id": job_channel_id,
+        "prompt": prompt,
+        "trigger": str(job.trigger),
+        "next_run_time": next_run_time.isoformat() if next_run_time else None,
+      })
+    return tasks
+
+  def pending_prompt_count(self) -> int:
+    return sum(len(prompts) for prompts in self._pending_prompts.values())
+
+  def new_task_id(self) -> str:
+    return uuid.uuid4().hex[:8]
+
+  async def run_prompt(self, channel_id: int, prompt: str, task_id: Optional[str] = None):
+    """同じチャンネルに同時に届いたプロンプトを1回のエージェント実行にまとめる
+
+    ``task_id`` は一度だけの予約で渡され、実行した時点で保存対象から外す
+    """
+    if task_id is not None:
+      self._task_specs.pop(task_id, None)
+    task = asyncio.current_task()
+    self._running.add(task)
+    try:
+      await self._run_prompt(channel_id, prompt)
+    finally:
+      self._running.discard(task)
+
+  async def _run_prompt(self, channel_id: int, prompt: str):
+    pending = self._pending_prompts.setdefault(channel_id, [])
+    pending.append(PendingPrompt(prompt=prompt, queued_at=time.monotonic()))
+    if len(pending) > 1:
+      # 先に届いたジョブがまとめて実行する
+      return
+
+    await asyncio.sleep(self.batch_window)
+    batch = self._pending_prompts.pop(channel_id, [])
+    if self._prompt_runner is None:
+      logger.error("Scheduled prompts dropped: no prompt runner is set.")
+      return
+
+    prompts = [item.prompt for item in batch]
+    try:
+      usage = await self._prompt_runner(channel_id, prompts)
+    except Exception:
+      self.stats.failures += 1
+      SCHEDULED_PROMPTS.labels("error").inc(len(prompts))
+      logger.exception(f"Scheduled run failed for channel {channel_id}")
+      return
+
+    latency = time.monotonic() - batch[0].queued_at
+    self.stats.record(len(prompts), latency, usage)
+    SCHEDULED_PROMPTS.labels("ok").inc(len(prompts))
+    SCHEDULED_RUN_SECONDS.observe(latency)
+    logger.info(f"Scheduled run finished for channel {channel_id}: {len(prompts)} prompts, {latency:.2f}s, usage={usage}")
+
+
+# 予約やリマインドの話をしているときだけツールのスキーマを送る
+TASK_KEYWORDS = (
+  "remind", "schedule", "task", "later", "every", "daily", "cron", "cancel",
+  "リマインド", "予約", "予定", "タスク", "分後", "時間後", "あとで", "後で",
+  "毎日", "毎朝", "毎晩", "毎週", "毎時", "定期", "キャンセル", "取り消",
+)
+
+
+def get_tools(context):
+  """予約タスクを操作するツール。TaskManager を持たないプロセス (ワーカーなど) では使わない"""
+  task_manager = context.get("task_manager")
+  if task_manager is None:
+    return []
+
+  def create_task(channel_id: int, prompt: str, minutes_later: int):
+    """
+    Schedule a new task to run after a specified time.
+
+    Args:
+        channel_id (int): Discord channel ID where the task will run.
+        prompt (str): Content to execute as the task after the specified delay.
+        minutes_later (int): Minutes from now when the task will execute.
+
+    Example:
+        create_task(1234567890, "Check server status", 10)  # Executes 10 minutes later
+    """
+
+    try:
+      # 現在時刻から指定された分だけ後の時刻を計算
+      scheduled_time = datetime.now() + timedelta(minutes=minutes_later)
+
+      # タスクをスケジュール
+      task_id = task_manager.add_prompt_task(channel_id, prompt, scheduled_time)
+      return f"Successfully scheduled.: {scheduled_time.isoformat()}. task_id: {task_id}"
+    except Exception as e:
+      return f"Error: {str(e)}"
+
+  def create_recurring_task(channel_id: int, prompt: str, interval_minutes: int = None, cron: str = None):
+    """
+    Schedule a task that runs repeatedly at a fixed interval or on a cron schedule.
+
+    Args:
+        channel_id (int): Discord channel ID where the task will run.
+        prompt (str): Content to execute each time the task runs.
+        interval_minutes (int): Minutes between runs, at least 30. Give either this or cron.
+        cron (str): Crontab expression such as "0 9 * * *", at least 30 minutes apart. Give either this or interval_minutes.
+
+    Example:
+        create_recurring_task(1234567890, "Remind everyone to drink water", interval_minutes=60)
+        create_recurring_task(1234567890, "Say good morning", cron="0 9 * * *")
+    """
+    try:
+      task_id = task_manager.add_recurring_prompt_task(channel_id, prompt, interval_minutes=interval_minutes, cron=cron)
+      return f"Successfully scheduled. task_id: {task_id}"
+    except Exception as e:
+      return f"Error: {str(e)}"
+
+  def list_tasks(channel_id: int):
+    # 呼び出した会話のチャンネルの予約だけを見せる
+    current_channel_id = CURRENT_CHANNEL_ID.get()
+    return task_manager.list_tasks(channel_id if current_channel_id is None else current_channel_id)
+
+  def cancel_task(task_id: str):
+    if task_manager.remove_task(task_id, channel_id=CURRENT_CHANNEL_ID.get()):
+      return f"Successfully cancelled.: {task_id}"
+    return f"Error: task {task_id} not found"
+
+  return [
+    ToolDefinition(
+      name="create_task",
+      description="Schedule a task to run after the specified number of minutes.",
+      parameters={
+        "type": "object",
+        "properties": {
+          "channel_id": {
+            "type": "integer",
+            "description": "Discord channel ID where the task will run.",
+          },
+          "prompt": {
+            "type": "string",
+            "description": "Prompt to run as the scheduled task.",
+          },
+          "minutes_later": {
+            "type": "integer",
+            "description": "Minutes from now when the task will execute.",
+          },
+        },
+        "required": ["channel_id", "prompt", "minutes_later"],
+      },
+      handler=create_task,
+      keywords=TASK_KEYWORDS,
+    ),
+    ToolDefinition(
+      name="create_recurring_task",
+      description="Schedule a task that repeats every interval_minutes or on a cron schedule. Specify exactly one of them.",
+      parameters={
+        "type": "object",
+        "properties": {
+          "channel_id": {
+            "type": "integer",
+            "description": "Discord channel ID where the task will run.",
+          },
+          "prompt": {
+            "type": "string",
+            "description": "Prompt to run each time the task fires.",
+          },
+          "interval_minutes": {
+            "type": "integer",
+            "description": "Run the task every N minutes (at least 30).",
+          },
+          "cron": {
+            "type": "string",
+            "description": "Crontab expression (minute hour day month day_of_week), e.g. '0 9 * * 1-5'.",
+          },
+        },
+        "required": ["channel_id", "prompt"],
+      },
+      handler=create_recurring_task,
+      keywords=TASK_KEYWORDS,
+    ),
+    ToolDefinition(
+      name="list_tasks",
+      description="List scheduled tasks for the current channel.",
+      parameters={
+        "type": "object",
+        "properties": {
+          "channel_id": {
+            "type": "integer",
+            "description": "Discord channel ID.",
+          },
+        },
+        "required": ["channel_id"],
+      },
+      handler=list_tasks,
+      keywords=TASK_KEYWORDS,
+    ),
+    ToolDefinition(
+      name="cancel_task",
+      description="Cancel a scheduled task in the current channel by its task_id.",
+      parameters={
+        "type": "object",
+        "properties": {
+          "task_id": {
+            "type": "string",
+            "description": "ID returned when the task was scheduled.",
+          },
+        },
+        "required": ["task_id"],
+      },
+      handler=cancel_task,
+      keywords=TASK_KEYWORDS,
+    ),
+  ]
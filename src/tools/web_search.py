@@ -1,19 +1,37 @@
+import asyncio
 from typing import Dict
-from serpapi import GoogleSearch
 
-from config import load_config
+from config import get_config
+from llm import ToolDefinition
 from logging import getLogger
 logger = getLogger(__name__)
 
+SEARCH_TIMEOUT = 30
+# 検索のたびに接続を張り直さないよう、warm() で作ったセッションを使い回す
+_session = None
 
-def web_search(query: str) -> Dict[str, str]:
-  """web search"""
-  search = GoogleSearch({
+
+def get_session():
+  global _session
+  if _session is None:
+    import requests
+    _session = requests.Session()
+  return _session
+
+
+def search(query: str) -> Dict[str, str]:
+  from serpapi import GoogleSearch
+
+  client = GoogleSearch({
     "engine": "yahoo",
     "p": query,
-    "api_key": load_config().serp_api_key
+    "api_key": get_config().serp_api_key,
+    "output": "json",
   })
-  result = search.get_dict()
+  url, parameters = client.construct_url()
+  response = get_session().get(url, params=parameters, timeout=SEARCH_TIMEOUT)
+  response.raise_for_status()
+  result = response.json()
 
   # "organic_results" key なければエラー
   if "organic_results" not in result or not result["organic_results"]:
@@ -22,6 +40,52 @@ def web_search(query: str) -> Dict[str, str]:
   return result["organic_results"][:1] # 1件だけ返す
 
 
+async def web_search(query: str) -> Dict[str, str]:
+  """web search"""
+  # HTTPの待ち時間でイベントループを止めない
+  return await asyncio.to_thread(search, query)
+
+
+WEB_SEARCH_TOOL = ToolDefinition(
+  name="web_search",
+  description="Search the web for the given query.",
+  parameters={
+    "type": "object",
+    "properties": {
+      "query": {
+        "type": "string",
+        "description": "Search query.",
+      },
+    },
+    "required": ["query"],
+  },
+  handler=web_search,
+  result_fields=("title", "link", "snippet", "error"),
+  result_budget=1500,
+  keywords=(
+    "search", "look up", "google", "news", "weather", "latest", "http", "what is", "who is",
+    "検索", "調べ", "ググ", "ニュース", "天気", "最新", "とは", "って何", "ってなに", "知って", "教えて",
+  ),
+)
+
+
+def get_tools(context):
+  return [WEB_SEARCH_TOOL]
+
+
+def warm():
+  # serpapi の読み込みとセッションの用意を最初の検索より前に済ませておく
+  import serpapi  # noqa: F401
+  get_session()
+
+
+def close():
+  global _session
+  if _session is not None:
+    _session.close()
+    _session = None
+
+
 if __name__ == '__main__':
-  web_search_result = web_search("meowgent")
+  web_search_result = asyncio.run(web_search("meowgent"))
   print(web_search_result)
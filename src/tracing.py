@@ -0,0 +1,177 @@
+import functools
+import itertools
+import json
+import os
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Optional
+
+logger = getLogger(__name__)
+
+
+class Span:
+  __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_us", "start_ns", "duration_us", "attributes")
+
+  def __init__(self, name: str, trace_id: int, span_id: int, parent_id: Optional[int], attributes: dict[str, Any]):
+    self.name = name
+    self.trace_id = trace_id
+    self.span_id = span_id
+    self.parent_id = parent_id
+    self.attributes = attributes
+    self.start_us = time.time_ns() // 1000
+    self.start_ns = time.perf_counter_ns()
+    self.duration_us = 0
+
+  def set(self, key: str, value: Any):
+    self.attributes[key] = value
+
+  def to_chrome_event(self) -> dict[str, Any]:
+    return {
+      "name": self.name,
+      "cat": "meowgent",
+      "ph": "X",
+      "ts": self.start_us,
+      "dur": self.duration_us,
+      "pid": os.getpid(),
+      "tid": self.trace_id,
+      "args": {"span_id": self.span_id, "parent_id": self.parent_id, **self.attributes},
+    }
+
+
+# 親トレースがサンプリング対象外のとき、子スパンも記録しないための目印
+_NOT_SAMPLED = object()
+_current_span: ContextVar[Any] = ContextVar("meowgent_current_span", default=None)
+
+
+class ChromeTraceExporter:
+  """Append spans to a Chrome trace event file (open it in Perfetto or chrome://tracing).
+
+  Spans are written by a background thread so the event loop never
+  touches the file.
+  """
+
+  def __init__(self, path: str | Path):
+    self.path = Path(path)
+    self.path.parent.mkdir(parents=True, exist_ok=True)
+    self._queue: queue.SimpleQueue = queue.SimpleQueue()
+    self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+    self._thread.start()
+
+  def export(self, span: Span):
+    self._queue.put(span)
+
+  def close(self):
+    self._queue.put(None)
+    self._thread.join(timeout=5)
+
+  def _run(self):
+    # Chromeのトレース形式は閉じていない配列も読めるので、追記だけで済む
+    with self.path.open("a", encoding="utf-8") as file:
+      if file.tell() == 0:
+        file.write("[\n")
+      while True:
+        span = self._queue.get()
+        if span is None:
+          file.flush()
+          return
+        file.write(json.dumps(span.to_chrome_event(), ensure_ascii=False, default=str) + ",\n")
+        if self._queue.empty():
+          file.flush()
+
+
+class Tracer:
+  def __init__(self):
+    self.exporter = None
+    self.sample_rate = 0.0
+    self._ids = itertools.count(1)
+
+  @property
+  def enabled(self) -> bool:
+    return self.exporter is not None and self.sample_rate > 0
+
+  def configure(self, exporter, sample_rate: float):
+    self.exporter = exporter
+    self.sample_rate = sample_rate
+    logger.info(f"Tracing enabled with sample rate {sample_rate}")
+
+  def close(self):
+    """Stop recording and let the exporter write out the spans it still holds."""
+    exporter, self.exporter = self.exporter, None
+    close = getattr(exporter, "close", None)
+    if close is not None:
+      close()
+
+  @contextmanager
+  def span(self, name: str, root: bool = False, **attributes):
+    """Record a span under the current one.
+
+    A span with ``root=True`` starts a new trace, subject to sampling.
+    Other spans are only recorded inside a sampled trace.
+    """
+    if not self.enabled:
+      yield None
+      return
+
+    parent = _current_span.get()
+    if parent is _NOT_SAMPLED or (parent is None and not root):
+      yield None
+      return
+    if parent is None and random.random() >= self.sample_rate:
+      token = _current_span.set(_NOT_SAMPLED)
+      try:
+        yield None
+      finally:
+        _current_span.reset(token)
+      return
+
+    # 記録中に close() されても、始めたスパンは同じエクスポーターに渡す
+    exporter = self.exporter
+    span_id = next(self._ids)
+    span = Span(
+      name,
+      trace_id=parent.trace_id if parent is not None else span_id,
+      span_id=span_id,
+      parent_id=parent.span_id if parent is not None else None,
+      attributes=attributes,
+    )
+    token = _current_span.set(span)
+    try:
+      yield span
+    except BaseException as e:
+      span.set("error", type(e).__name__)
+      raise
+    finally:
+      _current_span.reset(token)
+      span.duration_us = (time.perf_counter_ns() - span.start_ns) // 1000
+      exporter.export(span)
+
+
+TRACER = Tracer()
+
+
+def current_span() -> Optional[Span]:
+  span = _current_span.get()
+  return span if isinstance(span, Span) else None
+
+
+def traced(name: str, root: bool = False):
+  """Wrap a coroutine function in a span."""
+  def decorator(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+      with TRACER.span(name, root=root):
+        return await func(*args, **kwargs)
+    return wrapper
+  return decorator
+
+
+def configure_tracing(path: str, sample_rate: float):
+  if sample_rate <= 0:
+    return
+  TRACER.configure(ChromeTraceExporter(path), min(1.0, sample_rate))
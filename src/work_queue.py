@@ -0,0 +1,290 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, fields
+from logging import getLogger
+from typing import Any, Optional
+
+from llm import LLMMessage, LLMResponse, to_llm_message
+from metrics import QUEUE_DEPTH, WORK_QUEUE_JOBS, WORK_QUEUE_WAIT_SECONDS
+
+logger = getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  kind TEXT NOT NULL,
+  payload TEXT NOT NULL,
+  state TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  worker TEXT,
+  lease_until REAL,
+  result TEXT,
+  error TEXT,
+  created_at REAL NOT NULL,
+  finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+class WorkQueueFull(Exception):
+  """The queue already holds ``max_pending`` unfinished jobs."""
+
+
+class WorkQueueError(Exception):
+  """A worker failed the job, or gave up on it after too many attempts."""
+
+
+@dataclass
+class Job:
+  id: int
+  kind: str
+  payload: dict[str, Any]
+  attempts: int
+
+
+class WorkQueue:
+  """Job queue in a local SQLite file shared by the gateway and worker processes.
+
+  A claimed job carries a lease. If the worker dies before completing it,
+  the lease runs out and another worker picks the job up again, up to
+  ``max_attempts`` times.
+  """
+
+  def __init__(self, path: str, lease_seconds: float = 300.0, max_attempts: int = 2, max_pending: int = 100):
+    self.path = path
+    self.lease_seconds = lease_seconds
+    self.max_attempts = max_attempts
+    self.max_pending = max_pending
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    self._conn.execute("PRAGMA journal_mode=WAL")
+    self._conn.executescript(SCHEMA)
+
+  @contextmanager
+  def _transaction(self):
+    with self._lock:
+      # 書き込みロックを先に取り、複数のワーカーが同じジョブを取らないようにする
+      self._conn.execute("BEGIN IMMEDIATE")
+      try:
+        yield self._conn
+      except BaseException:
+        self._conn.execute("ROLLBACK")
+        raise
+      self._conn.execute("COMMIT")
+
+  def enqueue(self, kind: str, payload: dict[str, Any]) -> int:
+    with self._transaction() as conn:
+      (depth,) = conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'claimed')").fetchone()
+      if depth >= self.max_pending:
+        raise WorkQueueFull(f"{depth} jobs are waiting")
+      cursor = conn.execute(
+        "INSERT INTO jobs (kind, payload, created_at) VALUES (?, ?, ?)",
+        (kind, json.dumps(payload, ensure_ascii=False), time.time()),
+      )
+      return cursor.lastrowid
+
+  def claim(self, worker: str) -> Optional[Job]:
+    now = time.time()
+    with self._transaction() as conn:
+      conn.execute(
+        "UPDATE jobs SET state = 'failed', error = 'lease expired', finished_at = ? "
+        "WHERE state = 'claimed' AND lease_until < ? AND attempts >= ?",
+        (now, now, self.max_attempts),
+      )
+      row = conn.execute(
+        "SELECT id, kind, payload, attempts FROM jobs "
+        "WHERE state = 'pending' OR (state = 'claimed' AND lease_until < ?) ORDER BY id LIMIT 1",
+        (now,),
+      ).fetchone()
+      if row is None:
+        return None
+      job_id, kind, payload, attempts = row
+      if attempts:
+        logger.warning("Reclaiming job %s after an expired lease (attempt %s)", job_id, attempts + 1)
+      conn.execute(
+        "UPDATE jobs SET state = 'claimed', worker = ?, attempts = attempts + 1, lease_until = ? WHERE id = ?",
+        (worker, now + self.lease_seconds, job_id),
+      )
+    return Job(id=job_id, kind=kind, payload=json.loads(payload), attempts=attempts + 1)
+
+  def complete(self, job_id: int, result: Any):
+    self._finish(job_id, "done", result=json.dumps(result, ensure_ascii=False))
+
+  def fail(self, job_id: int, error: str):
+    self._finish(job_id, "failed", error=error)
+
+  def _finish(self, job_id: int, state: str, result: Optional[str] = None, error: Optional[str] = None):
+    with self._transaction() as conn:
+      conn.execute(
+        "UPDATE jobs SET state = ?, result = ?, error = ?, finished_at = ? WHERE id = ? AND state = 'claimed'",
+        (state, result, error, time.time(), job_id),
+      )
+
+  def take_results(self, job_ids: list[int]) -> dict[int, tuple[str, Any, Optional[str]]]:
+    """Return finished jobs among ``job_ids`` and delete them from the queue."""
+    if not job_ids:
+      return {}
+    placeholders = ",".join("?" * len(job_ids))
+    with self._transaction() as conn:
+      rows = conn.execute(
+        f"SELECT id, state, result, error FROM jobs WHERE id IN ({placeholders}) AND state IN ('done', 'failed')",
+        job_ids,
+      ).fetchall()
+      if rows:
+        conn.execute(f"DELETE FROM jobs WHERE id IN ({','.join('?' * len(rows))})", [row[0] for row in rows])
+    return {
+      job_id: (state, json.loads(result) if result is not None else None, error)
+      for job_id, state, result, error in rows
+    }
+
+  def depth(self) -> int:
+    with self._lock:
+      (depth,) = self._conn.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'claimed')").fetchone()
+    return depth
+
+  def purge_finished(self, older_than: float = 3600.0) -> int:
+    """Drop results nobody collected, e.g. after the gateway restarted."""
+    with self._transaction() as conn:
+      cursor = conn.execute(
+        "DELETE FROM jobs WHERE state IN ('done', 'failed') AND finished_at < ?",
+        (time.time() - older_than,),
+      )
+      return cursor.rowcount
+
+  def close(self):
+    self._conn.close()
+
+
+class WorkQueueClient:
+  """Gateway side of the queue: submit jobs and wait for their results.
+
+  One polling task collects results for every waiting job. When the
+  queue is full, ``submit`` waits for room for up to ``submit_timeout``
+  seconds before giving up, so a burst slows callers down instead of
+  piling up unbounded work.
+  """
+
+  def __init__(self, queue: WorkQueue, poll_interval: float = 0.05, submit_timeout: float = 30.0):
+    self.queue = queue
+    self.poll_interval = poll_interval
+    self.submit_timeout = submit_timeout
+    self.depth = 0
+    self._waiters: dict[int, asyncio.Future] = {}
+    self._poller: Optional[asyncio.Task] = None
+    QUEUE_DEPTH.labels("work_queue").set_function(lambda: self.depth)
+
+  async def submit(self, kind: str, payload: dict[str, Any], timeout: Optional[float] = None) -> Any:
+    started = time.monotonic()
+    while True:
+      try:
+        job_id = await asyncio.to_thread(self.queue.enqueue, kind, payload)
+        break
+      except WorkQueueFull:
+        if time.monotonic() - started > self.submit_timeout:
+          WORK_QUEUE_JOBS.labels("rejected").inc()
+          raise
+        await asyncio.sleep(self.poll_interval * 10)
+
+    future = asyncio.get_running_loop().create_future()
+    self._waiters[job_id] = future
+    if self._poller is None or self._poller.done():
+      self._poller = asyncio.create_task(self._poll())
+    try:
+      return await asyncio.wait_for(future, timeout)
+    finally:
+      self._waiters.pop(job_id, None)
+      WORK_QUEUE_WAIT_SECONDS.observe(time.monotonic() - started)
+
+  async def _poll(self):
+    while self._waiters:
+      await asyncio.sleep(self.poll_interval)
+      finished = await asyncio.to_thread(self.queue.take_results, list(self._waiters))
+      self.depth = await asyncio.to_thread(self.queue.depth)
+      for job_id, (state, result, error) in finished.items():
+        WORK_QUEUE_JOBS.labels(state).inc()
+        future = self._waiters.get(job_id)
+        if future is None or future.done():
+          continue
+        if state == "done":
+          future.set_result(result)
+        else:
+          future.set_exception(WorkQueueError(error or "job failed"))
+
+
+MESSAGE_FIELDS = tuple(item.name for item in fields(LLMMessage) if item.init)
+
+
+def serialize_messages(messages) -> list[dict[str, Any]]:
+  return [
+    {name: getattr(message, name) for name in MESSAGE_FIELDS}
+    for message in map(to_llm_message, messages)
+  ]
+
+
+def deserialize_messages(messages: list[dict[str, Any]]) -> list[LLMMessage]:
+  return [LLMMessage(**message) for message in messages]
+
+
+class RemoteProvider:
+  """Provider for single model calls outside an agent run, made by a worker.
+
+  Each call becomes a ``generate`` job (length retries, history summaries
+  and image descriptions). Tool schemas are not supported.
+  """
+
+  def __init__(self, client: WorkQueueClient, timeout: Optional[float] = None):
+    self.client = client
+    self.timeout = timeout
+
+  async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None) -> LLMResponse:
+    if tools:
+      raise ValueError("RemoteProvider does not send tools")
+    result = await self.client.submit(
+      "generate",
+      {"messages": serialize_messages(messages), "max_tokens": max_tokens},
+      timeout=self.timeout,
+    )
+    return LLMResponse(
+      content=result["content"],
+      tool_calls=result.get("tool_calls") or [],
+      finish_reason=result.get("finish_reason"),
+      raw=None,
+      usage=result.get("usage"),
+    )
+
+
+class RemoteMeowgentApp:
+  """Drop-in for ``MeowgentApp`` that runs the agent in a worker process.
+
+  Stamina is still kept by the gateway's Meowgent: the worker reports
+  what the run used and it is charged here. ``provider`` sends single
+  model calls to the workers as well.
+  """
+
+  def __init__(self, meowgent, client: WorkQueueClient, timeout: Optional[float] = None):
+    self.meowgent = meowgent
+    self.client = client
+    self.timeout = timeout
+    self.provider = RemoteProvider(client, timeout)
+
+  async def ainvoke(self, state, config=None):
+    messages = [to_llm_message(message) for message in state["messages"]]
+    result = await self.client.submit(
+      "agent",
+      {
+        "messages": serialize_messages(messages),
+        "current_channel_id": state["current_channel_id"],
+        "system_prompt": self.meowgent.system_prompt,
+        "config": config,
+      },
+      timeout=self.timeout,
+    )
+    usage = result.get("usage") or {}
+    if usage.get("stamina"):
+      await self.meowgent.reduce_stamina(usage["stamina"])
+    return {"messages": messages + deserialize_messages(result["messages"]), "usage": usage}
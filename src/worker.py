@@ -0,0 +1,154 @@
+"""LLM worker process for WORKER_MODE.
+
+  uv run python src/worker.py --concurrency 4
+
+Claims reply jobs that the gateway process (src/bot.py) put on the local
+work queue, runs the agent and writes the new messages back. Only tools
+that don't need the Discord connection are available here.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+from logging import getLogger
+
+from cassette import wrap_provider
+from config import add_reload_listener, get_config, install_reload_triggers
+from llm import OpenAICompatibleChatProvider
+from logging_setup import setup_logging
+from loop_monitor import install_event_loop
+from tools.registry import ToolRegistry
+from work_queue import Job, WorkQueue, deserialize_messages, serialize_messages
+
+logger = getLogger(__name__)
+
+
+async def handle_job(queue: WorkQueue, meowgent, job: Job):
+  try:
+    payload = job.payload
+    if job.kind == "agent":
+      input_messages = deserialize_messages(payload["messages"])
+      final_state = await meowgent.app.ainvoke(
+        {
+          "messages": input_messages,
+          "current_channel_id": payload["current_channel_id"],
+          "system_prompt": payload.get("system_prompt"),
+        },
+        config=payload.get("config"),
+      )
+      result = {
+        "messages": serialize_messages(final_state["messages"][len(input_messages):]),
+        "usage": final_state.get("usage"),
+      }
+    elif job.kind == "generate":
+      # 長さ超過のリトライや要約など、エージェントを通さない1回だけの呼び出し
+      response = await meowgent.provider.generate(
+        deserialize_messages(payload["messages"]),
+        tools=[],
+        max_tokens=payload.get("max_tokens"),
+      )
+      result = {
+        "content": response.content,
+        "tool_calls": response.tool_calls,
+        "finish_reason": response.finish_reason,
+        "usage": response.usage,
+      }
+    else:
+      raise ValueError(f"Unknown job kind: {job.kind}")
+  except Exception as e:
+    logger.exception(f"Job {job.id} failed")
+    await asyncio.to_thread(queue.fail, job.id, f"{type(e).__name__}: {e}")
+    return
+  await asyncio.to_thread(queue.complete, job.id, result)
+
+
+async def run_worker(queue: WorkQueue, meowgent, concurrency: int = 4, poll_interval: float = 0.1, stop: asyncio.Event = None):
+  stop = stop or asyncio.Event()
+  worker_id = f"{socket.gethostname()}:{os.getpid()}"
+  slots = asyncio.Semaphore(concurrency)
+  running: set[asyncio.Task] = set()
+
+  async def run(job: Job):
+    try:
+      await handle_job(queue, meowgent, job)
+    finally:
+      slots.release()
+
+  logger.info(f"Worker {worker_id} is waiting for jobs on {queue.path}")
+  while not stop.is_set():
+    await slots.acquire()
+    job = await asyncio.to_thread(queue.claim, worker_id)
+    if job is None:
+      slots.release()
+      try:
+        await asyncio.wait_for(stop.wait(), poll_interval)
+      except asyncio.TimeoutError:
+        pass
+      continue
+    task = asyncio.create_task(run(job))
+    running.add(task)
+    task.add_done_callback(running.discard)
+
+  # 受け取ったジョブは終わらせてから抜ける。間に合わなくてもリースが切れれば他のワーカーがやり直す
+  if running:
+    await asyncio.wait(running)
+
+
+async def main_async(args, config):
+  from meowgent import Meowgent
+
+  provider = OpenAICompatibleChatProvider(**config.openai.provider_settings())
+  provider = wrap_provider(
+    provider,
+    config.llm_cassette.mode,
+    config.sharding.partition_path(config.llm_cassette.path),
+    speed=config.llm_cassette.speed,
+  )
+  # TaskManager は渡さないので、予約タスクのツールはここでは使えない
+  tools = ToolRegistry(select=config.tool_selection)
+  await tools.warm()
+  meowgent = Meowgent(
+    provider=provider,
+    tools=tools,
+    system_prompt=config.character_prompt,
+    clock_timezones=config.clock_timezones,
+  )
+  queue = WorkQueue(
+    config.sharding.partition_path(config.worker.queue_path),
+    lease_seconds=config.worker.lease_seconds,
+    max_pending=config.worker.max_pending,
+  )
+
+  def apply_config(old_config, new_config):
+    # システムプロンプトはジョブごとにゲートウェイから届くので、ここではモデルの設定だけ
+    if hasattr(provider, "configure"):
+      provider.configure(**new_config.openai.provider_settings())
+    meowgent.clock_timezones = tuple(new_config.clock_timezones)
+    tools.select_tools = new_config.tool_selection
+
+  stop = asyncio.Event()
+  loop = asyncio.get_running_loop()
+  for signum in (signal.SIGINT, signal.SIGTERM):
+    loop.add_signal_handler(signum, stop.set)
+  add_reload_listener(apply_config)
+  install_reload_triggers(loop)
+  try:
+    await run_worker(queue, meowgent, concurrency=args.concurrency or config.worker.concurrency, stop=stop)
+  finally:
+    queue.close()
+    await tools.close()
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--concurrency", type=int, default=None, help="Jobs to run at once (default: WORKER_CONCURRENCY).")
+  args = parser.parse_args(argv)
+  config = get_config()
+  setup_logging(config.logging.level, config.logging.format, config.logging.max_length)
+  install_event_loop(config.event_loop.name)
+  asyncio.run(main_async(args, config))
+
+
+if __name__ == "__main__":
+  main()
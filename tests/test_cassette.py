@@ -0,0 +1,128 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from cassette import RecordingProvider, ReplayProvider, keys_for_request, load_cassette, request_keys, summarize_cassette
+from llm import LLMMessage, LLMResponse
+
+
+class FakeProvider:
+  def __init__(self):
+    self.calls = 0
+
+  async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+    self.calls += 1
+    if self.calls == 1:
+      return LLMResponse(
+        None,
+        [{"id": "call_1", "type": "function", "function": {"name": "get_current_time", "arguments": "{}"}}],
+        "tool_calls",
+        None,
+        {"prompt_tokens": 10, "completion_tokens": 2},
+      )
+    return LLMResponse(f"reply {self.calls}", [], "stop", None, {"prompt_tokens": 12, "completion_tokens": 3})
+
+
+class CassetteTest(unittest.TestCase):
+  def test_replay_serves_recorded_responses_by_request(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "llm.jsonl"
+        recorder = RecordingProvider(FakeProvider(), path)
+        first = [LLMMessage(role="user", content="hi")]
+        second = [*first, LLMMessage(role="assistant", content="reply 2")]
+        await recorder.generate(first)
+        await recorder.generate(second)
+
+        replay = ReplayProvider(path)
+        # 記録と逆順で呼んでもリクエスト内容で対応する応答が返る
+        second_response = await replay.generate(second)
+        first_response = await replay.generate(first)
+
+        self.assertEqual(first_response.finish_reason, "tool_calls")
+        self.assertEqual(first_response.tool_calls[0]["function"]["name"], "get_current_time")
+        self.assertEqual(second_response.content, "reply 2")
+        self.assertEqual(replay.stats.calls, 2)
+        self.assertEqual(replay.stats.exact_hits, 2)
+
+        summary = summarize_cassette(path)
+        self.assertEqual(summary["calls"], 2)
+        self.assertEqual(summary["finish_reasons"], {"tool_calls": 1, "stop": 1})
+        self.assertEqual(summary["prompt_tokens"], 22)
+
+        with self.assertRaises(LookupError):
+          await replay.generate(first)
+
+    asyncio.run(run_test())
+
+  def test_concurrent_recordings_write_whole_lines(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "llm.jsonl"
+        recorder = RecordingProvider(FakeProvider(), path)
+        await asyncio.gather(*(
+          recorder.generate([LLMMessage(role="user", content=f"hi {index}")])
+          for index in range(20)
+        ))
+
+        self.assertEqual(summarize_cassette(path)["calls"], 20)
+
+    asyncio.run(run_test())
+
+  def test_request_keys_ignore_tool_call_ids(self):
+    def conversation(tool_call_id):
+      return [
+        LLMMessage(role="user", content="time?"),
+        LLMMessage(
+          role="assistant",
+          tool_calls=[{"id": tool_call_id, "type": "function", "function": {"name": "clock", "arguments": "{}"}}],
+        ),
+        LLMMessage(role="tool", content="12:00", tool_call_id=tool_call_id, name="clock"),
+      ]
+
+    self.assertEqual(request_keys(conversation("call_a")), request_keys(conversation("call_b")))
+
+  def test_exact_key_ignores_the_clock_system_message(self):
+    def conversation(time):
+      return [
+        LLMMessage(role="system", content=f"current_time:\nAsia/Tokyo: {time}"),
+        LLMMessage(role="user", content="hi"),
+      ]
+
+    self.assertEqual(request_keys(conversation("12:00"))[0], request_keys(conversation("12:01"))[0])
+
+  def test_records_the_normalized_request_next_to_its_keys(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "llm.jsonl"
+        recorder = RecordingProvider(FakeProvider(), path)
+        await recorder.generate([LLMMessage(role="user", content="hi")], max_tokens=50)
+
+        entry = load_cassette(path)[0]
+        self.assertEqual(entry.request["messages"], [{"role": "user", "content": "hi"}])
+        self.assertEqual(entry.request["max_tokens"], 50)
+        self.assertEqual(keys_for_request(entry.request), (entry.key, entry.loose_key))
+
+    asyncio.run(run_test())
+
+  def test_loose_key_matches_when_tool_results_differ(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "llm.jsonl"
+        recorder = RecordingProvider(FakeProvider(), path)
+        await recorder.generate([LLMMessage(role="tool", content="12:00", tool_call_id="a")])
+
+        replay = ReplayProvider(path)
+        await replay.generate([LLMMessage(role="tool", content="12:01", tool_call_id="b")])
+
+        self.assertEqual(replay.stats.loose_hits, 1)
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()
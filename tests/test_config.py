@@ -0,0 +1,115 @@
+import asyncio
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+import config
+from dotenv import dotenv_values
+from llm import LLMMessage, OpenAICompatibleChatProvider
+
+
+class ReloadConfigTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.env_path = Path(self.directory.name) / ".env"
+    self.env_path.write_text("OPEN_AI_MODEL=model-a\nCHARACTER_PROMPT=cat\n")
+    patches = [
+      mock.patch.object(config, "ENV_PATH", str(self.env_path)),
+      mock.patch.object(config, "_config", None),
+      mock.patch.object(config, "_reload_listeners", []),
+      mock.patch.dict(os.environ, {"OPEN_AI_MODEL": "model-a", "CHARACTER_PROMPT": "cat"}),
+    ]
+    for patch in patches:
+      patch.start()
+      self.addCleanup(patch.stop)
+    self.addCleanup(self.directory.cleanup)
+
+  def test_reload_swaps_the_config_and_notifies_listeners(self):
+    changes = []
+    config.add_reload_listener(lambda old, new: changes.append((old.openai.model, new.openai.model)))
+    current = config.get_config()
+    self.assertIs(config.get_config(), current)
+
+    self.env_path.write_text("OPEN_AI_MODEL=model-b\nCHARACTER_PROMPT=dog\n")
+    reloaded = config.reload_config()
+
+    self.assertIs(config.get_config(), reloaded)
+    self.assertEqual(reloaded.character_prompt, "dog")
+    self.assertEqual(changes, [("model-a", "model-b")])
+
+  def test_keeps_the_current_config_when_the_new_one_is_invalid(self):
+    current = config.get_config()
+    self.env_path.write_text("OPEN_AI_MAX_TOKEN=many\n")
+
+    with self.assertLogs("config", level="ERROR"):
+      self.assertIs(config.reload_config(), current)
+    self.assertIs(config.get_config(), current)
+
+  def test_watch_reloads_when_env_file_changes(self):
+    async def run_test():
+      task = asyncio.create_task(config.watch_config(0.01))
+      await asyncio.sleep(0.03)
+      self.env_path.write_text("OPEN_AI_MODEL=model-c\n")
+      os.utime(self.env_path, (1, 1))
+      for _ in range(50):
+        if config.get_config().openai.model == "model-c":
+          break
+        await asyncio.sleep(0.01)
+      task.cancel()
+      self.assertEqual(config.get_config().openai.model, "model-c")
+
+    asyncio.run(run_test())
+
+
+class ProviderConfigureTest(unittest.TestCase):
+  def test_request_in_flight_keeps_the_settings_it_started_with(self):
+    async def run_test():
+      provider = OpenAICompatibleChatProvider(model="model-a", api_key="key", temperature=1.0)
+      first_client = provider.client
+      started = asyncio.Event()
+      release = asyncio.Event()
+      requests = []
+
+      async def create_completion(request, client=None):
+        requests.append((request, client))
+        started.set()
+        await release.wait()
+        message = SimpleNamespace(content="ok", tool_calls=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=None)
+
+      provider._create_completion = create_completion
+      task = asyncio.create_task(provider.generate([LLMMessage(role="user", content="hi")]))
+      await started.wait()
+      provider.configure(model="model-b", api_key="other", temperature=0.2)
+      release.set()
+      await task
+
+      self.assertEqual(requests[0][0]["model"], "model-a")
+      self.assertIs(requests[0][1], first_client)
+      self.assertIsNot(provider.client, first_client)
+      self.assertEqual((provider.model, provider.temperature), ("model-b", 0.2))
+
+    asyncio.run(run_test())
+
+
+class EnvExampleTest(unittest.TestCase):
+  def test_env_example_loads(self):
+    values = dotenv_values(Path(__file__).resolve().parents[1] / ".env.example")
+    with mock.patch.dict(os.environ, {key: value for key, value in values.items() if value is not None}, clear=True):
+      loaded = config.load_config()
+
+    self.assertEqual(loaded.clock_timezones, ("Asia/Tokyo",))
+    self.assertTrue(loaded.tool_selection)
+    self.assertTrue(loaded.images.describe)
+    self.assertEqual(loaded.llm_cassette.speed, 0)
+    self.assertIsNone(loaded.sharding.shard_count)
+
+
+if __name__ == "__main__":
+  unittest.main()
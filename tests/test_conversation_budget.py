@@ -0,0 +1,72 @@
+import random
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from conversation_budget import ConversationBudget
+from metrics import LLM_CALLS_PREVENTED
+
+
+class FakeClock:
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+class ConversationBudgetTest(unittest.TestCase):
+  def test_bot_chain_decays_and_stops_until_a_human_speaks(self):
+    clock = FakeClock()
+    budget = ConversationBudget(max_bot_chain=3, decay=0.5, max_replies=100, window=600, rng=random.Random(1), clock=clock)
+    budget.rng.random = lambda: 0.3
+    prevented = LLM_CALLS_PREVENTED.labels("bot_chain").value
+
+    # 0.3 < 1.0, 0.5 は通るが、0.25 では止まる
+    self.assertTrue(budget.allow(1, from_bot=True))
+    self.assertTrue(budget.allow(1, from_bot=True))
+    self.assertFalse(budget.allow(1, from_bot=True))
+    self.assertEqual(budget.bot_chain(1), 2)
+
+    budget.rng.random = lambda: 0.0
+    self.assertTrue(budget.allow(1, from_bot=True))
+    self.assertFalse(budget.allow(1, from_bot=True))
+    self.assertEqual(LLM_CALLS_PREVENTED.labels("bot_chain").value, prevented + 1)
+
+    # 他のチャンネルは別に数える
+    self.assertTrue(budget.allow(2, from_bot=True))
+
+    budget.record_human(1)
+    self.assertTrue(budget.allow(1, from_bot=True))
+
+    clock.now += 601
+    self.assertEqual(budget.bot_chain(1), 1)
+    self.assertTrue(budget.allow(1, from_bot=True))
+    self.assertEqual(budget.bot_chain(1), 1)
+
+  def test_channel_limit_applies_to_random_replies_and_expires(self):
+    clock = FakeClock()
+    budget = ConversationBudget(max_replies=2, window=60, clock=clock)
+
+    self.assertTrue(budget.allow(1, from_bot=False))
+    self.assertTrue(budget.allow(1, from_bot=False))
+    self.assertFalse(budget.allow(1, from_bot=False))
+
+    clock.now += 61
+    self.assertTrue(budget.allow(1, from_bot=False))
+
+  def test_base_probability_rejections_are_not_counted_as_prevented(self):
+    budget = ConversationBudget(rng=random.Random(1))
+    budget.rng.random = lambda: 0.9
+    before = {reason: LLM_CALLS_PREVENTED.labels(reason).value for reason in ("bot_chain", "decay", "channel_limit")}
+
+    self.assertFalse(budget.allow(1, from_bot=True, probability=0.5))
+
+    after = {reason: LLM_CALLS_PREVENTED.labels(reason).value for reason in before}
+    self.assertEqual(before, after)
+
+
+if __name__ == "__main__":
+  unittest.main()
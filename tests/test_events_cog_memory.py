@@ -7,8 +7,12 @@ from types import SimpleNamespace
 
 sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
 
-from cogs.events_cog import ConversationMessage, EventsCog, ShortTermMemory
+from cogs.events_cog import MESSAGE_MENTION, ConversationMessage, EventsCog, ShortTermMemory
+from conversation_budget import ConversationBudget
 from llm import LLMResponse
+from meowgent import Meowgent
+from summaries import BackgroundLane, SummaryCache
+from work_queue import WorkQueueFull
 
 
 def fake_message(
@@ -21,6 +25,7 @@ def fake_message(
   created_at=None,
   attachments=None,
   reference=None,
+  mentions=None,
 ):
   return SimpleNamespace(
     id=message_id,
@@ -30,6 +35,7 @@ def fake_message(
     created_at=created_at or datetime(2026, 6, 5, tzinfo=timezone.utc),
     attachments=attachments or [],
     reference=reference,
+    mentions=mentions or [],
   )
 
 
@@ -40,6 +46,18 @@ def fake_cog(bot_user_id=999):
   cog.channel_message_history = {}
   cog.initial_max_tokens = 100
   cog.current_max_tokens = 100
+  cog.image_max_side = 1024
+  cog.image_max_per_message = 4
+  cog.image_cache = None
+  cog.reply_channels = {}
+  cog.waiting_replies = set()
+  cog.accepting_replies = True
+  cog.active_replies = 0
+  cog.replies_idle = asyncio.Event()
+  cog.replies_idle.set()
+  cog.summary_cache = SummaryCache()
+  cog.summary_task = None
+  cog.background_tasks = set()
   return cog
 
 
@@ -82,7 +100,99 @@ class ShortTermMemoryTest(unittest.TestCase):
     self.assertEqual(messages[0].content, "new")
 
 
+class ShutdownTest(unittest.TestCase):
+  def test_memory_snapshot_round_trips_through_json(self):
+    import json
+
+    memory = ShortTermMemory(max_length=10)
+    now = datetime(2026, 6, 5, tzinfo=timezone.utc)
+    memory.add(ConversationMessage(1, 10, 100, "sota", "user", "sota:100 hi", now))
+    memory.add(ConversationMessage(2, 10, 999, "bot", "assistant", [{"type": "text", "text": "hello"}], now + timedelta(seconds=1)))
+
+    restored = ShortTermMemory(max_length=10)
+    restored.restore(json.loads(json.dumps(memory.snapshot())))
+
+    self.assertEqual(restored.get(10), memory.get(10))
+
+  def test_drain_stops_new_replies_and_waits_for_running_ones(self):
+    async def run_test():
+      cog = fake_cog()
+      release = asyncio.Event()
+
+      async def reply():
+        with cog.track_reply():
+          await release.wait()
+
+      running = asyncio.create_task(reply())
+      await asyncio.sleep(0)
+      self.assertFalse(await cog.drain(timeout=0.01))
+      self.assertFalse(cog.accepting_replies)
+
+      cog.classify_message = lambda message: self.fail("accepted a message while draining")
+      await cog.on_message(fake_message())
+
+      release.set()
+      self.assertTrue(await cog.drain(timeout=1))
+      await running
+
+    asyncio.run(run_test())
+
+  def test_human_mentions_are_answered_without_using_the_channel_limit(self):
+    async def run_test():
+      cog = fake_cog()
+      cog.conversation_budget = ConversationBudget(max_replies=1)
+      cog.classify_message = lambda message: MESSAGE_MENTION
+      replied = []
+
+      async def reply_to(message):
+        replied.append(message.id)
+
+      cog.reply_to = reply_to
+      for message_id in range(3):
+        await cog.on_message(fake_message(message_id=message_id, channel_id=10))
+
+      self.assertEqual(replied, [0, 1, 2])
+      # 人間への返信は数えないので、botやランダムへの返信の枠は残っている
+      self.assertTrue(cog.conversation_budget.allow(10, from_bot=False))
+
+    asyncio.run(run_test())
+
+  def test_drain_cancels_background_work(self):
+    async def run_test():
+      cog = fake_cog()
+      finished = []
+
+      async def describe():
+        await asyncio.sleep(1)
+        finished.append("described")
+
+      task = cog.start_background(describe())
+      await asyncio.sleep(0)
+
+      self.assertTrue(await cog.drain(timeout=1))
+
+      self.assertTrue(task.cancelled())
+      self.assertEqual(cog.background_tasks, set())
+      self.assertEqual(finished, [])
+      cog.image_describe = True
+      self.assertEqual(cog.schedule_image_descriptions({"https://example.com/a.png": "a"}, budget=1), 0)
+
+    asyncio.run(run_test())
+
+
 class ConversationMessageTest(unittest.TestCase):
+  def test_records_are_frozen_and_share_names_and_llm_dicts(self):
+    now = datetime(2026, 6, 5, tzinfo=timezone.utc)
+    first = ConversationMessage(1, 10, 100, "".join(["so", "ta"]), "user", "one", now)
+    second = ConversationMessage(2, 10, 100, "".join(["so", "ta"]), "user", "two", now)
+
+    self.assertIs(first.author_name, second.author_name)
+    self.assertIs(first.to_llm_message(), first.to_llm_message())
+    self.assertEqual(first.to_llm_message(), {"role": "user", "content": "one"})
+    self.assertFalse(hasattr(first, "__dict__"))
+    with self.assertRaises(AttributeError):
+      first.content = "changed"
+
   def test_user_text_message_is_normalized_with_name_and_id(self):
     cog = fake_cog()
     message = fake_message(author_id=123, author_name="sota", content="hi")
@@ -106,6 +216,97 @@ class ConversationMessageTest(unittest.TestCase):
       "image_url": {"url": "https://example.com/image.png"},
     })
 
+  def test_keeps_every_image_attachment_up_to_the_limit(self):
+    cog = fake_cog()
+    cog.image_max_per_message = 2
+    attachments = [
+      SimpleNamespace(content_type="image/png", url=f"https://example.com/{index}.png")
+      for index in range(3)
+    ]
+    attachments.insert(1, SimpleNamespace(content_type="text/plain", url="https://example.com/notes.txt"))
+    message = fake_message(content="look", attachments=attachments)
+
+    conversation_message = cog.to_conversation_message(message)
+
+    self.assertEqual(
+      [part["image_url"]["url"] for part in conversation_message.content[1:]],
+      ["https://example.com/0.png", "https://example.com/1.png"],
+    )
+
+  def test_prepare_image_context_uses_descriptions_and_cached_images(self):
+    async def run_test():
+      cog = fake_cog()
+      cog.image_token_budget = 85
+      cog.image_describe = False
+      cog.image_description_tasks = {}
+      cached = {"https://example.com/new.png": "data:image/png;base64,AAAA"}
+      cog.image_cache = SimpleNamespace(
+        description=lambda url: "a cat on a desk" if url.endswith("old.png") else None,
+        data_url=lambda url: asyncio.sleep(0, cached.get(url)),
+      )
+      stored = [
+        {"role": "user", "content": [
+          {"type": "text", "text": "sota:1 look"},
+          {"type": "image_url", "image_url": {"url": "https://example.com/old.png"}},
+        ]},
+        {"role": "user", "content": [
+          {"type": "text", "text": "sota:1 and this"},
+          {"type": "image_url", "image_url": {"url": "https://example.com/too-many.png"}},
+          {"type": "image_url", "image_url": {"url": "https://example.com/new.png"}},
+        ]},
+      ]
+
+      prepared = await cog.prepare_image_context(stored)
+
+      self.assertEqual(prepared[0]["content"][1], {"type": "text", "text": "[image: a cat on a desk]"})
+      self.assertEqual(prepared[1]["content"][1], {"type": "text", "text": "[image omitted]"})
+      self.assertEqual(prepared[1]["content"][2], {
+        "type": "image_url",
+        "image_url": {"url": "data:image/png;base64,AAAA", "detail": "low"},
+      })
+      self.assertEqual(stored[0]["content"][1]["type"], "image_url")
+
+    asyncio.run(run_test())
+
+  def test_image_descriptions_are_capped_per_reply_and_charged(self):
+    async def run_test():
+      calls = []
+      charged = []
+
+      class FakeProvider:
+        async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+          calls.append(messages[1].content[0]["image_url"]["url"])
+          return LLMResponse("a cat", [], "stop", None)
+
+      descriptions = {}
+
+      async def set_description(url, description):
+        descriptions[url] = description
+
+      async def reduce_stamina(amount):
+        charged.append(amount)
+
+      cog = fake_cog()
+      cog.image_describe = True
+      cog.image_description_tasks = {}
+      cog.image_cache = SimpleNamespace(description=descriptions.get, set_description=set_description)
+      cog.bot.meowgent = SimpleNamespace(provider=FakeProvider(), reduce_stamina=reduce_stamina)
+      images = {"https://x/a.png": "data:a", "https://x/b.png": "data:b"}
+
+      self.assertEqual(cog.schedule_image_descriptions(images, budget=0), 0)
+      self.assertEqual(cog.schedule_image_descriptions(images, budget=5), cog.IMAGE_DESCRIPTIONS_PER_REPLY)
+      await asyncio.gather(*cog.image_description_tasks.values())
+
+      self.assertEqual(calls, ["data:a"])
+      self.assertEqual(charged, [cog.IMAGE_DESCRIPTION_STAMINA])
+      self.assertEqual(descriptions, {"https://x/a.png": "a cat"})
+      # 説明文があるものは作り直さない
+      cog.schedule_image_descriptions(images, budget=5)
+      await asyncio.gather(*cog.image_description_tasks.values())
+      self.assertEqual(calls, ["data:a", "data:b"])
+
+    asyncio.run(run_test())
+
   def test_voice_notification_assistant_message_becomes_system(self):
     cog = fake_cog()
     message = fake_message(content="sotaがgeneralに入ったにゃ！")
@@ -116,6 +317,48 @@ class ConversationMessageTest(unittest.TestCase):
     self.assertEqual(conversation_message.content, "sotaがgeneralに入ったにゃ！")
 
 
+class ClassifyMessageTest(unittest.TestCase):
+  def test_uses_structured_mentions_and_references(self):
+    from cogs.events_cog import MESSAGE_CHAT, MESSAGE_DROP, MESSAGE_MENTION, MESSAGE_STORE
+
+    cog = fake_cog(bot_user_id=999)
+    bot_user = SimpleNamespace(id=999)
+    bot_message = SimpleNamespace(author=bot_user)
+
+    self.assertEqual(cog.classify_message(fake_message(mentions=[bot_user])), MESSAGE_MENTION)
+    # 本文にIDが含まれているだけではメンション扱いにしない
+    self.assertEqual(cog.classify_message(fake_message(content="id 999")), MESSAGE_CHAT)
+    reply = fake_message(reference=SimpleNamespace(message_id=5, resolved=bot_message), mentions=[bot_user])
+    # 待っていない (古い) botの発言への返信は、メンションとして返信する
+    self.assertEqual(cog.classify_message(reply), MESSAGE_MENTION)
+    cog.waiting_replies.add(5)
+    self.assertEqual(cog.classify_message(reply), MESSAGE_STORE)
+    self.assertEqual(cog.classify_message(fake_message(author_id=999)), MESSAGE_DROP)
+    self.assertEqual(cog.classify_message(fake_message(content="")), MESSAGE_DROP)
+
+  def test_drops_messages_from_channels_the_bot_cannot_send_to(self):
+    from cogs.events_cog import MESSAGE_DROP
+
+    cog = fake_cog()
+    checks = []
+
+    def permissions_for(member):
+      checks.append(member)
+      return SimpleNamespace(send_messages=False)
+
+    message = fake_message()
+    message.channel = SimpleNamespace(id=10, guild=SimpleNamespace(me="me"), permissions_for=permissions_for)
+    cog.to_conversation_message = lambda *args, **kwargs: self.fail("formatted a dropped message")
+
+    async def run_test():
+      await cog.on_message(message)
+      await cog.on_message(message)
+
+    asyncio.run(run_test())
+    self.assertEqual(cog.classify_message(message), MESSAGE_DROP)
+    self.assertEqual(checks, ["me"])
+
+
 class HistoryFetchDecisionTest(unittest.TestCase):
   def test_fetches_when_memory_is_empty_or_too_small(self):
     cog = fake_cog()
@@ -143,7 +386,7 @@ class HistoryFetchDecisionTest(unittest.TestCase):
   def test_fetches_when_bot_is_mentioned_and_memory_is_not_full(self):
     cog = fake_cog(bot_user_id=999)
     now = datetime(2026, 6, 5, tzinfo=timezone.utc)
-    message = fake_message(message_id=4, content="<@999> hi", created_at=now)
+    message = fake_message(message_id=4, content="<@999> hi", created_at=now, mentions=[SimpleNamespace(id=999)])
     memory_messages = [
       ConversationMessage(1, 10, 100, "sota", "user", "one", now),
       ConversationMessage(2, 10, 100, "sota", "user", "two", now),
@@ -214,6 +457,49 @@ class ConversationContextTest(unittest.TestCase):
     asyncio.run(run_test())
 
 
+class HistoryWarmTest(unittest.TestCase):
+  def test_warms_recent_channels_with_bounded_concurrency(self):
+    async def run_test():
+      import discord
+
+      cog = fake_cog()
+      cog.HISTORY_WARM_CONCURRENCY = 2
+      cog.HISTORY_WARM_INTERVAL = 0
+      now = datetime.now(timezone.utc)
+      active = {"current": 0, "max": 0}
+
+      def make_channel(channel_id, last_message_at):
+        channel = SimpleNamespace(
+          id=channel_id,
+          last_message_id=discord.utils.time_snowflake(last_message_at),
+        )
+        history_message = fake_message(message_id=channel_id * 10, channel_id=channel_id, content=f"hello {channel_id}")
+        history_message.channel = channel
+
+        async def history(limit):
+          active["current"] += 1
+          active["max"] = max(active["max"], active["current"])
+          await asyncio.sleep(0.01)
+          active["current"] -= 1
+          yield history_message
+
+        channel.history = history
+        return channel
+
+      recent_channels = [make_channel(channel_id, now - timedelta(minutes=channel_id)) for channel_id in range(1, 5)]
+      stale_channel = make_channel(99, now - timedelta(days=2))
+      cog.bot.guilds = [SimpleNamespace(text_channels=[*recent_channels, stale_channel])]
+
+      self.assertEqual([channel.id for channel in cog.select_channels_to_warm(now)], [1, 2, 3, 4])
+      await cog.warm_channel_history()
+
+      self.assertEqual(active["max"], 2)
+      self.assertEqual(cog.short_term_memory.get(1)[0].content, "sota:100 hello 1")
+      self.assertEqual(cog.short_term_memory.get(99), [])
+
+    asyncio.run(run_test())
+
+
 class CompressionTest(unittest.TestCase):
   def test_split_for_compression_keeps_latest_non_bot_message_and_later_messages(self):
     cog = fake_cog(bot_user_id=999)
@@ -292,6 +578,8 @@ class CompressionTest(unittest.TestCase):
         provider=provider,
         system_prompt="system prompt",
       )
+      cog.bot.meowgent.context_messages = lambda channel_id: Meowgent.context_messages(cog.bot.meowgent, channel_id)
+      cog.bot.meowgent.clock_timezones = ("Asia/Tokyo",)
       cog.short_term_memory.add(ConversationMessage(1, 10, 100, "sota", "user", "old", now - timedelta(minutes=2)))
       cog.short_term_memory.add(ConversationMessage(2, 10, 999, "bot", "assistant", "old bot", now - timedelta(minutes=1)))
       cog.short_term_memory.add(ConversationMessage(3, 10, 101, "nana", "user", "nana:101 latest", now))
@@ -311,6 +599,251 @@ class CompressionTest(unittest.TestCase):
       self.assertIn("Conversation summary before the latest user message:\nsummary", retry_contents)
       self.assertIn("nana:101 latest", retry_contents)
       self.assertNotIn("sota:100 old", retry_contents)
+      self.assertEqual(retry_contents[:2], ["system prompt", "current_channel_id: 10"])
+      self.assertTrue(retry_contents[2].startswith("current_time:"))
+
+    asyncio.run(run_test())
+
+  def test_idle_channels_are_summarized_once_in_the_background(self):
+    async def run_test():
+      class FakeProvider:
+        def __init__(self):
+          self.calls = []
+
+        async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+          self.calls.append(messages[-1].content)
+          return LLMResponse(f"summary {len(self.calls)}", [], "stop", None)
+
+      provider = FakeProvider()
+      cog = fake_cog(bot_user_id=999)
+      cog.bot.meowgent = Meowgent(provider=provider, tools=[], system_prompt="")
+      now = datetime(2026, 6, 5, 12, 0, tzinfo=timezone.utc)
+      idle = now - cog.SUMMARY_IDLE
+      for message_id in range(cog.SUMMARY_MIN_MESSAGES):
+        cog.short_term_memory.add(ConversationMessage(message_id, 10, 100, "sota", "user", f"idle {message_id}", idle - timedelta(minutes=message_id)))
+        cog.short_term_memory.add(ConversationMessage(100 + message_id, 11, 100, "sota", "user", f"active {message_id}", now))
+      cog.short_term_memory.add(ConversationMessage(200, 12, 100, "sota", "user", "short", idle))
+
+      self.assertEqual(cog.select_channels_to_summarize(now), [10])
+      await cog.summarize_channel(10, BackgroundLane(provider))
+      self.assertEqual(cog.summary_cache.get(10).text, "summary 1")
+      self.assertEqual(cog.bot.meowgent.stamina, cog.bot.meowgent.max_stamina - cog.SUMMARY_STAMINA)
+      self.assertEqual(cog.select_channels_to_summarize(now), [])
+
+      # 要約後に増えた分は前回の要約と合わせて要約し直す
+      cog.short_term_memory.add(ConversationMessage(50, 10, 101, "nana", "user", "later", idle))
+      self.assertEqual(cog.select_channels_to_summarize(now), [10])
+      await cog.summarize_channel(10, BackgroundLane(provider))
+      self.assertIn("summary 1", provider.calls[1])
+      self.assertIn("later", provider.calls[1])
+      self.assertNotIn("idle 0", provider.calls[1])
+      self.assertEqual(cog.summary_cache.get(10).last_message_id, 50)
+
+      # スタミナが減っている間は要約しない
+      cog.short_term_memory.add(ConversationMessage(51, 10, 101, "nana", "user", "even later", idle))
+      cog.bot.meowgent.stamina = 10
+      await cog.summarize_channel(10, BackgroundLane(provider))
+      self.assertEqual(len(provider.calls), 2)
+
+    asyncio.run(run_test())
+
+  def test_background_summaries_are_not_started_in_worker_mode(self):
+    async def run_test():
+      cog = fake_cog(bot_user_id=999)
+      cog.bot.guilds = []
+      cog.history_warm_task = object()
+      cog.background_summaries = False
+
+      await cog.on_ready()
+
+      self.assertIsNone(cog.summary_task)
+
+    asyncio.run(run_test())
+
+  def test_length_retries_reuse_and_extend_the_previous_summary(self):
+    async def run_test():
+      class FakeProvider:
+        def __init__(self):
+          self.calls = []
+
+        async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+          self.calls.append(messages[1].content)
+          return LLMResponse(f"summary {len(self.calls)}", [], "stop", None)
+
+      provider = FakeProvider()
+      cog = fake_cog(bot_user_id=999)
+      cog.bot.meowgent = SimpleNamespace(provider=provider)
+      now = datetime(2026, 6, 5, 12, 0, tzinfo=timezone.utc)
+      messages = [
+        ConversationMessage(1, 10, 100, "sota", "user", "sota:100 old", now),
+        ConversationMessage(2, 10, 999, "bot", "assistant", "old bot", now + timedelta(minutes=1)),
+        ConversationMessage(3, 10, 101, "nana", "user", "nana:101 question", now + timedelta(minutes=2)),
+        ConversationMessage(4, 10, 999, "bot", "assistant", "answer", now + timedelta(minutes=3)),
+        ConversationMessage(5, 10, 101, "nana", "user", "nana:101 latest", now + timedelta(minutes=4)),
+      ]
+
+      first = await cog.build_compressed_retry_context(messages[:3])
+      self.assertEqual(first[0]["content"], "Conversation summary before the latest user message:\nsummary 1")
+      self.assertEqual(cog.summary_cache.get(10).last_message_id, 2)
+
+      # 同じ範囲ならモデルを呼ばずに使い回す
+      await cog.build_compressed_retry_context(messages[:3])
+      self.assertEqual(len(provider.calls), 1)
+
+      # 増えた分だけを前回の要約と合わせて要約する
+      second = await cog.build_compressed_retry_context(messages)
+      self.assertIn("summary 1", provider.calls[1])
+      self.assertIn("nana:101 question", provider.calls[1])
+      self.assertNotIn("sota:100 old", provider.calls[1])
+      self.assertEqual(
+        [message["content"] for message in second],
+        ["Conversation summary before the latest user message:\nsummary 2", "nana:101 latest"],
+      )
+      self.assertEqual(cog.summary_cache.get(10).last_message_id, 4)
+
+    asyncio.run(run_test())
+
+  def test_retries_share_one_provider_call_budget(self):
+    async def run_test():
+      class ToolCallingApp:
+        def __init__(self):
+          self.budgets = []
+
+        async def ainvoke(self, state, config=None):
+          budget = config["configurable"]["max_provider_calls"]
+          self.budgets.append(budget)
+          tool_call = {"id": "1", "type": "function", "function": {"name": "search", "arguments": "{}"}}
+          return {
+            "messages": [*state["messages"], LLMResponse(None, [tool_call], "tool_calls", None).to_message()],
+            "usage": {"provider_calls": min(5, budget)},
+          }
+
+      app = ToolCallingApp()
+      cog = fake_cog()
+      cog.bot.meowgent = SimpleNamespace(app=app)
+      cog.short_term_memory.add(ConversationMessage(1, 10, 100, "sota", "user", "sota:100 hi", datetime(2026, 6, 5, tzinfo=timezone.utc)))
+      message = fake_message(message_id=1, channel_id=10)
+      cog.should_fetch_discord_history = lambda *args: False
+
+      await cog.get_reply(message)
+
+      self.assertEqual(app.budgets, [cog.MAX_PROVIDER_CALLS_PER_REPLY, cog.MAX_PROVIDER_CALLS_PER_REPLY - 5])
+
+    asyncio.run(run_test())
+
+  def test_full_work_queue_is_answered_with_the_fallback(self):
+    async def run_test():
+      class FullQueueApp:
+        async def ainvoke(self, state, config=None):
+          raise WorkQueueFull("100 jobs are waiting")
+
+      cog = fake_cog()
+      cog.bot.meowgent = SimpleNamespace(app=FullQueueApp())
+      cog.short_term_memory.add(ConversationMessage(1, 10, 100, "sota", "user", "sota:100 hi", datetime(2026, 6, 5, tzinfo=timezone.utc)))
+      cog.should_fetch_discord_history = lambda *args: False
+
+      messages = await cog.get_reply(fake_message(message_id=1, channel_id=10))
+
+      self.assertEqual(messages[-1].role, "assistant")
+      self.assertEqual(messages[-1].content, cog.FAILURE_REPLY)
+
+    asyncio.run(run_test())
+
+  def test_length_retry_uses_the_app_provider(self):
+    async def run_test():
+      class LengthApp:
+        def __init__(self):
+          self.provider = SimpleNamespace(generate=self.generate)
+          self.generated = []
+
+        async def ainvoke(self, state, config=None):
+          return {
+            "messages": [*state["messages"], LLMResponse("cut", [], "length", None).to_message()],
+            "usage": {"provider_calls": 1},
+          }
+
+        async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+          self.generated.append(tools)
+          return LLMResponse("short answer", [], "stop", None)
+
+      app = LengthApp()
+      cog = fake_cog()
+      cog.bot.meowgent = SimpleNamespace(app=app, provider=None, context_messages=lambda channel_id: [])
+      cog.short_term_memory.add(ConversationMessage(1, 10, 100, "sota", "user", "sota:100 hi", datetime(2026, 6, 5, tzinfo=timezone.utc)))
+      cog.should_fetch_discord_history = lambda *args: False
+
+      messages = await cog.get_reply(fake_message(message_id=1, channel_id=10))
+
+      self.assertEqual(app.generated, [[]])
+      self.assertEqual(messages[-1].content, "short answer")
+
+    asyncio.run(run_test())
+
+
+class FakeTyping:
+  def __init__(self, channel):
+    self.channel = channel
+
+  async def __aenter__(self):
+    self.channel.typing_count += 1
+
+  async def __aexit__(self, *args):
+    return False
+
+
+class VoiceNotificationTest(unittest.TestCase):
+  def test_burst_of_joins_is_sent_as_one_message_with_one_typing(self):
+    async def run_test():
+      import discord
+
+      sends = []
+      notification_channel = SimpleNamespace(id=50, name="general", type=discord.ChannelType.text, typing_count=0)
+      notification_channel.typing = lambda: FakeTyping(notification_channel)
+      guild = SimpleNamespace(id=1, name="guild", channels=[notification_channel])
+      voice = SimpleNamespace(name="vc", guild=guild)
+      scans = []
+
+      class Channels(list):
+        def __iter__(self):
+          scans.append(1)
+          return super().__iter__()
+
+      guild.channels = Channels(guild.channels)
+      notification_channel.guild = guild
+
+      async def send(channel, content, **kwargs):
+        sends.append(content)
+        return fake_message(message_id=len(sends), channel_id=channel.id, author_id=999, content=content)
+
+      cog = fake_cog()
+      cog.bot.outbound = SimpleNamespace(send=send)
+      cog.voice_notification_enabled = True
+      cog.join_message = "{name}が{channel}に入ったにゃ！"
+      cog.leave_message = "{name}が{channel}からきえてくにゃ・・・"
+      cog.notification_channel_name = "general"
+      cog.notification_channels = {}
+      cog.pending_voice_notifications = {}
+      cog.voice_notification_tasks = {}
+      cog.VOICE_NOTIFICATION_WINDOW = 0.01
+
+      empty = SimpleNamespace(channel=None)
+      joined = SimpleNamespace(channel=voice)
+      for member_id in range(20):
+        member = SimpleNamespace(id=member_id, nick=None, name=f"user{member_id}")
+        await cog.on_voice_state_update(member, empty, joined)
+      await cog.on_voice_state_update(SimpleNamespace(id=0, nick=None, name="user0"), joined, empty)
+      await asyncio.gather(*cog.voice_notification_tasks.values())
+
+      self.assertEqual(len(sends), 1)
+      self.assertEqual(notification_channel.typing_count, 1)
+      self.assertEqual(len(scans), 1)
+      lines = sends[0].splitlines()
+      self.assertEqual(len(lines), 20)
+      self.assertEqual(lines[-1], "user0がvcからきえてくにゃ・・・")
+      self.assertEqual(cog.short_term_memory.get(50)[0].role, "system")
+
+      await cog.on_guild_channel_update(notification_channel, notification_channel)
+      self.assertEqual(cog.notification_channels, {})
 
     asyncio.run(run_test())
 
@@ -0,0 +1,36 @@
+import sys
+import unittest
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from meowgent import Meowgent
+from tools.get_current_time import clock_context, get_current_time, get_timezone
+
+
+class ClockContextTest(unittest.TestCase):
+  def test_formats_configured_zones_and_skips_unknown_ones(self):
+    now = datetime(2026, 6, 5, 3, 4, 5, tzinfo=timezone.utc)
+
+    text = clock_context(["Asia/Tokyo", "Nowhere/Unknown", "Etc/UTC"], now=now)
+
+    self.assertEqual(text, "current_time:\nAsia/Tokyo: 2026-06-05 12:04:05 JST+0900\nEtc/UTC: 2026-06-05 03:04:05 UTC+0000")
+    self.assertEqual(clock_context([]), "")
+
+  def test_timezones_are_cached(self):
+    self.assertIs(get_timezone("Asia/Tokyo"), get_timezone("Asia/Tokyo"))
+    self.assertEqual(get_current_time("Nowhere/Unknown"), {"error": "Unknown timezone: Nowhere/Unknown"})
+
+  def test_meowgent_puts_the_clock_in_the_system_context(self):
+    meowgent = Meowgent(provider=object(), tools=[], system_prompt="prompt", clock_timezones=["Asia/Tokyo"])
+
+    messages = meowgent.context_messages(10)
+
+    self.assertEqual([message.content for message in messages[:2]], ["prompt", "current_channel_id: 10"])
+    self.assertTrue(messages[2].content.startswith("current_time:\nAsia/Tokyo: "))
+    self.assertEqual(len(Meowgent(provider=object(), tools=[], system_prompt="").context_messages(10)), 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,105 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from image_cache import ImageCache, cache_key, choose_details, estimate_image_tokens, image_size, thumbnail_url
+
+
+class FakeFetcher:
+  def __init__(self, payloads):
+    self.payloads = payloads
+    self.calls = []
+
+  async def __call__(self, url):
+    self.calls.append(url)
+    return self.payloads[cache_key(url)], "image/png"
+
+
+class ImageHelpersTest(unittest.TestCase):
+  def test_thumbnail_url_scales_to_max_side_and_keeps_signature(self):
+    attachment = SimpleNamespace(
+      url="https://cdn.discordapp.com/a/1/cat.png?ex=1&hm=abc",
+      proxy_url="https://media.discordapp.net/a/1/cat.png?ex=1&hm=abc",
+      width=4000,
+      height=2000,
+    )
+
+    url = thumbnail_url(attachment, 1000)
+
+    self.assertTrue(url.startswith("https://media.discordapp.net/a/1/cat.png?"))
+    self.assertIn("hm=abc", url)
+    self.assertEqual(image_size(url), (1000, 500))
+
+  def test_cache_key_ignores_changing_signatures(self):
+    first = "https://media.discordapp.net/a/1/cat.png?ex=1&hm=abc&width=10&height=5"
+    second = "https://media.discordapp.net/a/1/cat.png?ex=2&hm=def&width=10&height=5"
+
+    self.assertEqual(cache_key(first), cache_key(second))
+
+  def test_newest_images_get_high_detail_within_budget(self):
+    high = estimate_image_tokens((512, 512), "high")
+
+    details = choose_details([(512, 512), (512, 512), (512, 512)], budget=high + 85)
+
+    self.assertEqual(details, [None, "low", "high"])
+
+
+class ImageCacheTest(unittest.TestCase):
+  def test_fetches_once_and_stores_by_content(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        fetcher = FakeFetcher({cache_key("https://x/a.png"): b"same", cache_key("https://x/b.png"): b"same"})
+        cache = ImageCache(directory, max_bytes=1024, fetcher=fetcher)
+
+        first = await cache.data_url("https://x/a.png?hm=1")
+        again = await cache.data_url("https://x/a.png?hm=2")
+        await cache.data_url("https://x/b.png")
+
+        self.assertEqual(first, "data:image/png;base64,c2FtZQ==")
+        self.assertEqual(again, first)
+        self.assertEqual(len(fetcher.calls), 2)
+        self.assertEqual(len([path for path in Path(directory).iterdir() if path.name != "index.json"]), 1)
+
+    asyncio.run(run_test())
+
+  def test_evicts_least_recently_used_but_keeps_descriptions(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        fetcher = FakeFetcher({cache_key(f"https://x/{name}.png"): name.encode() * 10 for name in "abc"})
+        cache = ImageCache(directory, max_bytes=25, fetcher=fetcher)
+
+        await cache.data_url("https://x/a.png")
+        await cache.set_description("https://x/a.png", "a cat")
+        await cache.data_url("https://x/b.png")
+        await cache.data_url("https://x/c.png")
+
+        self.assertLessEqual(cache.total_bytes, 25)
+        reloaded = ImageCache(directory, max_bytes=25, fetcher=fetcher)
+        self.assertEqual(reloaded.description("https://x/a.png?hm=2"), "a cat")
+        await reloaded.data_url("https://x/a.png")
+        self.assertEqual(fetcher.calls.count("https://x/a.png"), 2)
+
+    asyncio.run(run_test())
+
+  def test_creates_the_directory_on_first_write_and_keeps_every_description(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "cache"
+        cache = ImageCache(path, max_bytes=1024, fetcher=FakeFetcher({}))
+        self.assertFalse(path.exists())
+
+        await asyncio.gather(*(cache.set_description(f"https://x/{index}.png", f"image {index}") for index in range(20)))
+
+        reloaded = ImageCache(path, max_bytes=1024)
+        self.assertEqual([reloaded.description(f"https://x/{index}.png") for index in range(20)], [f"image {index}" for index in range(20)])
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,53 @@
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from config import ShardingConfig
+from launcher import BOT_PATH, WORKER_PATH, build_children, child_environment, split_shards
+
+
+class SplitShardsTest(unittest.TestCase):
+  def test_distributes_shards_round_robin(self):
+    self.assertEqual(split_shards(5, 2), [[0, 2, 4], [1, 3]])
+
+  def test_never_starts_more_processes_than_shards(self):
+    self.assertEqual(split_shards(2, 8), [[0], [1]])
+
+  def test_child_environment_selects_the_shard_group(self):
+    env = child_environment(4, [1, 3], 1)
+
+    self.assertEqual(env["AUTO_SHARD"], "true")
+    self.assertEqual(env["SHARD_COUNT"], "4")
+    self.assertEqual(env["SHARD_IDS"], "1,3")
+    self.assertEqual(env["SHARD_GROUP"], "1")
+    self.assertNotIn("WORKER_MODE", env)
+
+  def test_workers_are_started_per_shard_group(self):
+    children = build_children(2, [[0], [1]], workers=2)
+
+    self.assertEqual(
+      sorted(children),
+      ["shard-group-0", "shard-group-1", "worker-0-0", "worker-0-1", "worker-1-0", "worker-1-1"],
+    )
+    self.assertEqual(children["shard-group-1"][0], BOT_PATH)
+    self.assertEqual(children["worker-1-0"][0], WORKER_PATH)
+    self.assertEqual(children["worker-1-0"][1]["SHARD_IDS"], "1")
+    self.assertEqual(children["worker-1-0"][1]["WORKER_MODE"], "true")
+
+
+class ShardingConfigTest(unittest.TestCase):
+  def test_partition_path_is_unchanged_for_the_first_group(self):
+    config = ShardingConfig(enabled=True, shard_count=4, shard_ids=[0, 2], group=0)
+
+    self.assertEqual(config.partition_path("jobs.sqlite"), "jobs.sqlite")
+
+  def test_partition_path_is_suffixed_for_other_groups(self):
+    config = ShardingConfig(enabled=True, shard_count=4, shard_ids=[1, 3], group=1)
+
+    self.assertEqual(config.partition_path("state/jobs.sqlite"), "state/jobs.shard1.sqlite")
+
+
+if __name__ == "__main__":
+  unittest.main()
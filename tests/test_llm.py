@@ -0,0 +1,174 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from llm import LLMMessage, LLMResponse, ToolDefinition
+from meowgent import Meowgent
+from metrics import TOOL_RESULT_TOKENS_SAVED
+
+
+def search_tool(**kwargs):
+  return ToolDefinition(
+    name="search",
+    description="Search.",
+    parameters={"type": "object", "properties": {}},
+    handler=lambda: None,
+    **kwargs,
+  )
+
+
+class ToolResultEncodingTest(unittest.TestCase):
+  def test_projects_fields_and_encodes_compactly(self):
+    tool = search_tool(result_fields=("title", "link"))
+
+    text, truncated = tool.encode_result([{"title": "猫", "link": "https://x", "thumbnail": "https://t", "position": 1}])
+
+    self.assertEqual(text, '[{"title":"猫","link":"https://x"}]')
+    self.assertFalse(truncated)
+
+  def test_drops_trailing_items_before_cutting_text(self):
+    tool = search_tool(result_budget=40)
+
+    text, truncated = tool.encode_result([{"snippet": "a" * 10}, {"snippet": "b" * 10}, {"snippet": "c" * 10}])
+
+    self.assertEqual(text, '[{"snippet":"aaaaaaaaaa"}]')
+    self.assertFalse(truncated)
+
+  def test_cuts_text_over_budget(self):
+    text, truncated = search_tool(result_budget=5).encode_result("abcdefgh")
+
+    self.assertEqual(text, "abcde…(truncated 3 chars)")
+    self.assertTrue(truncated)
+
+
+class LLMMessageTest(unittest.TestCase):
+  def test_request_dict_is_cached_until_the_message_changes(self):
+    message = LLMMessage(role="assistant", content="draft")
+    first = message.to_openai()
+
+    self.assertIs(message.to_openai(), first)
+    message.content = "final"
+    self.assertEqual(message.to_openai()["content"], "final")
+
+
+class MeowgentToolResultTest(unittest.TestCase):
+  def test_messages_are_slotted_and_round_trip_through_the_work_queue(self):
+    from work_queue import deserialize_messages, serialize_messages
+
+    message = LLMMessage(role="user", content="hi")
+    message.to_openai()
+
+    self.assertFalse(hasattr(message, "__dict__"))
+    self.assertEqual(message["content"], "hi")
+    self.assertEqual(deserialize_messages(serialize_messages([message])), [message])
+
+  def test_tool_message_uses_compact_encoding_and_reports_savings(self):
+    class FakeProvider:
+      def __init__(self):
+        self.calls = 0
+
+      async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+        self.calls += 1
+        if self.calls == 1:
+          return LLMResponse(None, [{"id": "1", "type": "function", "function": {"name": "search", "arguments": "{}"}}], "tool_calls", None)
+        return LLMResponse("done", [], "stop", None)
+
+    tool = search_tool(result_fields=("title",))
+    tool.handler = lambda: [{"title": "meowgent", "snippet": "x" * 200}]
+    saved = TOOL_RESULT_TOKENS_SAVED.labels("search")
+    before = saved.value
+    meowgent = Meowgent(provider=FakeProvider(), tools=[tool], system_prompt="")
+
+    final_state = asyncio.run(meowgent.ainvoke({"messages": [], "current_channel_id": 1}))
+
+    tool_message = final_state["messages"][1]
+    self.assertEqual(tool_message.content, '[{"title":"meowgent"}]')
+    self.assertGreater(saved.value, before)
+
+
+class ScriptedProvider:
+  """Return a tool call for every request that allows tools."""
+
+  def __init__(self, arguments=lambda call: "{}"):
+    self.arguments = arguments
+    self.tool_choices = []
+
+  async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+    self.tool_choices.append(tool_choice)
+    if tool_choice == "none":
+      return LLMResponse("answer", [], "stop", None)
+    call = len(self.tool_choices)
+    function = {"name": "search", "arguments": self.arguments(call)}
+    return LLMResponse(None, [{"id": str(call), "type": "function", "function": function}], "tool_calls", None)
+
+
+class MeowgentLoopTest(unittest.TestCase):
+  def run_agent(self, provider, tool, configurable=None):
+    meowgent = Meowgent(provider=provider, tools=[tool], system_prompt="")
+    state = asyncio.run(meowgent.ainvoke(
+      {"messages": [], "current_channel_id": 1},
+      config={"configurable": configurable or {}},
+    ))
+    return meowgent, state
+
+  def test_last_iteration_disables_tools(self):
+    provider = ScriptedProvider(arguments=lambda call: f'{{"page": {call}}}')
+    calls = []
+    tool = search_tool()
+    tool.handler = lambda page: calls.append(page) or "ok"
+
+    meowgent, state = self.run_agent(provider, tool, {"recursion_limit": 3})
+
+    self.assertEqual(provider.tool_choices, [None, None, "none"])
+    self.assertEqual(calls, [1, 2])
+    self.assertEqual(state["messages"][-1].content, "answer")
+    self.assertEqual(state["usage"]["provider_calls"], 3)
+    self.assertEqual(meowgent.stamina, meowgent.max_stamina - 15)
+
+  def test_repeated_tool_call_reuses_result_and_forces_answer(self):
+    provider = ScriptedProvider()
+    calls = []
+    tool = search_tool()
+    tool.handler = lambda: calls.append(1) or "ok"
+
+    _, state = self.run_agent(provider, tool, {"recursion_limit": 5})
+
+    self.assertEqual(provider.tool_choices, [None, None, "none"])
+    self.assertEqual(len(calls), 1)
+    self.assertEqual([message.content for message in state["messages"] if message.role == "tool"], ["ok", "ok"])
+
+  def test_provider_call_budget_caps_iterations(self):
+    provider = ScriptedProvider(arguments=lambda call: f'{{"page": {call}}}')
+    tool = search_tool()
+    tool.handler = lambda page: "ok"
+
+    _, state = self.run_agent(provider, tool, {"recursion_limit": 5, "max_provider_calls": 2})
+
+    self.assertEqual(provider.tool_choices, [None, "none"])
+    self.assertEqual(state["usage"]["provider_calls"], 2)
+
+  def test_sends_only_tools_relevant_to_the_latest_message(self):
+    class RecordingProvider:
+      def __init__(self):
+        self.tools = []
+
+      async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+        self.tools.append([tool.name for tool in tools])
+        return LLMResponse("answer", [], "stop", None)
+
+    provider = RecordingProvider()
+    remind_tool = search_tool(keywords=("remind",))
+    remind_tool.name = "remind"
+    meowgent = Meowgent(provider=provider, tools=[search_tool(keywords=("search",)), remind_tool], system_prompt="")
+
+    for content in ("hello", "please search for cats"):
+      asyncio.run(meowgent.ainvoke({"messages": [{"role": "user", "content": content}], "current_channel_id": 1}))
+
+    self.assertEqual(provider.tools, [["search", "remind"], ["search"]])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,89 @@
+import io
+import json
+import logging
+import sys
+import time
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from logging_setup import JsonFormatter, LazyPayload, LazyQueueHandler, redact, setup_logging, stop_logging
+
+
+class RedactTest(unittest.TestCase):
+  def test_truncates_long_payloads_with_a_hash(self):
+    text = "a" * 50
+
+    redacted = redact(text, 10)
+
+    self.assertTrue(redacted.startswith("a" * 10 + "…(+40 chars, sha256:"))
+    self.assertEqual(redacted, redact(text, 10))
+
+  def test_masks_inline_images_and_api_keys(self):
+    image = "data:image/png;base64," + "A" * 200
+    redacted = redact(f"look {image} key=sk-abcdefgh12345678901234", 0)
+
+    self.assertNotIn("A" * 64, redacted)
+    self.assertIn("data:image/png;base64,<", redacted)
+    self.assertIn("sk-abcdefgh***", redacted)
+
+
+class LazyQueueHandlerTest(unittest.TestCase):
+  def test_prepare_keeps_arguments_unformatted(self):
+    calls = []
+    payload = LazyPayload(lambda: calls.append(1) or "rendered")
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "payload: %s", (payload,), None)
+
+    prepared = LazyQueueHandler(None).prepare(record)
+
+    self.assertEqual(calls, [])
+    self.assertEqual(prepared.getMessage(), "payload: rendered")
+
+  def test_prepare_snapshots_mutable_arguments(self):
+    contents = ["hello"]
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "%s %d", (contents, 3), None)
+
+    prepared = LazyQueueHandler(None).prepare(record)
+    contents.append("changed later")
+
+    self.assertEqual(prepared.getMessage(), "['hello'] 3")
+
+
+class JsonFormatterTest(unittest.TestCase):
+  def test_formats_structured_record_with_extra_fields(self):
+    record = logging.LogRecord("meowgent", logging.WARNING, __file__, 1, "hello %s", ("x" * 20,), None)
+    record.channel_id = 10
+
+    payload = json.loads(JsonFormatter(max_length=8).format(record))
+
+    self.assertEqual(payload["level"], "WARNING")
+    self.assertEqual(payload["logger"], "meowgent")
+    self.assertEqual(payload["channel_id"], 10)
+    self.assertTrue(payload["msg"].startswith("hello xx…"))
+
+
+class SetupLoggingTest(unittest.TestCase):
+  def test_records_are_written_by_the_listener_thread(self):
+    root = logging.getLogger()
+    previous_handlers, previous_level = list(root.handlers), root.level
+    stream = io.StringIO()
+    setup_logging("INFO", "json", 100, stream=stream)
+    try:
+      logging.getLogger("meowgent.test").info("queued %d", 1)
+      deadline = time.monotonic() + 2
+      while not stream.getvalue() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    finally:
+      stop_logging()
+      for handler in list(root.handlers):
+        root.removeHandler(handler)
+      for handler in previous_handlers:
+        root.addHandler(handler)
+      root.setLevel(previous_level)
+
+    self.assertEqual(json.loads(stream.getvalue())["msg"], "queued 1")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,54 @@
+import asyncio
+import sys
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from loop_monitor import LoopMonitor, install_event_loop
+
+
+def blocking_tool():
+  time.sleep(0.3)
+
+
+class LoopMonitorTest(unittest.TestCase):
+  def test_records_stall_with_the_blocking_stack(self):
+    async def run_test():
+      monitor = LoopMonitor(threshold=0.15, interval=0.02).start()
+      await asyncio.sleep(0.05)
+      blocking_tool()
+      await asyncio.sleep(0.05)
+      monitor.stop()
+      return monitor
+
+    with self.assertLogs("loop_monitor", level="WARNING"):
+      monitor = asyncio.run(run_test())
+
+    self.assertEqual(len(monitor.stalls), 1)
+    self.assertGreaterEqual(monitor.stalls[0].duration, 0.15)
+    self.assertIn("blocking_tool", monitor.stalls[0].stack)
+
+  def test_no_stall_when_loop_keeps_running(self):
+    async def run_test():
+      monitor = LoopMonitor(threshold=0.15, interval=0.02).start()
+      await asyncio.sleep(0.2)
+      monitor.stop()
+      return monitor
+
+    self.assertEqual(len(asyncio.run(run_test()).stalls), 0)
+
+
+class InstallEventLoopTest(unittest.TestCase):
+  def test_falls_back_to_asyncio_without_uvloop(self):
+    with mock.patch.dict(sys.modules, {"uvloop": None}), self.assertLogs("loop_monitor", level="WARNING"):
+      self.assertEqual(install_event_loop("uvloop"), "asyncio")
+
+  def test_default_loop_is_left_alone(self):
+    self.assertEqual(install_event_loop("asyncio"), "asyncio")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,65 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from metrics import MetricsRegistry, start_metrics_server
+
+
+class MetricsRegistryTest(unittest.TestCase):
+  def test_renders_prometheus_text_format(self):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["finish_reason"])
+    depth = registry.gauge("queue_depth", "Depth.")
+    latency = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+    requests.labels("stop").inc()
+    requests.labels(finish_reason="stop").inc(2)
+    requests.labels('len"gth').inc()
+    depth.set_function(lambda: 7)
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(3)
+
+    text = registry.render()
+
+    self.assertIn("# TYPE requests_total counter", text)
+    self.assertIn('requests_total{finish_reason="stop"} 3', text)
+    self.assertIn('requests_total{finish_reason="len\\"gth"} 1', text)
+    self.assertIn("queue_depth 7", text)
+    self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+    self.assertIn('latency_seconds_bucket{le="1"} 2', text)
+    self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+    self.assertIn("latency_seconds_count 3", text)
+    self.assertIn("latency_seconds_sum 3.55", text)
+
+  def test_rejects_wrong_label_count(self):
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests.", ["finish_reason"])
+    with self.assertRaises(ValueError):
+      requests.inc()
+
+  def test_metrics_endpoint_serves_registry(self):
+    async def run_test():
+      from aiohttp import ClientSession
+
+      registry = MetricsRegistry()
+      registry.counter("hits_total", "Hits.").inc()
+      runner = await start_metrics_server("127.0.0.1", 0, registry)
+      try:
+        port = runner.addresses[0][1]
+        async with ClientSession() as session:
+          async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+            body = await response.text()
+      finally:
+        await runner.cleanup()
+
+      self.assertIn("hits_total 1", body)
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()
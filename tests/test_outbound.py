@@ -0,0 +1,108 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from outbound import PRIORITY_NOTIFICATION, PRIORITY_REPLY, OutboundQueue
+
+
+class FakeChannel:
+  def __init__(self, channel_id=10):
+    self.id = channel_id
+    self.sent = []
+
+  async def send(self, content, **kwargs):
+    self.sent.append(content)
+    return SimpleNamespace(id=len(self.sent), content=content)
+
+
+class OutboundQueueTest(unittest.TestCase):
+  def test_replies_jump_ahead_and_notifications_are_merged(self):
+    async def run_test():
+      queue = OutboundQueue()
+      queue.MESSAGE_RATE = (1, 0.05)
+      channel = FakeChannel()
+      message = SimpleNamespace(channel=channel, reply=lambda text: channel.send(f"reply:{text}"))
+
+      first = asyncio.create_task(queue.send(channel, "first"))
+      await asyncio.sleep(0)
+      notifications = [
+        asyncio.create_task(queue.send(channel, f"join {index}", priority=PRIORITY_NOTIFICATION, merge_key="voice"))
+        for index in range(3)
+      ]
+      reply = asyncio.create_task(queue.reply(message, "hi", priority=PRIORITY_REPLY))
+      results = await asyncio.gather(first, *notifications, reply)
+
+      self.assertEqual(channel.sent, ["first", "reply:hi", "join 0\njoin 1\njoin 2"])
+      self.assertEqual(len({id(result) for result in results[1:4]}), 1)
+      self.assertEqual(queue.pending_count(), 0)
+
+    asyncio.run(run_test())
+
+  def test_send_errors_are_raised_to_the_caller(self):
+    async def run_test():
+      queue = OutboundQueue()
+
+      class BrokenChannel(FakeChannel):
+        async def send(self, content, **kwargs):
+          raise RuntimeError("forbidden")
+
+      with self.assertRaises(RuntimeError):
+        await queue.send(BrokenChannel(), "hello")
+      sent = await queue.send(FakeChannel(), "after")
+      self.assertEqual(sent.content, "after")
+
+    asyncio.run(run_test())
+
+  def test_bucket_spaces_sends_per_channel(self):
+    async def run_test():
+      queue = OutboundQueue()
+      queue.MESSAGE_RATE = (2, 0.1)
+      channel = FakeChannel()
+      other_channel = FakeChannel(20)
+      loop = asyncio.get_running_loop()
+      started = loop.time()
+
+      await asyncio.gather(*(queue.send(channel, str(index)) for index in range(4)), queue.send(other_channel, "x"))
+
+      self.assertGreaterEqual(loop.time() - started, 0.09)
+      self.assertEqual(channel.sent, ["0", "1", "2", "3"])
+
+    asyncio.run(run_test())
+
+  def test_rate_limited_sends_wait_for_retry_after_and_are_retried(self):
+    async def run_test():
+      queue = OutboundQueue()
+
+      class RateLimitedChannel(FakeChannel):
+        def __init__(self):
+          super().__init__()
+          self.attempts = 0
+
+        async def send(self, content, **kwargs):
+          self.attempts += 1
+          if self.attempts == 1:
+            error = RuntimeError("429")
+            error.status = 429
+            error.response = SimpleNamespace(headers={"X-RateLimit-Reset-After": "0.05"})
+            raise error
+          return await super().send(content, **kwargs)
+
+      channel = RateLimitedChannel()
+      loop = asyncio.get_running_loop()
+      started = loop.time()
+
+      sent = await queue.send(channel, "hello")
+
+      self.assertEqual(sent.content, "hello")
+      self.assertEqual(channel.attempts, 2)
+      self.assertGreaterEqual(loop.time() - started, 0.04)
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,138 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from cogs.proposal_cog import Proposal, ProposalCog, ProposalStore
+
+
+def reaction(message_id, user_id, emoji):
+  return SimpleNamespace(message_id=message_id, user_id=user_id, emoji=emoji)
+
+
+class FakeOutbound:
+  def __init__(self):
+    self.edits = []
+    self.reactions = []
+
+  async def edit(self, message, **kwargs):
+    self.edits.append((message, kwargs))
+
+  async def add_reaction(self, message, emoji):
+    self.reactions.append((message, emoji))
+
+
+class ProposalTest(unittest.TestCase):
+  def test_one_vote_per_user(self):
+    proposal = Proposal(channel_id=1, title="t", description="d")
+
+    proposal.vote(10, "🆗")
+    proposal.vote(10, "🙅")
+    proposal.unvote(10, "🆗")
+    proposal.vote(11, "🙅")
+
+    self.assertEqual(proposal.counts["🆗"], 0)
+    self.assertEqual(proposal.counts["🙅"], 2)
+
+    proposal.unvote(10, "🙅")
+    self.assertEqual(proposal.counts["🙅"], 1)
+
+
+class ProposalCogTest(unittest.TestCase):
+  def test_votes_are_tallied_from_raw_events_and_edited_once_per_interval(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "proposals.json")
+        cog = ProposalCog.__new__(ProposalCog)
+        cog.EDIT_INTERVAL = 0.01
+        cog.store = ProposalStore(path)
+        cog.refresh_tasks = {}
+        channel = SimpleNamespace(get_partial_message=lambda message_id: f"message {message_id}")
+        cog.bot = SimpleNamespace(
+          user=SimpleNamespace(id=10**6),
+          outbound=FakeOutbound(),
+          get_channel=lambda channel_id: channel,
+        )
+        cog.store.add(5, Proposal(channel_id=1, title="t", description="d"))
+
+        for user_id in range(1000):
+          await cog.on_raw_reaction_add(reaction(5, user_id, "🆗" if user_id % 4 else "💢"))
+        await cog.on_raw_reaction_add(reaction(5, 10**6, "🆗"))
+        await cog.on_raw_reaction_add(reaction(5, 1, "🙈"))
+        await cog.on_raw_reaction_add(reaction(6, 1, "🆗"))
+        await asyncio.gather(*cog.refresh_tasks.values())
+
+        self.assertEqual(len(cog.bot.outbound.edits), 1)
+        message, kwargs = cog.bot.outbound.edits[0]
+        self.assertEqual(message, "message 5")
+        fields = {field.name: field.value for field in kwargs["embed"].fields}
+        self.assertEqual((fields["Yes"], fields["No with Veto"]), ("750", "250"))
+
+        reloaded = ProposalStore(path).get(5)
+        self.assertEqual(reloaded.counts["🆗"], 750)
+
+    asyncio.run(run_test())
+
+  def test_failed_edit_keeps_the_update_for_the_next_interval(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        cog = ProposalCog.__new__(ProposalCog)
+        cog.EDIT_INTERVAL = 0.01
+        cog.store = ProposalStore(str(Path(directory) / "proposals.json"))
+        cog.refresh_tasks = {}
+        outbound = FakeOutbound()
+        attempts = []
+
+        async def flaky_edit(message, **kwargs):
+          attempts.append(message)
+          if len(attempts) == 1:
+            raise RuntimeError("edit failed")
+          await FakeOutbound.edit(outbound, message, **kwargs)
+
+        outbound.edit = flaky_edit
+        channel = SimpleNamespace(get_partial_message=lambda message_id: f"message {message_id}")
+        cog.bot = SimpleNamespace(user=SimpleNamespace(id=10**6), outbound=outbound, get_channel=lambda channel_id: channel)
+        cog.store.add(5, Proposal(channel_id=1, title="t", description="d"))
+
+        await cog.on_raw_reaction_add(reaction(5, 1, "🆗"))
+        await asyncio.gather(*cog.refresh_tasks.values())
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(len(outbound.edits), 1)
+        self.assertFalse(cog.store.get(5).dirty)
+
+    asyncio.run(run_test())
+
+  def test_new_proposal_reactions_go_through_the_outbound_queue(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        cog = ProposalCog.__new__(ProposalCog)
+        cog.store = ProposalStore(str(Path(directory) / "proposals.json"))
+        cog.bot = SimpleNamespace(outbound=FakeOutbound())
+        message = SimpleNamespace(id=5)
+
+        async def defer():
+          pass
+
+        async def send(embed):
+          return message
+
+        interaction = SimpleNamespace(
+          channel_id=1,
+          response=SimpleNamespace(defer=defer),
+          followup=SimpleNamespace(send=send),
+        )
+        await ProposalCog.proposal.callback(cog, interaction, "t", "d")
+
+        self.assertEqual(cog.bot.outbound.reactions, [(message, emoji) for emoji in ["🆗", "🙅", "💤", "💢"]])
+        self.assertIsNotNone(cog.store.get(5))
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,34 @@
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from state_snapshot import load_snapshot, save_snapshot
+
+
+class StateSnapshotTest(unittest.TestCase):
+  def test_snapshot_is_read_once(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / "state.json"
+      save_snapshot(path, {"stamina": 42, "tasks": []})
+
+      state = load_snapshot(path)
+
+      self.assertEqual(state["stamina"], 42)
+      self.assertFalse(path.exists())
+      self.assertIsNone(load_snapshot(path))
+
+  def test_ignores_broken_snapshots(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / "state.json"
+      path.write_text("{")
+
+      with self.assertLogs("state_snapshot", level="WARNING"):
+        self.assertIsNone(load_snapshot(path))
+      self.assertFalse(path.exists())
+
+
+if __name__ == "__main__":
+  unittest.main()
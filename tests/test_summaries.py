@@ -0,0 +1,66 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from llm import LLMResponse
+from summaries import BackgroundLane, ChannelSummary, SummaryCache
+
+
+class BackgroundLaneTest(unittest.TestCase):
+  def test_limits_concurrency_and_waits_until_idle(self):
+    async def run_test():
+      active = {"now": 0, "max": 0}
+      busy = {"value": True}
+
+      class FakeProvider:
+        async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+          active["now"] += 1
+          active["max"] = max(active["max"], active["now"])
+          await asyncio.sleep(0.01)
+          active["now"] -= 1
+          return LLMResponse("ok", [], "stop", None)
+
+      lane = BackgroundLane(FakeProvider(), concurrency=2, is_busy=lambda: busy["value"], poll_interval=0.01)
+      tasks = [asyncio.create_task(lane.generate([])) for _ in range(5)]
+      await asyncio.sleep(0.05)
+      self.assertEqual(active["max"], 0)
+
+      busy["value"] = False
+      responses = await asyncio.gather(*tasks)
+
+      self.assertEqual(active["max"], 2)
+      self.assertEqual([response.content for response in responses], ["ok"] * 5)
+
+    asyncio.run(run_test())
+
+
+class SummaryCacheTest(unittest.TestCase):
+  def test_lookup_returns_messages_after_the_summary(self):
+    cache = SummaryCache()
+    messages = [SimpleNamespace(message_id=message_id) for message_id in range(4)]
+    cache.put(10, ChannelSummary(1, "summary"))
+
+    summary, uncovered = cache.lookup(10, messages)
+
+    self.assertEqual(summary, "summary")
+    self.assertEqual([message.message_id for message in uncovered], [2, 3])
+    self.assertIsNone(cache.lookup(10, messages[2:]))
+    self.assertIsNone(cache.lookup(11, messages))
+
+  def test_drops_least_recently_used_channels(self):
+    cache = SummaryCache(max_channels=2)
+    cache.put(1, ChannelSummary(1, "one"))
+    cache.put(2, ChannelSummary(2, "two"))
+    cache.lookup(1, [SimpleNamespace(message_id=1)])
+    cache.put(3, ChannelSummary(3, "three"))
+
+    self.assertIsNotNone(cache.get(1))
+    self.assertIsNone(cache.get(2))
+
+
+if __name__ == "__main__":
+  unittest.main()
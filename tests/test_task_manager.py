@@ -0,0 +1,192 @@
+import asyncio
+import json
+import sys
+import unittest
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from tools.registry import CURRENT_CHANNEL_ID
+from tools.task_manager import TaskManager, get_tools
+
+
+class ScheduledPromptBatchingTest(unittest.TestCase):
+  def test_prompts_for_the_same_channel_share_one_run(self):
+    async def run_test():
+      task_manager = TaskManager(batch_window=0.01)
+      runs = []
+
+      async def runner(channel_id, prompts):
+        runs.append((channel_id, prompts))
+        return {"provider_calls": 1, "prompt_tokens": 10, "completion_tokens": 5}
+
+      task_manager.set_prompt_runner(runner)
+      await asyncio.gather(
+        task_manager.run_prompt(10, "water"),
+        task_manager.run_prompt(10, "stretch"),
+        task_manager.run_prompt(20, "other channel"),
+      )
+
+      self.assertEqual(sorted(runs), [(10, ["water", "stretch"]), (20, ["other channel"])])
+      self.assertEqual(task_manager.stats.runs, 2)
+      self.assertEqual(task_manager.stats.prompts, 3)
+      self.assertEqual(task_manager.stats.batched_prompts, 1)
+      self.assertEqual(task_manager.stats.provider_calls, 2)
+      self.assertEqual(task_manager.stats.prompt_tokens, 20)
+
+    asyncio.run(run_test())
+
+  def test_failed_run_is_counted_and_does_not_raise(self):
+    async def run_test():
+      task_manager = TaskManager(batch_window=0)
+
+      async def runner(channel_id, prompts):
+        raise RuntimeError("boom")
+
+      task_manager.set_prompt_runner(runner)
+      await task_manager.run_prompt(10, "water")
+
+      self.assertEqual(task_manager.stats.failures, 1)
+      self.assertEqual(task_manager.stats.runs, 0)
+
+    asyncio.run(run_test())
+
+
+class RecurringTriggerTest(unittest.TestCase):
+  def test_requires_exactly_one_schedule(self):
+    async def run_test():
+      task_manager = TaskManager()
+      with self.assertRaises(ValueError):
+        task_manager.build_recurring_trigger()
+      with self.assertRaises(ValueError):
+        task_manager.build_recurring_trigger(interval_minutes=5, cron="0 9 * * *")
+      with self.assertRaises(ValueError):
+        task_manager.build_recurring_trigger(interval_minutes=0)
+
+    asyncio.run(run_test())
+
+  def test_rejects_schedules_shorter_than_the_minimum_interval(self):
+    async def run_test():
+      task_manager = TaskManager()
+      with self.assertRaises(ValueError):
+        task_manager.build_recurring_trigger(interval_minutes=1)
+      with self.assertRaises(ValueError):
+        task_manager.build_recurring_trigger(cron="* * * * *")
+      # 1日1回でも、続けて2回動くものは間隔で弾く
+      with self.assertRaises(ValueError):
+        task_manager.build_recurring_trigger(cron="0,5 9 * * *")
+      task_manager.build_recurring_trigger(interval_minutes=30)
+      task_manager.build_recurring_trigger(cron="*/30 * * * *")
+
+    asyncio.run(run_test())
+
+  def test_limits_the_number_of_tasks_per_channel(self):
+    async def run_test():
+      task_manager = TaskManager()
+      for index in range(task_manager.MAX_TASKS_PER_CHANNEL):
+        task_manager.add_recurring_prompt_task(10, f"task {index}", interval_minutes=60)
+
+      with self.assertRaises(ValueError):
+        task_manager.add_prompt_task(10, "one more", datetime.now() + timedelta(minutes=5))
+      task_manager.add_prompt_task(20, "other channel", datetime.now() + timedelta(minutes=5))
+
+    asyncio.run(run_test())
+
+  def test_tools_only_list_and_cancel_tasks_of_the_current_channel(self):
+    async def run_test():
+      task_manager = TaskManager()
+      own_id = task_manager.add_recurring_prompt_task(10, "water", interval_minutes=60)
+      other_id = task_manager.add_recurring_prompt_task(20, "morning", cron="0 9 * * *")
+      tools = {tool.name: tool for tool in get_tools({"task_manager": task_manager})}
+
+      token = CURRENT_CHANNEL_ID.set(10)
+      try:
+        listed = await tools["list_tasks"].ainvoke({"channel_id": 20})
+        cancel_other = await tools["cancel_task"].ainvoke({"task_id": other_id})
+        cancel_own = await tools["cancel_task"].ainvoke({"task_id": own_id})
+      finally:
+        CURRENT_CHANNEL_ID.reset(token)
+
+      self.assertEqual([task["task_id"] for task in listed], [own_id])
+      self.assertTrue(cancel_other.startswith("Error"))
+      self.assertTrue(cancel_own.startswith("Successfully"))
+      self.assertEqual([task["task_id"] for task in task_manager.list_tasks()], [other_id])
+
+    asyncio.run(run_test())
+
+  def test_recurring_tasks_can_be_listed_and_cancelled(self):
+    async def run_test():
+      task_manager = TaskManager()
+      interval_id = task_manager.add_recurring_prompt_task(10, "water", interval_minutes=60)
+      cron_id = task_manager.add_recurring_prompt_task(20, "morning", cron="0 9 * * *")
+
+      self.assertEqual([task["task_id"] for task in task_manager.list_tasks(10)], [interval_id])
+      self.assertTrue(task_manager.remove_task(cron_id))
+      self.assertFalse(task_manager.remove_task(cron_id))
+      self.assertEqual(len(task_manager.list_tasks()), 1)
+
+    asyncio.run(run_test())
+
+  def test_pending_tasks_survive_a_snapshot_and_restore(self):
+    async def run_test():
+      task_manager = TaskManager()
+      task_manager.add_recurring_prompt_task(10, "water", interval_minutes=60, task_id="water")
+      task_manager.add_recurring_prompt_task(20, "morning", cron="0 9 * * *", task_id="morning")
+      task_manager.add_prompt_task(30, "late", datetime.now() - timedelta(minutes=5), task_id="late")
+      snapshot = json.loads(json.dumps(task_manager.snapshot()))
+
+      restored = TaskManager()
+      self.assertEqual(restored.restore(snapshot), 3)
+
+      tasks = {task["task_id"]: task for task in restored.list_tasks()}
+      self.assertEqual(set(tasks), {"water", "morning", "late"})
+      self.assertEqual(tasks["morning"]["prompt"], "morning")
+      # 止まっている間に過ぎた予約は、すぐ実行されるように先送りする
+      self.assertGreater(restored.scheduler.get_job("late").trigger.run_date.replace(tzinfo=None), datetime.now())
+
+    asyncio.run(run_test())
+
+  def test_one_shot_task_is_forgotten_after_it_runs(self):
+    async def run_test():
+      async def runner(channel_id, prompts):
+        pass
+
+      task_manager = TaskManager(batch_window=0)
+      task_manager.set_prompt_runner(runner)
+      task_manager.add_prompt_task(30, "late", datetime.now() + timedelta(minutes=5), task_id="late")
+      task_manager.add_recurring_prompt_task(10, "water", interval_minutes=60, task_id="water")
+      job = task_manager.scheduler.get_job("late")
+
+      await job.func(*job.args, **job.kwargs)
+
+      self.assertNotIn("late", task_manager._task_specs)
+      self.assertIn("water", task_manager._task_specs)
+
+    asyncio.run(run_test())
+
+  def test_shutdown_waits_for_running_prompts(self):
+    async def run_test():
+      finished = []
+
+      async def runner(channel_id, prompts):
+        await asyncio.sleep(0.02)
+        finished.append(prompts)
+
+      task_manager = TaskManager(batch_window=0)
+      task_manager.set_prompt_runner(runner)
+      task_manager.start_scheduler()
+      running = asyncio.create_task(task_manager.run_prompt(10, "water"))
+      await asyncio.sleep(0)
+
+      await task_manager.shutdown(timeout=1)
+
+      self.assertEqual(finished, [["water"]])
+      self.assertFalse(task_manager.scheduler.running)
+      await running
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()
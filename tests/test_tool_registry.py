@@ -0,0 +1,115 @@
+import asyncio
+import sys
+import types
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from llm import LLMMessage, ToolDefinition
+from tools import web_search
+from tools.registry import ToolRegistry
+
+
+def tool(name, keywords=()):
+  return ToolDefinition(
+    name=name,
+    description=f"{name} tool.",
+    parameters={"type": "object", "properties": {}},
+    handler=lambda: name,
+    keywords=keywords,
+  )
+
+
+class ToolRegistryTest(unittest.TestCase):
+  def test_discovers_tool_modules_and_skips_tools_missing_their_context(self):
+    gateway = ToolRegistry(context={"task_manager": object()})
+    worker = ToolRegistry()
+
+    self.assertIn("tools.web_search", gateway.module_names())
+    self.assertNotIn("tools.registry", gateway.module_names())
+    self.assertIn("create_task", gateway.names())
+    self.assertEqual(sorted(worker.names()), ["get_current_time", "web_search"])
+
+  def test_selects_tools_by_keywords_and_previous_calls(self):
+    registry = ToolRegistry.from_tools([
+      tool("always"),
+      tool("search", keywords=("検索",)),
+      tool("remind", keywords=("remind",)),
+    ])
+    messages = [
+      LLMMessage(role="tool", content="ok", tool_call_id="1", name="remind"),
+      LLMMessage(role="user", content=[{"type": "text", "text": "猫について検索して"}]),
+    ]
+
+    self.assertEqual([item.name for item in registry.select(messages)], ["always", "search", "remind"])
+    self.assertEqual([item.name for item in registry.select(messages[1:])], ["always", "search"])
+    # 英語のキーワードは単語単位で、発言者の名前は見ない
+    self.assertEqual([item.name for item in registry.select([LLMMessage(role="user", content="remind:1 remind me")])], ["always", "remind"])
+    # どれにも当たらなければすべて送る
+    for content in ("hi", "remind:1 hi", "reminders are sometimes fun"):
+      self.assertEqual(len(registry.select([LLMMessage(role="user", content=content)])), 3)
+
+    registry.select_tools = False
+    self.assertEqual(len(registry.select(messages)), 3)
+
+  def test_loads_lazily_and_warms_and_closes_modules(self):
+    calls = []
+    module = types.ModuleType("fake_tool_module")
+    module.get_tools = lambda context: calls.append("load") or [tool("fake")]
+    module.warm = lambda: calls.append("warm")
+
+    async def close():
+      calls.append("close")
+
+    module.close = close
+    sys.modules["fake_tool_module"] = module
+    self.addCleanup(sys.modules.pop, "fake_tool_module")
+
+    async def run_test():
+      registry = ToolRegistry(modules=["fake_tool_module"])
+      self.assertEqual(calls, [])
+      # 最初のリクエストが warm() と重なっても読み込みは1回だけ
+      await asyncio.gather(registry.warm(), registry.aselect([]), registry.aselect([]))
+      self.assertEqual(registry.get("fake").handler(), "fake")
+      await registry.close()
+
+    asyncio.run(run_test())
+
+    self.assertEqual(calls, ["load", "warm", "close"])
+
+
+class WebSearchTest(unittest.TestCase):
+  def test_reuses_the_warmed_session_off_the_event_loop(self):
+    import threading
+
+    class FakeSession:
+      def __init__(self):
+        self.requests = []
+        self.closed = False
+
+      def get(self, url, params=None, timeout=None):
+        self.requests.append((params["p"], threading.current_thread()))
+        return types.SimpleNamespace(raise_for_status=lambda: None, json=lambda: {"organic_results": [{"title": params["p"]}]})
+
+      def close(self):
+        self.closed = True
+
+    session = FakeSession()
+    self.addCleanup(setattr, web_search, "_session", None)
+    web_search._session = session
+
+    async def run_test():
+      return [await web_search.web_search(query) for query in ("猫", "犬")]
+
+    results = asyncio.run(run_test())
+    web_search.close()
+
+    self.assertEqual(results, [[{"title": "猫"}], [{"title": "犬"}]])
+    self.assertNotIn(threading.main_thread(), [thread for _, thread in session.requests])
+    self.assertTrue(session.closed)
+    self.assertIsNone(web_search._session)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from tracing import ChromeTraceExporter, Tracer, current_span
+
+
+class MemoryExporter:
+  def __init__(self):
+    self.spans = []
+
+    self.closed = False
+
+  def export(self, span):
+    self.spans.append(span)
+
+  def close(self):
+    self.closed = True
+
+
+class TracerTest(unittest.TestCase):
+  def test_sampled_trace_records_nested_spans_across_awaits(self):
+    async def run_test():
+      tracer = Tracer()
+      exporter = MemoryExporter()
+      tracer.configure(exporter, sample_rate=1.0)
+
+      async def generate():
+        with tracer.span("llm.generate", model="mock") as span:
+          await asyncio.sleep(0)
+          span.set("finish_reason", "stop")
+
+      with tracer.span("events.reply", root=True, channel_id=10) as root:
+        self.assertIs(current_span(), root)
+        await asyncio.gather(generate(), generate())
+
+      self.assertEqual([span.name for span in exporter.spans], ["llm.generate", "llm.generate", "events.reply"])
+      children = exporter.spans[:2]
+      self.assertTrue(all(span.parent_id == root.span_id for span in children))
+      self.assertTrue(all(span.trace_id == root.trace_id for span in children))
+      self.assertEqual(children[0].attributes, {"model": "mock", "finish_reason": "stop"})
+      self.assertEqual(root.to_chrome_event()["ph"], "X")
+      self.assertIsNone(current_span())
+
+    asyncio.run(run_test())
+
+  def test_unsampled_traces_and_orphan_spans_are_not_recorded(self):
+    tracer = Tracer()
+    exporter = MemoryExporter()
+    tracer.configure(exporter, sample_rate=0.1)
+
+    with tracer.span("orphan") as orphan:
+      self.assertIsNone(orphan)
+    with mock.patch("tracing.random.random", return_value=0.5):
+      with tracer.span("events.reply", root=True):
+        # 対象外のトレースの中では新しいルートも始めない
+        with tracer.span("events.reply", root=True) as nested:
+          self.assertIsNone(nested)
+
+    self.assertEqual(exporter.spans, [])
+
+  def test_error_is_recorded_on_span(self):
+    tracer = Tracer()
+    exporter = MemoryExporter()
+    tracer.configure(exporter, sample_rate=1.0)
+
+    with self.assertRaises(RuntimeError):
+      with tracer.span("tool.ainvoke", root=True):
+        raise RuntimeError("boom")
+
+    self.assertEqual(exporter.spans[0].attributes["error"], "RuntimeError")
+
+  def test_close_flushes_the_exporter_and_stops_recording(self):
+    tracer = Tracer()
+    exporter = MemoryExporter()
+    tracer.configure(exporter, sample_rate=1.0)
+
+    with tracer.span("events.reply", root=True):
+      tracer.close()
+
+    self.assertTrue(exporter.closed)
+    self.assertFalse(tracer.enabled)
+    self.assertEqual([span.name for span in exporter.spans], ["events.reply"])
+    with tracer.span("events.reply", root=True) as span:
+      self.assertIsNone(span)
+
+  def test_chrome_exporter_writes_queued_spans_on_close(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = Path(directory) / "trace.json"
+      tracer = Tracer()
+      tracer.configure(ChromeTraceExporter(path), sample_rate=1.0)
+      for _ in range(100):
+        with tracer.span("events.reply", root=True):
+          pass
+
+      tracer.close()
+
+      self.assertEqual(path.read_text(encoding="utf-8").count('"events.reply"'), 100)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from llm import LLMResponse
+from meowgent import Meowgent
+from work_queue import RemoteMeowgentApp, RemoteProvider, WorkQueue, WorkQueueClient, WorkQueueError, WorkQueueFull
+from worker import run_worker
+
+
+class FakeProvider:
+  def __init__(self):
+    self.system_prompts = []
+
+  async def generate(self, messages, tools=None, max_tokens=None, tool_choice=None):
+    self.system_prompts.append(messages[0].content)
+    return LLMResponse(content="にゃ", tool_calls=[], finish_reason="stop", raw=None)
+
+
+class WorkQueueTest(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.path = str(Path(self.directory.name) / "queue.sqlite")
+
+  def tearDown(self):
+    self.directory.cleanup()
+
+  def test_claimed_job_result_is_returned_once(self):
+    queue = WorkQueue(self.path)
+    job_id = queue.enqueue("agent", {"value": 1})
+
+    job = queue.claim("worker-1")
+    self.assertEqual((job.id, job.payload, job.attempts), (job_id, {"value": 1}, 1))
+    self.assertIsNone(queue.claim("worker-2"))
+
+    queue.complete(job.id, {"ok": True})
+    self.assertEqual(queue.take_results([job_id]), {job_id: ("done", {"ok": True}, None)})
+    self.assertEqual(queue.take_results([job_id]), {})
+    queue.close()
+
+  def test_rejects_jobs_beyond_max_pending(self):
+    queue = WorkQueue(self.path, max_pending=1)
+    queue.enqueue("agent", {})
+
+    with self.assertRaises(WorkQueueFull):
+      queue.enqueue("agent", {})
+    queue.close()
+
+  def test_expired_lease_is_reclaimed_then_failed(self):
+    queue = WorkQueue(self.path, lease_seconds=10, max_attempts=2)
+    job_id = queue.enqueue("agent", {})
+    now = 1000.0
+
+    with mock.patch("work_queue.time.time", side_effect=lambda: now):
+      self.assertEqual(queue.claim("crashed").attempts, 1)
+      now += 11
+      self.assertEqual(queue.claim("worker-2").attempts, 2)
+      now += 11
+      self.assertIsNone(queue.claim("worker-3"))
+
+    self.assertEqual(queue.take_results([job_id]), {job_id: ("failed", None, "lease expired")})
+    queue.close()
+
+
+class RemoteMeowgentAppTest(unittest.TestCase):
+  def test_agent_runs_in_worker_and_stamina_is_charged_on_gateway(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "queue.sqlite")
+        gateway_queue = WorkQueue(path)
+        worker_queue = WorkQueue(path)
+        gateway = Meowgent(provider=FakeProvider(), tools=[], system_prompt="gateway prompt")
+        worker_provider = FakeProvider()
+        worker = Meowgent(provider=worker_provider, tools=[], system_prompt="worker prompt")
+        stop = asyncio.Event()
+        worker_task = asyncio.create_task(run_worker(worker_queue, worker, poll_interval=0.01, stop=stop))
+
+        app = RemoteMeowgentApp(gateway, WorkQueueClient(gateway_queue, poll_interval=0.01), timeout=5)
+        final_state = await app.ainvoke({
+          "messages": [{"role": "user", "content": "こんにちは"}],
+          "current_channel_id": 1,
+        })
+
+        stop.set()
+        await worker_task
+        gateway_queue.close()
+        worker_queue.close()
+
+      self.assertEqual([message.content for message in final_state["messages"]], ["こんにちは", "にゃ"])
+      self.assertEqual(worker_provider.system_prompts, ["gateway prompt"])
+      self.assertEqual(gateway.stamina, gateway.max_stamina - 5)
+
+    asyncio.run(run_test())
+
+  def test_single_generate_calls_run_in_the_worker(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        path = str(Path(directory) / "queue.sqlite")
+        gateway_queue = WorkQueue(path)
+        worker_queue = WorkQueue(path)
+        worker_provider = FakeProvider()
+        worker = Meowgent(provider=worker_provider, tools=[], system_prompt="worker prompt")
+        stop = asyncio.Event()
+        worker_task = asyncio.create_task(run_worker(worker_queue, worker, poll_interval=0.01, stop=stop))
+
+        provider = RemoteProvider(WorkQueueClient(gateway_queue, poll_interval=0.01), timeout=5)
+        response = await provider.generate([{"role": "system", "content": "summarize"}], tools=[], max_tokens=50)
+
+        stop.set()
+        await worker_task
+        gateway_queue.close()
+        worker_queue.close()
+
+      self.assertEqual((response.content, response.finish_reason), ("にゃ", "stop"))
+      self.assertEqual(worker_provider.system_prompts, ["summarize"])
+
+    asyncio.run(run_test())
+
+  def test_failed_job_raises_on_gateway(self):
+    async def run_test():
+      with tempfile.TemporaryDirectory() as directory:
+        queue = WorkQueue(str(Path(directory) / "queue.sqlite"))
+        client = WorkQueueClient(queue, poll_interval=0.01)
+        submit = asyncio.create_task(client.submit("agent", {}))
+        await asyncio.sleep(0.05)
+        job = queue.claim("worker")
+        queue.fail(job.id, "boom")
+
+        with self.assertRaises(WorkQueueError):
+          await submit
+        queue.close()
+
+    asyncio.run(run_test())
+
+
+if __name__ == "__main__":
+  unittest.main()